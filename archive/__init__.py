@@ -1,10 +1,11 @@
+import concurrent.futures
 import logging
-import filetype
 import json
 import os
 import shutil
 
-from .constants import CFG_NAME
+from .constants import CFG_NAME, PACKED_NAME_PREFIX, PACKED_NAME_SUFFIX
+from .detection import FileTypeCache, detect_archive_type
 from .handlers import *
 
 ARCHIVE_HANDLERS = {
@@ -22,34 +23,151 @@ def get_archive_handler(mime_type):
     
     return ARCHIVE_HANDLERS[mime_type]()
 
-def unpack_archives(dir, report):
-    final_result = True
-    # Walk the entire directory before beginning processing. This is because the directory contents may
-    # increase as individual archives are detected and expanded. Those will be handled recursively elsewhere.
-    for archive_path, mime_type in list(walk_archives(dir)):
-        result = unpack_archive(archive_path, mime_type, report)
-        if not result:
-            report.log_file_result(archive_path, 'ArchiveExtractionFailure', 'Archive file could not be extracted')
-            final_result = False
-    return final_result
-
-def repack_archives(dir, report):
-    final_result = True
-    # Process in reverse sorted order, to ensure that inner archives are re-packed before the enclosing ones.
-    for unpacked_path in sorted(walk_unpacked_archives(dir), reverse=True):
-        result = repack_archive(unpacked_path)
-        if not result:
-            report.log_file_result(unpacked_path, 'ArchiveUpdateFailure', 'Archive file could not be updated')
-            final_result = False
-    return final_result
-
-def walk_archives(dir):
+# Records every archive that has been expanded, keyed by the path of its expansion relative to the root of the
+# tree, along with which of them have had any of their contents modified. Only modified archives, and the
+# archives that enclose them, need to be repacked; all others can be used exactly as they were. Each entry
+# keeps the location of the original archive and of its expansion, so that a modified archive can be rebuilt
+# from a directory containing only its modified members.
+class ArchiveRegistry:
+    def __init__(self, root):
+        self.root = root
+        self.archives = {}
+        self.dirty = set()
+
+    def add(self, packed_path, archive_path, mime_type):
+        rel_path = os.path.relpath(packed_path, self.root).replace('\\','/')
+        self.archives[rel_path] = {
+            'archive_name' : os.path.basename(archive_path),
+            'archive_path' : archive_path,
+            'unpacked_path' : packed_path,
+            'mime_type' : mime_type
+        }
+
+    # Mark every expanded archive that contains the given relative path as modified.
+    def mark_modified(self, path):
+        parts = path.replace('\\','/').split('/')
+        for i in range(1, len(parts)):
+            rel_path = '/'.join(parts[:i])
+            if rel_path in self.archives:
+                self.dirty.add(rel_path)
+
+    def is_dirty(self, rel_path):
+        return rel_path.replace('\\','/') in self.dirty
+
+    # Expanded archives in the order in which they must be repacked, i.e. inner archives before enclosing ones.
+    def dirty_archives(self):
+        return sorted(self.dirty, reverse=True)
+
+    def __len__(self):
+        return len(self.archives)
+
+# Expand every archive found within a directory. By default each archive is expanded alongside itself. If a
+# separate output directory is given, expansions are instead placed at the equivalent relative location within
+# it, leaving the original directory untouched. If a registry is given, each expanded archive is recorded in it.
+# Archives are independent of each other, so up to the given number of workers expand them concurrently; any
+# archives found within an expansion are queued as soon as it completes. If an inventory of the directory is
+# given, it is used instead of walking the directory again. If a file type cache is given, it is used to avoid
+# examining files in the inventory whose type is already known. It is never used for the contents of expanded
+# archives, which are extracted afresh (with their original modification times) into a scratch directory whose
+# inodes are reused from one run to the next.
+def unpack_archives(dir, report, out_dir = None, registry = None, workers = 1, inventory = None, cache = None):
+    failed_paths = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        def submit_archives(archives, dir, out_dir):
+            for archive_path, mime_type in archives:
+                packed_dir = os.path.join(out_dir, os.path.relpath(os.path.dirname(archive_path), dir)) if out_dir else None
+                pending[executor.submit(unpack_archive_and_walk, archive_path, mime_type, packed_dir)] = (archive_path, mime_type)
+
+        # Walk the entire directory before beginning processing. This is because the directory contents may
+        # increase as individual archives are detected and expanded. Those are queued as they are expanded.
+        submit_archives(list(walk_archives(dir, inventory, cache)), dir, out_dir)
+        while pending:
+            (done, _) = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                (archive_path, mime_type) = pending.pop(future)
+                (packed_path, nested_archives) = future.result()
+                if not packed_path:
+                    failed_paths.append(archive_path)
+                    continue
+                if registry is not None:
+                    registry.add(packed_path, archive_path, mime_type)
+                submit_archives(nested_archives, packed_path, None)
+
+    # Failures are reported in a fixed order, however the work was scheduled.
+    for archive_path in sorted(failed_paths):
+        report.log_file_result(archive_path, 'ArchiveExtractionFailure', 'Archive file could not be extracted')
+    return not failed_paths
+
+def unpack_archive_and_walk(archive_path, mime_type, packed_dir):
+    packed_path = unpack_archive(archive_path, mime_type, packed_dir)
+    return (packed_path, list(walk_archives(packed_path)) if packed_path else [])
+
+# Repack expanded archives within a directory. If a registry is given, only the archives it has marked as
+# modified are repacked, and the directory need only contain their modified members; otherwise every expanded
+# archive found in the directory is repacked from its full expansion there. An archive is only
+# repacked once every expanded archive within it has been, but otherwise up to the given number of workers
+# repack archives concurrently.
+def repack_archives(dir, report, registry = None, workers = 1):
+    if registry is not None:
+        unpacked_paths = [os.path.join(dir, rel_path) for rel_path in registry.dirty_archives()]
+        repack = lambda path: update_archive(registry.archives[os.path.relpath(path, dir).replace('\\','/')], path)
+        logging.info(f'Repacking {len(unpacked_paths)} of {len(registry)} expanded archives')
+    else:
+        unpacked_paths = list(walk_unpacked_archives(dir))
+        repack = repack_archive
+
+    # Find the innermost expanded archive enclosing each one, and count how many each is waiting on.
+    parents = {}
+    waiting = dict((path, 0) for path in unpacked_paths)
+    for unpacked_path in unpacked_paths:
+        parent_path = os.path.dirname(unpacked_path)
+        while parent_path not in waiting and len(parent_path) > len(dir):
+            parent_path = os.path.dirname(parent_path)
+        if parent_path in waiting:
+            parents[unpacked_path] = parent_path
+            waiting[parent_path] += 1
+
+    failed_paths = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = dict((executor.submit(repack, path), path) for path in sorted(waiting, reverse=True) if waiting[path] == 0)
+        while pending:
+            (done, _) = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                unpacked_path = pending.pop(future)
+                if not future.result():
+                    failed_paths.append(unpacked_path)
+                parent_path = parents.get(unpacked_path)
+                if parent_path:
+                    waiting[parent_path] -= 1
+                    if waiting[parent_path] == 0:
+                        pending[executor.submit(repack, parent_path)] = parent_path
+
+    for unpacked_path in sorted(failed_paths):
+        report.log_file_result(unpacked_path, 'ArchiveUpdateFailure', 'Archive file could not be updated')
+    return not failed_paths
+
+# The file type cache is only used for files taken from the inventory.
+def walk_archives(dir, inventory = None, cache = None):
+    for (path, entry) in walk_file_paths(dir, inventory):
+        try:
+            mime_type = cache.get_archive_type(path, entry) if cache is not None and entry is not None else detect_archive_type(path)
+        except OSError as e:
+            logging.error(f'Error reading file "{path}": {e}')
+            continue
+        if mime_type:
+            yield (path, mime_type)
+
+# Yields the path of each file within a directory, along with its inventory entry if an inventory is used.
+def walk_file_paths(dir, inventory = None):
+    if inventory is not None and inventory.is_root(dir):
+        for entry in inventory.files():
+            yield (entry.path, entry)
+        return
     logging.debug(f'Walking {dir}')
     for root, dirs, files in os.walk(dir):
-        for path in (os.path.join(root, f) for f in files):
-            kind = filetype.guess(path)
-            if kind is not None and kind.mime in (t.MIME for t in filetype.filetype.types if t.__module__.endswith('.archive')):
-                yield (path, kind.mime)
+        for f in files:
+            yield (os.path.join(root, f), None)
 
 def walk_unpacked_archives(dir):
     logging.debug(f'Walking {dir}...')
@@ -57,17 +175,20 @@ def walk_unpacked_archives(dir):
         if CFG_NAME in files:
             yield root
 
-def unpack_archive(archive_path, mime_type, report):
+# Expand a single archive, without looking for further archives within it.
+def unpack_archive(archive_path, mime_type, packed_dir = None):
     archive_handler = get_archive_handler(mime_type)
     if not archive_handler:
         logging.warn(f'No registered handler for MIME type "{mime_type}"')
         return False
     
     archive_file_name = os.path.basename(archive_path)
-    packed_path = os.path.join(os.path.dirname(archive_path), f'[[[{archive_file_name}]]]')
+    packed_path = os.path.join(packed_dir or os.path.dirname(archive_path), get_packed_name(archive_file_name))
 
     try:
         logging.info(f'Unpacking archive file "{archive_path}"...')
+        if packed_dir:
+            os.makedirs(packed_dir, exist_ok=True)
         if os.path.isdir(packed_path):
             shutil.rmtree(packed_path)
         if not archive_handler.unpack(mime_type, archive_path, packed_path):
@@ -79,7 +200,6 @@ def unpack_archive(archive_path, mime_type, report):
         logging.error(f'Error unpacking archive file "{archive_path}": {e}')
         return False
 
-    unpack_archives(packed_path, report)
     return packed_path
     
 def repack_archive(packed_path):
@@ -112,5 +232,40 @@ def repack_archive(packed_path):
     shutil.rmtree(packed_path)
     return True
 
+# Rebuild a modified archive recorded in an ArchiveRegistry. modified_path holds only the members that have
+# changed; everything else is taken from the original archive.
+def update_archive(entry, modified_path):
+    archive_handler = get_archive_handler(entry['mime_type'])
+    if not archive_handler:
+        logging.warn(f'No registered handler for MIME type "{entry["mime_type"]}"')
+        return False
+
+    try:
+        if not archive_handler.update(entry['mime_type'], entry['archive_path'], entry['unpacked_path'], modified_path,
+                                      os.path.join(os.path.dirname(modified_path), entry['archive_name'])):
+            return False
+    except Exception as e:
+        logging.error(f'Error packing archive directory "{modified_path}": {e}')
+        return False
+
+    shutil.rmtree(modified_path)
+    return True
+
+# The name of the directory into which an archive is expanded, alongside the archive itself.
+def get_packed_name(archive_file_name):
+    return f'{PACKED_NAME_PREFIX}{archive_file_name}{PACKED_NAME_SUFFIX}'
+
+def is_packed_name(name):
+    return name.startswith(PACKED_NAME_PREFIX) and name.endswith(PACKED_NAME_SUFFIX)
+
+# Map a relative path, which may lie within one or more expanded archives, to the path of the file in the
+# original tree that it came from (i.e. the outermost archive).
+def get_archive_source_path(path):
+    parts = path.replace('\\','/').split('/')
+    for (i, part) in enumerate(parts):
+        if is_packed_name(part):
+            return '/'.join(parts[:i] + [part[len(PACKED_NAME_PREFIX):-len(PACKED_NAME_SUFFIX)]])
+    return '/'.join(parts)
+
 def get_config_file_path(unpacked_path):
     return os.path.join(unpacked_path, CFG_NAME)
\ No newline at end of file
@@ -1 +1,3 @@
-CFG_NAME = '.unpacked-archive.cfg'
\ No newline at end of file
+CFG_NAME = '.unpacked-archive.cfg'
+PACKED_NAME_PREFIX = '[[['
+PACKED_NAME_SUFFIX = ']]]'
\ No newline at end of file
@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+
+import filetype
+
+CACHE_VERSION = 1
+SIGNATURE_SIZE = 8192
+
+# Every MIME type that filetype classes as an archive. This is worked out once, rather than for every file.
+ARCHIVE_TYPES = list(t for t in filetype.filetype.types if t.__module__.endswith('.archive'))
+ARCHIVE_MIME_TYPES = frozenset(t.MIME for t in ARCHIVE_TYPES)
+ARCHIVE_EXTENSIONS = frozenset(t.EXTENSION.lower() for t in ARCHIVE_TYPES)
+# Every type reported with one of those MIME types, which includes some that filetype does not class as archives.
+ARCHIVE_MATCHERS = list(t for t in filetype.filetype.types if t.MIME in ARCHIVE_MIME_TYPES)
+
+# The first bytes of every signature that filetype recognises as an archive (as of filetype 1.2.0), including
+# the UTF-8 BOM which may precede a PDF signature and the range of Zstandard skippable frame markers. A few
+# signatures lie further into the file, so those offsets are checked separately.
+ARCHIVE_LEAD_BYTES = frozenset(b'\x04\x1f\x7f\x89\xce\xed\xef\xfd!%7BCFILMNPRS{' + bytes(range(0x22, 0x29)) + bytes(range(0x50, 0x60)))
+ARCHIVE_OFFSET_SIGNATURES = [
+    (34, b'LP'),       # Embedded OpenType font
+    (128, b'DICM'),    # DICOM
+    (257, b'ustar')    # Tar
+]
+
+# Returns the MIME type of a file if it is some kind of archive, or None otherwise. This always gives the same
+# answer as filetype.guess(), but most files are ruled out more cheaply:
+# - A file whose extension is that of an archive goes straight to filetype.
+# - Otherwise, a file is only passed to filetype if its header starts with (or contains at the right offset)
+#   the first bytes of an archive signature, and only if one of the archive matchers recognises it. The full
+#   set of matchers is then used, as filetype gives precedence to some non-archive types.
+# Files are never ruled out on their extension alone, as renamed archives must still be found.
+def detect_archive_type(path):
+    with open(path, 'rb') as f:
+        header = f.read(SIGNATURE_SIZE)
+    if not header:
+        return None
+
+    if os.path.splitext(path)[1][1:].lower() not in ARCHIVE_EXTENSIONS:
+        if header[0] not in ARCHIVE_LEAD_BYTES and not any(header[offset:offset + len(signature)] == signature for (offset, signature) in ARCHIVE_OFFSET_SIGNATURES):
+            return None
+        buf = bytearray(header)
+        if not any(t.match(buf) for t in ARCHIVE_MATCHERS):
+            return None
+
+    kind = filetype.guess(header)
+    return kind.mime if kind is not None and kind.mime in ARCHIVE_MIME_TYPES else None
+
+# A cache of archive detection results, keyed by each file's device, inode, size and modification time so that
+# any change to a file invalidates its entry. If a path is given, the cache is loaded from it and can be saved
+# back, keeping only the entries used during this run so that it does not grow without limit. Lookups may be
+# made from several threads at once.
+class FileTypeCache:
+    def __init__(self, path = None):
+        self.path = path
+        self.previous_entries = {}
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except Exception as e:
+            logging.warning(f'Unable to read file type cache from "{self.path}": {e}')
+            return
+        if cache.get('version') != CACHE_VERSION:
+            logging.info(f'Ignoring file type cache "{self.path}" created by a different version')
+            return
+        self.previous_entries = cache.get('entries', {})
+
+    def save(self):
+        if not self.path:
+            return
+        logging.info(f'File type cache: {self.hits} hits, {self.misses} misses')
+        (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'version' : CACHE_VERSION, 'entries' : self.entries}, f)
+            os.replace(tmp_path, self.path)
+        except:
+            os.unlink(tmp_path)
+            raise
+
+    # If the file's inventory entry is given, the key is taken from it rather than from the file itself.
+    def get_archive_type(self, path, entry = None):
+        if entry is None:
+            st = os.stat(path)
+            key = f'{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}'
+        else:
+            key = f'{entry.dev}:{entry.inode}:{entry.size}:{entry.mtime_ns}'
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                return self.entries[key]
+            if key in self.previous_entries:
+                self.hits += 1
+                self.entries[key] = self.previous_entries[key]
+                return self.entries[key]
+            self.misses += 1
+        mime_type = detect_archive_type(path)
+        with self.lock:
+            self.entries[key] = mime_type
+        return mime_type
@@ -1,11 +1,13 @@
 import logging
 import os
 import shutil
+import struct
 import tempfile
 
 import util
 
 import bz2
+import copy
 import gzip
 import lzma
 import tarfile
@@ -13,7 +15,17 @@ import zipfile
 
 import py7zr
 
-from .constants import CFG_NAME
+from .constants import CFG_NAME, PACKED_NAME_PREFIX, PACKED_NAME_SUFFIX
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# From the zip file format specification (APPNOTE.TXT): the local file header, ending with the lengths of the
+# file name and extra field which follow it, the flag marking a member whose sizes and CRC follow its data, and
+# the ID of the ZIP64 extended information extra field.
+ZIP_LOCAL_HEADER_FORMAT = '<4s2B4HL2L2H'
+ZIP_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+ZIP_FLAG_DATA_DESCRIPTOR = 0x08
+ZIP64_EXTRA_HEADER_ID = 1
 
 class ArchiveHandler:
     def __init__(self):
@@ -22,16 +34,39 @@ class ArchiveHandler:
     def unpack(self, mime_type, from_path, to_path):
         return False
 
-    def repack(self, mime_type, from_path, to_path):
+    def repack(self, mime_type, from_path, to_path, modified_path = None):
         return False
-    
-    # Like os.walk but filter out unpacked archive config files
+
+    # Rebuild an archive which was expanded to expanded_path, given a directory containing only those of its
+    # members which have been modified. By default, the archive is rebuilt from the expanded tree, taking each
+    # member from modified_path where present. Handlers for formats which can be read member by member override
+    # this to stream the original archive instead.
+    def update(self, mime_type, archive_path, expanded_path, modified_path, to_path):
+        return self.repack(mime_type, expanded_path, to_path, modified_path)
+
+    # Like os.walk but filter out unpacked archive config files, and the expansions of any nested archives
     def walk(self, path):
         for (root, dirs, files) in os.walk(path):
             if CFG_NAME in files:
                 files.remove(CFG_NAME)
+            dirs[:] = list(d for d in dirs if not (d.startswith(PACKED_NAME_PREFIX) and d.endswith(PACKED_NAME_SUFFIX)))
             yield (root, dirs, files)
 
+    # Yields the path of each file to be packed, along with its path within the archive. Files present under
+    # modified_path take the place of those in from_path.
+    def walk_files(self, from_path, modified_path = None):
+        for (root, dirs, files) in self.walk(from_path):
+            for file_name in files:
+                file_path = util.os.path.join(root, file_name)
+                arc_path = os.path.relpath(file_path, from_path)
+                if modified_path and os.path.isfile(util.os.path.join(modified_path, arc_path)):
+                    file_path = util.os.path.join(modified_path, arc_path)
+                yield (file_path, arc_path)
+
+    def get_modified_member_path(self, modified_path, name):
+        path = util.os.path.join(modified_path, name)
+        return path if os.path.isfile(path) else None
+
     def validate_paths(self, base_path, paths):
         base_path = util.os.path.realpath(base_path)
         for path in paths:
@@ -52,20 +87,98 @@ class ZipArchiveHandler(ArchiveHandler):
             archive.extractall(to_path)
             return True
 
-    def repack(self, mime_type, from_path, to_path):
+    def repack(self, mime_type, from_path, to_path, modified_path = None):
         with tempfile.NamedTemporaryFile('w+b', delete=False) as tmp_zip:
             tmp_path = tmp_zip.name
             with zipfile.ZipFile(tmp_zip, 'w') as archive:
-                for (root, dirs, files) in self.walk(from_path):
-                    for file_name in files:
-                        file_path = util.os.path.join(root, file_name)
-                        arc_path = os.path.relpath(file_path, from_path)
-                        archive.write(file_path, arc_path)
-                        logging.info(f'File "{arc_path}" updated in archive "{to_path}".')
-
-        shutil.move(tmp_path, to_path)
+                for (file_path, arc_path) in self.walk_files(from_path, modified_path):
+                    archive.write(file_path, arc_path)
+                    logging.info(f'File "{arc_path}" updated in archive "{to_path}".')
+
+        util.replace_file(tmp_path, to_path)
+        return True
+
+    # Copy the original archive member by member, in its original order and with its original metadata,
+    # substituting the modified members. Unchanged members are copied still compressed where possible.
+    def update(self, mime_type, archive_path, expanded_path, modified_path, to_path):
+        with tempfile.NamedTemporaryFile('w+b', delete=False) as tmp_zip:
+            tmp_path = tmp_zip.name
+            with zipfile.ZipFile(archive_path, 'r') as original, zipfile.ZipFile(tmp_zip, 'w') as archive:
+                archive.comment = original.comment
+                copy_raw = can_copy_raw_members(archive)
+                for info in original.infolist():
+                    member_path = None if info.is_dir() else self.get_modified_member_path(modified_path, info.filename)
+                    if not member_path and copy_raw:
+                        self.copy_raw_member(original, archive, info)
+                        continue
+                    new_info = copy.copy(info)
+                    new_info.extra = strip_zip64_extra(info.extra)
+                    if info.is_dir():
+                        archive.writestr(new_info, b'')
+                        continue
+                    if member_path:
+                        new_info.file_size = os.path.getsize(member_path)
+                        logging.info(f'File "{info.filename}" updated in archive "{to_path}".')
+                    with (open(member_path, 'rb') if member_path else original.open(info)) as src:
+                        with archive.open(new_info, 'w', force_zip64=new_info.file_size > zipfile.ZIP64_LIMIT) as dst:
+                            shutil.copyfileobj(src, dst)
+
+        util.replace_file(tmp_path, to_path)
         return True
 
+    # zipfile has no way of copying a member between archives without decompressing and recompressing it, so
+    # the compressed data is copied directly, after a new local header. The sizes and CRC go in that header, so
+    # any data descriptor which followed the data in the original archive is dropped, as is any ZIP64 extra
+    # field, which zipfile adds again where needed.
+    def copy_raw_member(self, original, archive, info):
+        original.fp.seek(info.header_offset)
+        header = struct.unpack(ZIP_LOCAL_HEADER_FORMAT, original.fp.read(struct.calcsize(ZIP_LOCAL_HEADER_FORMAT)))
+        if header[0] != ZIP_LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile(f'Bad local header for member "{info.filename}"')
+        original.fp.seek(header[-2] + header[-1], os.SEEK_CUR)
+
+        new_info = copy.copy(info)
+        new_info.flag_bits &= ~ZIP_FLAG_DATA_DESCRIPTOR
+        new_info.extra = strip_zip64_extra(info.extra)
+        new_info.header_offset = archive.start_dir
+        archive.fp.seek(archive.start_dir)
+        archive.fp.write(new_info.FileHeader(new_info.file_size > zipfile.ZIP64_LIMIT or new_info.compress_size > zipfile.ZIP64_LIMIT))
+        remaining = info.compress_size
+        while remaining > 0:
+            data = original.fp.read(min(remaining, COPY_BUFFER_SIZE))
+            if not data:
+                raise zipfile.BadZipFile(f'Truncated data for member "{info.filename}"')
+            archive.fp.write(data)
+            remaining -= len(data)
+
+        archive.filelist.append(new_info)
+        archive.NameToInfo[new_info.filename] = new_info
+        archive.start_dir = archive.fp.tell()
+        archive._didModify = True
+
+# Copying a member's compressed data means writing to the archive in the same way that zipfile itself does, using
+# attributes of ZipFile which are not part of its documented API. If any of them are missing, e.g. in a future
+# version of Python, members are recompressed instead.
+ZIP_RAW_COPY_ATTRIBUTES = ['fp', 'filelist', 'NameToInfo', 'start_dir', '_didModify']
+
+def can_copy_raw_members(archive):
+    if all(hasattr(archive, name) for name in ZIP_RAW_COPY_ATTRIBUTES) and hasattr(zipfile.ZipInfo, 'FileHeader'):
+        return True
+    logging.debug('Unable to copy compressed zip members directly. Unchanged members will be recompressed.')
+    return False
+
+# Remove any ZIP64 extended information field (header ID 1) from a member's extra data. It holds the sizes and
+# offset of the member in the original archive, and zipfile adds a new one wherever one is needed.
+def strip_zip64_extra(extra):
+    fields = []
+    i = 0
+    while i + 4 <= len(extra):
+        (header_id, size) = struct.unpack('<HH', extra[i:i + 4])
+        if header_id != ZIP64_EXTRA_HEADER_ID:
+            fields.append(extra[i:i + 4 + size])
+        i += 4 + size
+    return b''.join(fields) + extra[i:]
+
 class SevenZipArchiveHandler(ArchiveHandler):
     def __init__(self):
         super()
@@ -77,18 +190,15 @@ class SevenZipArchiveHandler(ArchiveHandler):
             archive.extractall(to_path)
             return True
 
-    def repack(self, mime_type, from_path, to_path):
+    def repack(self, mime_type, from_path, to_path, modified_path = None):
         with tempfile.NamedTemporaryFile('w+b', delete=False) as tmp_zip:
             tmp_path = tmp_zip.name
             with py7zr.SevenZipFile(tmp_path, 'w') as archive:
-                for (root, dirs, files) in self.walk(from_path):
-                    for file_name in files:
-                        file_path = util.os.path.join(root, file_name)
-                        arc_path = os.path.relpath(file_path, from_path)
-                        archive.write(file_path, arc_path)
-                        logging.info(f'File "{arc_path}" updated in archive "{to_path}".')
-
-        shutil.move(tmp_path, to_path)
+                for (file_path, arc_path) in self.walk_files(from_path, modified_path):
+                    archive.write(file_path, arc_path)
+                    logging.info(f'File "{arc_path}" updated in archive "{to_path}".')
+
+        util.replace_file(tmp_path, to_path)
         return True
     
 class GzipArchiveHandler(ArchiveHandler):
@@ -106,17 +216,16 @@ class GzipArchiveHandler(ArchiveHandler):
 
         return True
 
-    def repack(self, mime_type, from_path, to_path):
+    def repack(self, mime_type, from_path, to_path, modified_path = None):
         tmp_zip_dir = tempfile.mkdtemp()
         try:
             tmp_path = util.os.path.join(tmp_zip_dir, os.path.basename(to_path))
             with gzip.open(tmp_path, 'w') as archive:
-                for (root, dirs, files) in self.walk(from_path):
-                    for file_name in files:
-                        with open(util.os.path.join(root, file_name), 'rb') as f:
-                            shutil.copyfileobj(f, archive)
+                for (file_path, arc_path) in self.walk_files(from_path, modified_path):
+                    with open(file_path, 'rb') as f:
+                        shutil.copyfileobj(f, archive)
 
-            shutil.move(tmp_path, to_path)
+            util.replace_file(tmp_path, to_path)
         finally:
             shutil.rmtree(tmp_zip_dir)
         return True
@@ -136,17 +245,16 @@ class Bz2ArchiveHandler(ArchiveHandler):
 
         return True
 
-    def repack(self, mime_type, from_path, to_path):
+    def repack(self, mime_type, from_path, to_path, modified_path = None):
         tmp_zip_dir = tempfile.mkdtemp()
         try:
             tmp_path = util.os.path.join(tmp_zip_dir, os.path.basename(to_path))
             with bz2.open(tmp_path, 'w') as archive:
-                for (root, dirs, files) in self.walk(from_path):
-                    for file_name in files:
-                        with open(util.os.path.join(root, file_name), 'rb') as f:
-                            shutil.copyfileobj(f, archive)
+                for (file_path, arc_path) in self.walk_files(from_path, modified_path):
+                    with open(file_path, 'rb') as f:
+                        shutil.copyfileobj(f, archive)
 
-            shutil.move(tmp_path, to_path)
+            util.replace_file(tmp_path, to_path)
         finally:
             shutil.rmtree(tmp_zip_dir)
         return True
@@ -166,17 +274,16 @@ class LzmaArchiveHandler(ArchiveHandler):
 
         return True
 
-    def repack(self, mime_type, from_path, to_path):
+    def repack(self, mime_type, from_path, to_path, modified_path = None):
         tmp_zip_dir = tempfile.mkdtemp()
         try:
             tmp_path = util.os.path.join(tmp_zip_dir, os.path.basename(to_path))
             with lzma.open(tmp_path, 'w') as archive:
-                for (root, dirs, files) in self.walk(from_path):
-                    for file_name in files:
-                        with open(util.os.path.join(root, file_name), 'rb') as f:
-                            shutil.copyfileobj(f, archive)
+                for (file_path, arc_path) in self.walk_files(from_path, modified_path):
+                    with open(file_path, 'rb') as f:
+                        shutil.copyfileobj(f, archive)
 
-            shutil.move(tmp_path, to_path)
+            util.replace_file(tmp_path, to_path)
         finally:
             shutil.rmtree(tmp_zip_dir)
         return True
@@ -193,17 +300,36 @@ class TarArchiveHandler(ArchiveHandler):
             archive.extractall(to_path)
             return True
 
-    def repack(self, mime_type, from_path, to_path):
+    def repack(self, mime_type, from_path, to_path, modified_path = None):
         with tempfile.NamedTemporaryFile('w+b', delete=False) as tmp_file:
             tmp_path = tmp_file.name
             with tarfile.open(tmp_path, 'w') as archive:
-                for (root, dirs, files) in self.walk(from_path):
-                    for file_name in files:
-                        file_path = util.os.path.join(root, file_name)
-                        arc_path = os.path.relpath(file_path, from_path)
-                        archive.add(file_path, arc_path)
-                        logging.info(f'File "{arc_path}" updated in archive "{to_path}".')
-
-        shutil.move(tmp_path, to_path)
+                for (file_path, arc_path) in self.walk_files(from_path, modified_path):
+                    archive.add(file_path, arc_path)
+                    logging.info(f'File "{arc_path}" updated in archive "{to_path}".')
+
+        util.replace_file(tmp_path, to_path)
         return True
 
+    # Copy the original archive member by member, keeping every member's metadata and any non-file members,
+    # substituting the modified members.
+    def update(self, mime_type, archive_path, expanded_path, modified_path, to_path):
+        with tempfile.NamedTemporaryFile('w+b', delete=False) as tmp_file:
+            tmp_path = tmp_file.name
+            with tarfile.open(archive_path, 'r') as original, tarfile.open(tmp_path, 'w', format=original.format) as archive:
+                for member in original:
+                    if not member.isfile():
+                        archive.addfile(member)
+                        continue
+                    member_path = self.get_modified_member_path(modified_path, member.name)
+                    if not member_path:
+                        archive.addfile(member, original.extractfile(member))
+                        continue
+                    new_member = copy.copy(member)
+                    new_member.size = os.path.getsize(member_path)
+                    with open(member_path, 'rb') as f:
+                        archive.addfile(new_member, f)
+                    logging.info(f'File "{member.name}" updated in archive "{to_path}".')
+
+        util.replace_file(tmp_path, to_path)
+        return True
@@ -0,0 +1,80 @@
+# Released as open source by NCC Group Plc - https://www.nccgroup.com/
+#
+# Developed by:
+#     Andrew Kisliakov (andrew.kisliakov@nccgroup.com)
+#
+# Project link: https://www.github.com/nccgroup/secretscrub/
+#
+# Released under AGPL-3.0. See LICENSE for more information.
+
+# Compares locating results by line number using LineIndex against the previous approach of reading the whole
+# artifact with readlines() for every result.
+#
+#     python benchmarks/bench_line_index.py --lines 1000000 --results 20
+
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from secretscrub_redaction import ArtifactSource, LineIndex, TEXT_ENCODING
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog = __file__)
+    parser.add_argument('--lines', type=int, default=1000000, help='The number of lines in the generated artifact. Default: 1000000')
+    parser.add_argument('--results', type=int, default=20, help='The number of results to locate within the artifact. Default: 20')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+def generate_artifact(path, line_count, rng):
+    with open(path, 'wb') as f:
+        for i in range(line_count):
+            line_end = rng.choice(['\n', '\r\n'])
+            f.write(f'{i:08d} {"x" * rng.randint(0, 80)}{line_end}'.encode('utf-8'))
+
+# The approach used before LineIndex: the artifact is read and split into lines once per result.
+def locate_with_readlines(path, result_lines):
+    found = []
+    for line_no in result_lines:
+        with io.open(path, 'r', newline='', encoding=TEXT_ENCODING) as f:
+            lines = f.readlines()
+        found.append(lines[line_no])
+    return found
+
+def locate_with_line_index(path, result_lines, sparse):
+    with ArtifactSource(path) as source:
+        line_index = LineIndex(source.data, set(result_lines) | set(n + 1 for n in result_lines) if sparse else None)
+        return list(line_index.text(line_no, line_no) for line_no in result_lines)
+
+def time_call(func, *args):
+    start_time = time.perf_counter()
+    result = func(*args)
+    return (time.perf_counter() - start_time, result)
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'artifact.txt')
+        generate_artifact(path, args.lines, rng)
+        result_lines = sorted(rng.randrange(args.lines) for _ in range(args.results))
+        print(f'{args.lines} lines, {os.path.getsize(path)} bytes, {args.results} results')
+
+        timings = [
+            ('readlines() per result', ) + time_call(locate_with_readlines, path, result_lines),
+            ('LineIndex, all lines', ) + time_call(locate_with_line_index, path, result_lines, False),
+            ('LineIndex, result lines only', ) + time_call(locate_with_line_index, path, result_lines, True)
+        ]
+        expected = timings[0][2]
+        for (name, elapsed, found) in timings:
+            if found != expected:
+                raise Exception(f'{name} located different lines')
+            print(f'{name:<30} {elapsed:8.3f}s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+# Released as open source by NCC Group Plc - https://www.nccgroup.com/
+#
+# Developed by:
+#     Andrew Kisliakov (andrew.kisliakov@nccgroup.com)
+#
+# Project link: https://www.github.com/nccgroup/secretscrub/
+#
+# Released under AGPL-3.0. See LICENSE for more information.
+
+# Times each stage of a full run over a synthetic corpus generated by corpus.py, in the same order as
+# secretscrub.py runs them: inventory, archive extraction, analysis, SARIF loading, redaction, copying the
+# remaining files and repacking archives. The external tools are never run; their results are taken from the
+# SARIF files generated along with the corpus, while BinDetect and RegexScan are run in-process. For each
+# stage the wall and CPU time, the number of bytes processed, the throughput and the peak RSS are reported.
+#
+#     python benchmarks/bench_pipeline.py --files 10000 --jobs 4 --json results.json
+
+import argparse
+import collections
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import corpus
+from secretscrub import copy_remaining_files, get_input_files, process_sarif_file, process_sarif_run, redact_targets, DEFAULT_PLACEHOLDER_FORMAT
+from secretscrub_report import SecretScrubReport, SecretScrubReportEncryption
+from secretscrub_redaction import RedactionTargets
+from archive import ArchiveRegistry, FileTypeCache, unpack_archives, repack_archives
+from bindetect import bin_detect
+from util.inventory import Inventory
+import regexscan
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog = __file__)
+    parser.add_argument('--workdir', help='The directory in which to generate the corpus and write the output. Default: a temporary directory, removed afterwards')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='The number of workers used by each stage, as for secretscrub.py --jobs. Default: 1')
+    parser.add_argument('--cq', help='The cq script from which to take RegexScan checks. Default: checks matching the generated secrets')
+    parser.add_argument('--ccs', help='The ccs script from which to take RegexScan checks. Default: checks matching the generated secrets')
+    parser.add_argument('--json', metavar='PATH', help='A file to which to write the results as JSON')
+    parser.add_argument('-l', '--log-level', default='WARNING', help='The logging level to use. Default: WARNING')
+    corpus.add_corpus_args(parser)
+    return parser.parse_args()
+
+class StageResult:
+    def __init__(self, name, wall_time, cpu_time, child_cpu_time, bytes_processed, peak_rss, child_peak_rss):
+        self.name = name
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.child_cpu_time = child_cpu_time
+        self.bytes_processed = bytes_processed
+        self.peak_rss = peak_rss
+        self.child_peak_rss = child_peak_rss
+
+    def throughput(self):
+        return self.bytes_processed / self.wall_time / (1024 * 1024) if self.wall_time > 0 else 0.0
+
+    def to_dict(self):
+        return dict(vars(self), throughput_mb_s=self.throughput())
+
+# Peak RSS is measured per stage where the high-water mark can be reset (Linux), and is otherwise the peak for
+# the process so far. Worker processes are only counted once they have exited, and only as the largest of them.
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def get_peak_rss():
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return get_max_rss(resource.RUSAGE_SELF) if resource else None
+
+def get_child_peak_rss():
+    return get_max_rss(resource.RUSAGE_CHILDREN) if resource else None
+
+# ru_maxrss is in kilobytes, other than on macOS where it is in bytes.
+def get_max_rss(who):
+    max_rss = resource.getrusage(who).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+def time_stage(results, name, bytes_processed, func, *args):
+    reset_peak_rss()
+    start_times = os.times()
+    start_time = time.perf_counter()
+    value = func(*args)
+    wall_time = time.perf_counter() - start_time
+    end_times = os.times()
+    results.append(StageResult(name, wall_time,
+                               (end_times.user + end_times.system) - (start_times.user + start_times.system),
+                               (end_times.children_user + end_times.children_system) - (start_times.children_user + start_times.children_system),
+                               bytes_processed, get_peak_rss(), get_child_peak_rss()))
+    return value
+
+def get_dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, file)) for (root, dirs, files) in os.walk(path) for file in files)
+
+def get_file_sizes(paths):
+    return sum(os.path.getsize(path) for path in paths if os.path.isfile(path))
+
+def analyse(src_dirs, result_dir, checks, jobs, inventory):
+    runs = []
+    for (layer, src_dir) in enumerate(src_dirs):
+        suffix = f'-{layer}' if layer else ''
+        bin_detect(src_dir, os.path.join(result_dir, f'70-bindetect{suffix}.sarif'), jobs, inventory=inventory)
+        runs.append(regexscan.regex_scan(src_dir, checks, f'80-regexscan{suffix}', jobs))
+    return runs
+
+def load_sarif(result_dir, runs):
+    targets = RedactionTargets()
+    for (file_type, file_subdir, file_path) in get_input_files(result_dir):
+        if file_type == 'sarif':
+            process_sarif_file(file_path, file_subdir, targets, DEFAULT_PLACEHOLDER_FORMAT)
+    for run in runs:
+        process_sarif_run(run, run.path, '', targets, DEFAULT_PLACEHOLDER_FORMAT)
+    return targets
+
+def repack(out_dir, report, registry, modified_paths, jobs):
+    for path in modified_paths:
+        registry.mark_modified(path)
+    # The repacked archives replace those copied from the source, alongside where they were expanded.
+    dirty_paths = list(os.path.join(out_dir, os.path.dirname(rel_path), registry.archives[rel_path]['archive_name']) for rel_path in registry.dirty_archives())
+    repack_archives(out_dir, report, registry, jobs)
+    return dirty_paths
+
+def run_pipeline(args, work_dir):
+    src_dir = os.path.join(work_dir, 'src')
+    result_dir = os.path.join(work_dir, 'sarif')
+    archive_dir = os.path.join(work_dir, 'archives')
+    out_dir = os.path.join(work_dir, 'out')
+    for path in [src_dir, result_dir, archive_dir, out_dir]:
+        shutil.rmtree(path, ignore_errors=True)
+
+    start_time = time.perf_counter()
+    stats = corpus.generate_corpus(src_dir, result_dir, args)
+    print(f'Corpus generated in {time.perf_counter() - start_time:.2f}s: {stats}')
+
+    checks = regexscan.load_checks(args.cq, args.ccs) if args.cq or args.ccs else corpus.REGEXSCAN_CHECKS
+    report = SecretScrubReport(None, SecretScrubReportEncryption.NONE)
+    statuses = collections.Counter()
+    report.add_row_observer(lambda row: statuses.update([row['Status']]))
+    results = []
+    try:
+        inventory = time_stage(results, 'inventory', 0, Inventory.scan, src_dir)
+        src_size = inventory.total_size()
+        results[-1].bytes_processed = src_size
+
+        registry = ArchiveRegistry(archive_dir)
+        time_stage(results, 'unpack', stats.archive_bytes, unpack_archives, src_dir, report, archive_dir, registry, args.jobs, inventory, FileTypeCache())
+        src_dirs = [src_dir, archive_dir]
+        archive_size = get_dir_size(archive_dir)
+
+        runs = time_stage(results, 'analysis', 2 * (src_size + archive_size), analyse, src_dirs, result_dir, checks, args.jobs, inventory)
+        targets = time_stage(results, 'sarif load', get_dir_size(result_dir), load_sarif, result_dir, runs)
+
+        target_size = get_file_sizes(os.path.join(src_dirs[-1] if '[[[' in t.artifact_path else src_dir, t.artifact_path) for t in targets)
+        modified_paths = time_stage(results, 'redaction', target_size, redact_targets, targets, src_dirs, out_dir, report, args.jobs)
+        time_stage(results, 'copy', src_size, copy_remaining_files, src_dir, out_dir, 'copy', inventory)
+        dirty_paths = time_stage(results, 'repack', 0, repack, out_dir, report, registry, modified_paths, args.jobs)
+        results[-1].bytes_processed = get_file_sizes(dirty_paths)
+    finally:
+        report.close()
+    return (stats, results, statuses)
+
+def print_results(results, statuses):
+    print(f'{"Stage":<12} {"Wall (s)":>10} {"CPU (s)":>10} {"Child CPU":>10} {"MB":>10} {"MB/s":>10} {"Peak RSS":>10} {"Child RSS":>10}')
+    for r in results:
+        print(f'{r.name:<12} {r.wall_time:10.3f} {r.cpu_time:10.3f} {r.child_cpu_time:10.3f} {r.bytes_processed / (1024 * 1024):10.1f} '
+              f'{r.throughput():10.1f} {format_size(r.peak_rss):>10} {format_size(r.child_peak_rss):>10}')
+    print(f'{"total":<12} {sum(r.wall_time for r in results):10.3f}')
+    print('Results: ' + ', '.join(f'{count} {status}' for (status, count) in sorted(statuses.items())))
+
+def format_size(size):
+    return f'{size / (1024 * 1024):.0f}M' if size is not None else '-'
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=args.log_level.upper())
+    work_dir = args.workdir or tempfile.mkdtemp(prefix='secretscrub-bench-')
+    try:
+        (stats, results, statuses) = run_pipeline(args, work_dir)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_results(results, statuses)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'settings' : dict((k, v) for (k, v) in vars(args).items() if k not in ['json', 'workdir', 'log_level']),
+                'corpus' : vars(stats),
+                'stages' : list(r.to_dict() for r in results),
+                'statuses' : dict(statuses)
+            }, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+# Released as open source by NCC Group Plc - https://www.nccgroup.com/
+#
+# Developed by:
+#     Andrew Kisliakov (andrew.kisliakov@nccgroup.com)
+#
+# Project link: https://www.github.com/nccgroup/secretscrub/
+#
+# Released under AGPL-3.0. See LICENSE for more information.
+
+# Generates a synthetic source tree for benchmarking, along with SARIF files describing the secrets planted in
+# it in the form that Trivy, Gitleaks, cq and ccs would report them, so that no external tools are needed. The
+# same seed and settings always produce the same tree, other than the timestamps that py7zr records in 7z archives.
+#
+#     python benchmarks/corpus.py --srcdir /tmp/corpus --sarif-dir /tmp/corpus-sarif --files 10000
+
+import argparse
+import gzip
+import io
+import math
+import os
+import random
+import sys
+import tarfile
+import zipfile
+
+import py7zr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archive import get_packed_name
+from secretscrub_sarif import write_sarif_doc
+
+TOOLS = ['trivy', 'gitleaks', 'cq', 'ccs']
+ARCHIVE_FORMATS = ['zip', 'tar', 'tar.gz', '7z', 'gz']
+DEFAULT_DENSITY = '0.002,0.002,0.002,0.002'
+WORDS = ['alpha', 'beta', 'gamma', 'delta', 'value', 'config', 'return', 'self', 'import', 'print', 'if', 'else',
+         'for', 'in', 'range', 'data', 'result', 'item', 'list', 'dict', '=', '+', '(', ')', '{', '}', '[', ']', '0', '1']
+ALNUM = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+HEX = '0123456789abcdef'
+# Checks for RegexScan that find the same secrets that cq and ccs are reported to have found, for use when the
+# real rule catalogs are not available.
+REGEXSCAN_CHECKS = [('cq/cred_password', r'password = \S+'), ('ccs/token:Rule:1', r'tok_[0-9a-f]{24}')]
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog = __file__)
+    parser.add_argument('--srcdir', required=True, help='The directory in which to generate the source tree')
+    parser.add_argument('--sarif-dir', required=True, help='The directory in which to write the SARIF files')
+    add_corpus_args(parser)
+    return parser.parse_args()
+
+def add_corpus_args(parser):
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--files', type=int, default=1000, help='The number of text files. Default: 1000')
+    parser.add_argument('--files-per-dir', type=int, default=100, help='The number of files in each directory. Default: 100')
+    parser.add_argument('--min-size', type=int, default=256, help='The smallest text file size in bytes. Default: 256')
+    parser.add_argument('--max-size', type=int, default=65536, help='The largest text file size in bytes. Sizes are spread log-uniformly between the two. Default: 65536')
+    parser.add_argument('--density', default=DEFAULT_DENSITY, help=f'The probability of each line containing a secret reported by each of {", ".join(TOOLS)}, as a comma-separated list. Default: {DEFAULT_DENSITY}')
+    parser.add_argument('--large-files', type=int, default=1, help='The number of large text files. Default: 1')
+    parser.add_argument('--large-file-size', type=int, default=64 * 1024 * 1024, help='The size of each large text file in bytes. Default: 64 MiB')
+    parser.add_argument('--archives', type=int, default=10, help='The number of archives. Default: 10')
+    parser.add_argument('--archive-depth', type=int, default=3, help='The number of levels of nesting within each archive. Default: 3')
+    parser.add_argument('--archive-files', type=int, default=10, help='The number of text files at each level of an archive. Default: 10')
+    parser.add_argument('--archive-formats', default=','.join(ARCHIVE_FORMATS), help=f'The archive formats to use, in turn. Default: {",".join(ARCHIVE_FORMATS)}')
+    parser.add_argument('--keystores', type=int, default=10, help='The number of binary key stores. Default: 10')
+
+def main():
+    args = parse_args()
+    stats = generate_corpus(args.srcdir, args.sarif_dir, args)
+    print(stats)
+
+class CorpusStats:
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.archives = 0
+        self.archive_bytes = 0
+        self.keystores = 0
+        self.findings = dict((tool, 0) for tool in TOOLS)
+
+    def __str__(self):
+        findings = ', '.join(f'{count} {tool}' for (tool, count) in self.findings.items())
+        return (f'{self.files} files ({self.bytes} bytes), {self.archives} archives ({self.archive_bytes} bytes), '
+                f'{self.keystores} key stores, findings: {findings}')
+
+# Findings are kept per tool and per layer: layer 0 is the source tree itself, and layer 1 the scratch tree of
+# expanded archives, whose paths include the names of the directories that archives are expanded into.
+class Findings:
+    def __init__(self):
+        self.results = dict(((tool, layer), []) for tool in TOOLS for layer in [0, 1])
+
+    def add(self, tool, layer, result):
+        self.results[(tool, layer)].append(result)
+
+def generate_corpus(src_dir, sarif_dir, args):
+    rng = random.Random(args.seed)
+    density = list(float(d) for d in args.density.split(','))
+    if len(density) != len(TOOLS):
+        raise ValueError(f'--density must give {len(TOOLS)} values')
+    formats = args.archive_formats.split(',')
+    stats = CorpusStats()
+    findings = Findings()
+    os.makedirs(src_dir, exist_ok=True)
+
+    for i in range(args.files):
+        rel_path = f'd{i // args.files_per_dir:04d}/f{i:06d}.{rng.choice(["py", "java", "txt", "yml"])}'
+        size = int(math.exp(rng.uniform(math.log(args.min_size), math.log(args.max_size))))
+        write_file(src_dir, rel_path, generate_text(rng, size, density, rel_path, 0, findings, stats), stats)
+
+    for i in range(args.large_files):
+        rel_path = f'large/large{i:03d}.txt'
+        write_file(src_dir, rel_path, generate_text(rng, args.large_file_size, density, rel_path, 0, findings, stats), stats)
+
+    for i in range(args.archives):
+        fmt = formats[i % len(formats)]
+        rel_path = f'archives/a{i:04d}.{fmt if fmt != "gz" else "txt.gz"}'
+        data = build_archive(rng, args, density, formats, i % len(formats), rel_path, args.archive_depth, findings, stats)
+        write_file(src_dir, rel_path, data, stats)
+        stats.archives += 1
+        stats.archive_bytes += len(data)
+
+    for i in range(args.keystores):
+        # Key stores are found by BinDetect itself. One in every few has no telling name, so is found by its content.
+        name = ['keystore', 'p12', 'dat'][i % 3]
+        data = b'\xfe\xed\xfe\xed\x00\x00\x00\x02' + rng.randbytes(rng.randint(1024, 8192))
+        write_file(src_dir, f'keys/k{i:04d}.{name}', data, stats)
+        stats.keystores += 1
+
+    os.makedirs(sarif_dir, exist_ok=True)
+    for ((tool, layer), results) in findings.results.items():
+        with open(os.path.join(sarif_dir, f'50-{tool}{"-" + str(layer) if layer else ""}.sarif'), 'w') as f:
+            write_sarif_doc(f, build_tool(tool), (build_result(tool, *result) for result in results))
+    return stats
+
+def write_file(src_dir, rel_path, data, stats):
+    path = os.path.join(src_dir, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    stats.files += 1
+    stats.bytes += len(data)
+
+# Generate text of roughly the given size. Each line may contain a secret of the kind reported by one of the
+# tools, which is recorded against the given path.
+def generate_text(rng, size, density, rel_path, layer, findings, stats):
+    lines = []
+    length = 0
+    line_no = 0
+    while length < size:
+        line_no += 1
+        words = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 12)))
+        line = f'{"    " * rng.randint(0, 3)}{words}'
+        roll = rng.random()
+        for (tool, tool_density) in zip(TOOLS, density):
+            if roll < tool_density:
+                (line, secret, column) = plant_secret(rng, tool, line)
+                findings.add(tool, layer, (rel_path, line_no, column, secret, line))
+                stats.findings[tool] += 1
+                break
+            roll -= tool_density
+        line = line + rng.choice(['\n', '\n', '\n', '\r\n'])
+        lines.append(line)
+        length += len(line)
+    return ''.join(lines).encode('utf-8')
+
+def plant_secret(rng, tool, line):
+    if tool == 'trivy':
+        (prefix, secret) = ('aws_access_key_id = ', 'AKIA' + ''.join(rng.choice(ALNUM) for _ in range(16)))
+    elif tool == 'gitleaks':
+        (prefix, secret) = ('api_key = "', ''.join(rng.choice(HEX) for _ in range(32)))
+    elif tool == 'cq':
+        (prefix, secret) = ('password = ', ''.join(rng.choice(ALNUM) for _ in range(12)))
+    else:
+        (prefix, secret) = ('token = tok_', ''.join(rng.choice(HEX) for _ in range(24)))
+    line = f'{line} {prefix}'
+    column = len(line)
+    return (f'{line}{secret}{"" if tool != "gitleaks" else chr(34)}', secret, column)
+
+# Build an archive containing a number of text files and, unless the innermost level has been reached, another
+# archive of the next format in turn. Members' findings are recorded at the paths they have once expanded.
+def build_archive(rng, args, density, formats, format_index, rel_path, depth, findings, stats):
+    fmt = formats[format_index]
+    expanded_path = f'{os.path.dirname(rel_path)}/{get_packed_name(os.path.basename(rel_path))}'.lstrip('/')
+    if fmt == 'gz':
+        member_name = os.path.basename(rel_path)[:-len('.gz')]
+        size = int(math.exp(rng.uniform(math.log(args.min_size), math.log(args.max_size))))
+        return gzip.compress(generate_text(rng, size, density, f'{expanded_path}/{member_name}', 1, findings, stats), mtime=0)
+    if fmt == 'tar.gz':
+        tar_name = os.path.basename(rel_path)[:-len('.gz')]
+        return gzip.compress(build_members_archive(rng, args, density, formats, format_index, 'tar', f'{expanded_path}/{tar_name}', depth, findings, stats), mtime=0)
+    return build_members_archive(rng, args, density, formats, format_index, fmt, rel_path, depth, findings, stats)
+
+def build_members_archive(rng, args, density, formats, format_index, fmt, rel_path, depth, findings, stats):
+    expanded_path = f'{os.path.dirname(rel_path)}/{get_packed_name(os.path.basename(rel_path))}'.lstrip('/')
+    members = {}
+    for j in range(args.archive_files):
+        member_name = f'm{j:03d}.txt'
+        size = int(math.exp(rng.uniform(math.log(args.min_size), math.log(args.max_size))))
+        members[member_name] = generate_text(rng, size, density, f'{expanded_path}/{member_name}', 1, findings, stats)
+    if depth > 1:
+        inner_index = (format_index + 1) % len(formats)
+        inner_fmt = formats[inner_index]
+        inner_name = f'inner{depth - 1}.{inner_fmt if inner_fmt != "gz" else "txt.gz"}'
+        members[inner_name] = build_archive(rng, args, density, formats, inner_index, f'{expanded_path}/{inner_name}', depth - 1, findings, stats)
+    return pack(fmt, members)
+
+def pack(fmt, members):
+    buffer = io.BytesIO()
+    if fmt == 'zip':
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for (name, data) in members.items():
+                archive.writestr(zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0)), data, zipfile.ZIP_DEFLATED)
+    elif fmt == 'tar':
+        with tarfile.open(fileobj=buffer, mode='w') as archive:
+            for (name, data) in members.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+    elif fmt == '7z':
+        with py7zr.SevenZipFile(buffer, 'w') as archive:
+            for (name, data) in members.items():
+                archive.writestr(data, name)
+    else:
+        raise ValueError(f'Unsupported archive format: {fmt}')
+    return buffer.getvalue()
+
+def build_tool(tool):
+    if tool == 'trivy':
+        rules = [{'id' : 'aws-access-key-id', 'name' : 'AWS', 'shortDescription' : {'text' : 'AWS Access Key ID'}, 'properties' : {'tags' : ['secret', 'CRITICAL']}}]
+    elif tool == 'gitleaks':
+        rules = [{'id' : 'generic-api-key', 'name' : 'Generic API Key', 'shortDescription' : {'text' : r'api_key = "[0-9a-f]{32}"'}}]
+    elif tool == 'cq':
+        rules = [{'id' : 'cred_password', 'name' : 'cred password', 'shortDescription' : {'text' : r'password = \S+'}, 'properties' : {'tags' : ['secret']}}]
+    else:
+        rules = [{'id' : 'token:Rule:1', 'name' : 'token:Rule:1', 'shortDescription' : {'text' : r'tok_[0-9a-f]{24}'}, 'properties' : {'tags' : []}}]
+    return {'driver' : {'name' : {'trivy' : 'Trivy', 'gitleaks' : 'gitleaks'}.get(tool, tool), 'rules' : rules}}
+
+# Each result is given in the form that the tool itself reports it: Trivy masks the secret within the matched
+# line in its message, Gitleaks gives (off by one) columns, and cq and ccs give the text of the line.
+def build_result(tool, rel_path, line_no, column, secret, line):
+    region = {'startLine' : line_no, 'endLine' : line_no}
+    message = f'{tool} has detected secret for file {rel_path}.'
+    if tool == 'trivy':
+        region.update({'startColumn' : 1, 'endColumn' : 1})
+        masked = line[:column] + '*' * len(secret) + line[column + len(secret):]
+        message = f'Artifact: {rel_path}\nType: \nSecret AWS Access Key ID\nSeverity: CRITICAL\nMatch: {masked.lstrip()}'
+    elif tool == 'gitleaks':
+        # Gitleaks' start columns are one too high, other than on the first line of a file.
+        start_column = column + (2 if line_no > 1 else 1)
+        region.update({'startColumn' : start_column, 'endColumn' : column + len(secret) + 1, 'snippet' : {'text' : secret}})
+    else:
+        region['snippet'] = {'text' : line}
+    return {
+        'ruleId' : build_tool(tool)['driver']['rules'][0]['id'],
+        'message' : {'text' : message},
+        'locations' : [{'physicalLocation' : {'artifactLocation' : {'uri' : rel_path}, 'region' : region}}]
+    }
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,20 @@
 import argparse
 import base64
+import concurrent.futures
+import functools
 import json
 import logging
+import multiprocessing
 import os
 import regex
 import sys
 
 from .bindetect_types import *
+from .bindetect_sniff import *
 
 FILETYPE_ASN1 = 'asn1'
+# Key stores and private keys are small, so by default only files up to this size are recognised by their content.
+DEFAULT_SNIFF_MAX_SIZE = 1024 * 1024
 
 FILENAME_PATTERNS = {
     r'\.bks$': None,               # BouncyCastle KeyStore, proprietary format
@@ -20,15 +26,48 @@ FILENAME_PATTERNS = {
     r'\.ppk$': None                # Putty private key
 }
 
+# All of the patterns combined into a single expression, so that each file name is only tested once. The
+# individual patterns are then only tested against the names that match.
+COMPILED_FILENAME_PATTERNS = list((pattern, regex.compile(pattern)) for pattern in FILENAME_PATTERNS)
+FILENAME_MATCHER = regex.compile('|'.join(f'(?:{pattern})' for pattern in FILENAME_PATTERNS))
+
+# Content that is reported as a secret wherever it is found, whatever the file is called. These rules only
+# apply to files for which no file name rule found anything.
+CONTENT_RULES = {
+    CONTENT_PKCS12 : 'PKCS#12 key store',
+    CONTENT_JKS : 'Java KeyStore',
+    CONTENT_JCEKS : 'Java JCE KeyStore',
+    CONTENT_PPK : 'PuTTY private key',
+    CONTENT_PEM_PRIVATE_KEY : 'PEM encoded private key'
+}
+PEM_PRIVATE_KEY_BLOCK_REGEX = regex.compile(rb'-----BEGIN ((?:[A-Z0-9]+ )*)PRIVATE KEY-----.*?-----END \1PRIVATE KEY-----', regex.DOTALL)
+
+# Counts of the files seen, of the files whose first few KB were sniffed and of the files read in full, so that
+# the effect of filtering can be seen.
+class BinDetectStats:
+    def __init__(self):
+        self.files_seen = 0
+        self.files_sniffed = 0
+        self.bytes_sniffed = 0
+        self.files_examined = 0
+        self.bytes_examined = 0
+
+    def __str__(self):
+        return (f'{self.files_seen} files seen, {self.files_sniffed} files ({self.bytes_sniffed} bytes) sniffed, '
+                f'{self.files_examined} files ({self.bytes_examined} bytes) examined')
+
 def main():
     global args
     args = parse_args()
-    bin_detect(args.srcdir, args.out)
+    bin_detect(args.srcdir, args.out, args.jobs, args.sniff, args.sniff_max_size or None)
 
 def parse_args():
     parser = argparse.ArgumentParser(prog = __file__)
     parser.add_argument('-s', '--srcdir', required=True)
     parser.add_argument('-o', '--out')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='The number of worker processes to use when examining files. Default: 1')
+    parser.add_argument('--sniff', action='store_true', help='Also recognise key stores and private keys by their content, rather than only examining files whose names match. The start of every file up to --sniff-max-size is read')
+    parser.add_argument('--sniff-max-size', type=int, default=DEFAULT_SNIFF_MAX_SIZE, help=f'Only recognise files by their content if they are no larger than this many bytes, or 0 for no limit. Default: {DEFAULT_SNIFF_MAX_SIZE}')
     args = parser.parse_args()
 
     if not args.srcdir:
@@ -36,63 +75,138 @@ def parse_args():
 
     return args
 
-def bin_detect(src_dir, out_path):
-    sarif_findings = list(process_dir(src_dir))
+def bin_detect(src_dir, out_path, jobs = 1, sniff = False, sniff_max_size = DEFAULT_SNIFF_MAX_SIZE, inventory = None):
+    stats = BinDetectStats()
+    sarif_findings = list(process_dir(src_dir, stats, jobs, sniff, sniff_max_size, inventory))
+    logging.info(f'BinDetect: {stats}')
     sarif_rules = build_rules()
     sarif_tool = build_sarif_tool(sarif_rules)
     sarif_doc = build_sarif_doc(sarif_tool, sarif_findings)
-    out_file = sys.stdout if out_path else open(out_path, 'w')
+    out_file = open(out_path, 'w') if out_path else sys.stdout
     try:
-        if out_path:
-            out_file = open(out_path, 'w')
-            json.dump(sarif_doc, out_file, indent=2)
+        json.dump(sarif_doc, out_file, indent=2)
     finally:
         if out_path:
             out_file.close()
+    return stats
 
-def process_dir(src_dir):
+# Candidate files are found by name first and then examined, optionally across a pool of worker processes.
+# If sniffing is enabled, every file up to sniff_max_size bytes (or every file if that is None) is a candidate, but only the
+# first SNIFF_SIZE bytes are read unless its name or content is recognised. Results are always produced in
+# sorted path order, however many jobs run. If an inventory of the directory is given, it is used instead of
+# walking the directory again. Worker processes are spawned rather than forked, as this may run on a worker thread
+# while other threads (e.g. other analysis tools) hold locks that a forked process would inherit.
+def process_dir(src_dir, stats = None, jobs = 1, sniff = False, sniff_max_size = DEFAULT_SNIFF_MAX_SIZE, inventory = None):
     logging.debug('Beginning Binary Detection...')
-    for root, _, files in os.walk(src_dir):
-        for filename in files:
-            try:
-                with open(os.path.join(root, filename), 'rb') as f:
-                    file_data = f.read()
-            except IOError as e:
-                logging.error(f'Error reading file {filename} : {e}')
-                continue
-
-            for filename_pattern in FILENAME_PATTERNS:
-                if not regex.search(filename_pattern, filename):
-                    continue
-
-                secret_segments = handle_file(filename_pattern, file_data)
-                rel_path = get_path_relative_to(os.path.join(root, filename), src_dir)
-                for secret_segment in secret_segments:
-                    sarif_result = {
-                        'ruleId' : f'bin_{filename_pattern}',
-                        'message' : {
-                            'text' : f'bin_{filename_pattern} has detected secret for file {rel_path}.'
-                        },
-                        'locations' : [
-                            {
-                                'physicalLocation' : {
-                                    'artifactLocation' : {
-                                        'uri' : rel_path
-                                    },
-                                    'region' : {
-                                        'byteOffset': secret_segment[0],
-                                        'byteLength': secret_segment[1],
-                                        'snippet' : {
-                                            'binary' : base64.b64encode(file_data[secret_segment[0]:secret_segment[1]]).decode('utf-8')
-                                        }
-                                    }
-                                }
-                            }
-                        ]
+    stats = stats or BinDetectStats()
+    candidates = []
+    if inventory is not None and inventory.is_root(src_dir):
+        for entry in inventory.files():
+            stats.files_seen += 1
+            if (sniff and (sniff_max_size is None or entry.size <= sniff_max_size)) or FILENAME_MATCHER.search(os.path.basename(entry.rel_path)):
+                candidates.append((entry.path, entry.rel_path))
+    else:
+        for root, _, files in os.walk(src_dir):
+            for filename in files:
+                stats.files_seen += 1
+                if FILENAME_MATCHER.search(filename) or (sniff and is_within_sniff_size(os.path.join(root, filename), sniff_max_size)):
+                    candidates.append((os.path.join(root, filename), get_path_relative_to(os.path.join(root, filename), src_dir)))
+    candidates.sort(key=lambda c: c[1] or '')
+
+    process = functools.partial(process_file, sniff=sniff, sniff_max_size=sniff_max_size)
+    if jobs > 1 and len(candidates) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn')) as executor:
+            file_results = executor.map(process, *zip(*candidates), chunksize=max(1, len(candidates) // (jobs * 4)))
+            yield from collect_file_results(file_results, stats)
+    else:
+        yield from collect_file_results((process(path, rel_path) for (path, rel_path) in candidates), stats)
+
+def is_within_sniff_size(path, sniff_max_size):
+    if sniff_max_size is None:
+        return True
+    try:
+        return os.path.getsize(path) <= sniff_max_size
+    except OSError:
+        return False
+
+def collect_file_results(file_results, stats):
+    for (bytes_sniffed, bytes_examined, sarif_results) in file_results:
+        if bytes_sniffed is not None:
+            stats.files_sniffed += 1
+            stats.bytes_sniffed += bytes_sniffed
+        if bytes_examined is not None:
+            stats.files_examined += 1
+            stats.bytes_examined += bytes_examined
+        yield from sarif_results
+
+# Returns the number of bytes sniffed and the number read in full (each None if that did not happen), along
+# with the list of results for the file.
+def process_file(path, rel_path, sniff = False, sniff_max_size = DEFAULT_SNIFF_MAX_SIZE):
+    filename = os.path.basename(path)
+    name_matched = FILENAME_MATCHER.search(filename) is not None
+    bytes_sniffed = None
+    content = None
+    try:
+        with open(path, 'rb') as f:
+            if sniff and (sniff_max_size is None or os.fstat(f.fileno()).st_size <= sniff_max_size):
+                header = f.read(SNIFF_SIZE)
+                bytes_sniffed = len(header)
+                content = sniff_content(header, os.fstat(f.fileno()).st_size)
+                if not name_matched and content not in CONTENT_RULES:
+                    return (bytes_sniffed, None, [])
+                file_data = header + f.read()
+            elif name_matched:
+                file_data = f.read()
+            else:
+                return (None, None, [])
+    except IOError as e:
+        logging.error(f'Error reading file {filename} : {e}')
+        return (bytes_sniffed, None, [])
+
+    sarif_results = []
+    for (filename_pattern, compiled_pattern) in COMPILED_FILENAME_PATTERNS:
+        if not compiled_pattern.search(filename):
+            continue
+
+        secret_segments = handle_file(filename_pattern, file_data)
+        for secret_segment in secret_segments:
+            sarif_results.append(build_sarif_result(f'bin_{filename_pattern}', rel_path, file_data, secret_segment))
+
+    if not sarif_results and content in CONTENT_RULES:
+        for secret_segment in find_content_segments(content, file_data):
+            sarif_results.append(build_sarif_result(f'bin_content_{content}', rel_path, file_data, secret_segment))
+    return (bytes_sniffed, len(file_data), sarif_results)
+
+# Key stores are secret in their entirety, whereas only the key blocks within a PEM file are.
+def find_content_segments(content, file_data):
+    if content == CONTENT_PEM_PRIVATE_KEY:
+        return list(m.span() for m in PEM_PRIVATE_KEY_BLOCK_REGEX.finditer(file_data))
+    return [(0, len(file_data))]
+
+def build_sarif_result(rule_id, rel_path, file_data, secret_segment):
+    return {
+        'ruleId' : rule_id,
+        'message' : {
+            'text' : f'{rule_id} has detected secret for file {rel_path}.'
+        },
+        'locations' : [
+            {
+                'physicalLocation' : {
+                    'artifactLocation' : {
+                        'uri' : rel_path
+                    },
+                    'region' : {
+                        'byteOffset': secret_segment[0],
+                        'byteLength': secret_segment[1] - secret_segment[0],
+                        'snippet' : {
+                            'binary' : base64.b64encode(file_data[secret_segment[0]:secret_segment[1]]).decode('utf-8')
+                        }
                     }
+                }
+            }
+        ]
+    }
 
-                    yield sarif_result
-                
 def get_path_relative_to(path, dir):
     try:
         relpath = os.path.relpath(path, dir)
@@ -127,6 +241,14 @@ def build_rules():
                 'tags' : tags
             }
         })
+    for (content, description) in CONTENT_RULES.items():
+        sarif_rules.append({
+            'id' : f'bin_content_{content}',
+            'name' : f"Binary File Content Matching '{description}'",
+            'properties' : {
+                'tags' : ['secret']
+            }
+        })
     return sarif_rules
 
 def build_sarif_tool(sarif_rules):
@@ -0,0 +1,5 @@
+from . import main
+
+# Worker processes are spawned, and so import this module again; they must not run the tool themselves.
+if __name__ == '__main__':
+    main()
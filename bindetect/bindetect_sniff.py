@@ -0,0 +1,64 @@
+import regex
+
+# The number of bytes at the start of a file that are used to recognise its content.
+SNIFF_SIZE = 4096
+
+CONTENT_DER = 'der'
+CONTENT_PKCS12 = 'pkcs12'
+CONTENT_JKS = 'jks'
+CONTENT_JCEKS = 'jceks'
+CONTENT_PPK = 'ppk'
+CONTENT_PEM_PRIVATE_KEY = 'pem'
+
+JKS_MAGIC = b'\xfe\xed\xfe\xed'
+JCEKS_MAGIC = b'\xce\xce\xce\xce'
+PPK_MAGIC = b'PuTTY-User-Key-File-'
+PEM_PRIVATE_KEY_REGEX = regex.compile(rb'-----BEGIN (?:[A-Z0-9]+ )*PRIVATE KEY-----')
+
+# INTEGER 3 (the PFX version) followed by a ContentInfo SEQUENCE
+PKCS12_VERSION = b'\x02\x01\x03\x30'
+# OBJECT IDENTIFIER 1.2.840.113549.1.7.1 (PKCS#7 data)
+PKCS7_DATA_OID = b'\x06\x09\x2a\x86\x48\x86\xf7\x0d\x01\x07\x01'
+
+# Decode the length of the outermost ASN.1 element, returning the length of its header and of its contents.
+# The contents length is None for the indefinite length form.
+def read_der_length(header):
+    if len(header) < 2:
+        return None
+    first = header[1]
+    if first < 0x80:
+        return (2, first)
+    if first == 0x80:
+        return (2, None)
+    count = first & 0x7f
+    if count > 4 or len(header) < 2 + count:
+        return None
+    return (2 + count, int.from_bytes(header[2:2 + count], 'big'))
+
+# Whether a file starts with an ASN.1 SEQUENCE that fits within the file.
+def is_der_sequence(header, file_size):
+    if not header.startswith(b'\x30'):
+        return False
+    length = read_der_length(header)
+    if length is None:
+        return False
+    (header_length, content_length) = length
+    return content_length is None or header_length + content_length <= file_size
+
+# Classify a file by the first SNIFF_SIZE bytes of its content. Returns one of the CONTENT_* values, or None
+# if the content is not recognised.
+def sniff_content(header, file_size):
+    if header.startswith(JKS_MAGIC):
+        return CONTENT_JKS
+    if header.startswith(JCEKS_MAGIC):
+        return CONTENT_JCEKS
+    if header.startswith(PPK_MAGIC):
+        return CONTENT_PPK
+    if is_der_sequence(header, file_size):
+        (header_length, _) = read_der_length(header)
+        if header[header_length:header_length + len(PKCS12_VERSION)] == PKCS12_VERSION and PKCS7_DATA_OID in header:
+            return CONTENT_PKCS12
+        return CONTENT_DER
+    if PEM_PRIVATE_KEY_REGEX.search(header):
+        return CONTENT_PEM_PRIVATE_KEY
+    return None
@@ -1,11 +1,17 @@
 import asn1
 
+from .bindetect_sniff import SNIFF_SIZE, is_der_sequence
+
 class BinDetectProcessor:
     def __init__(self):
         pass
 
 class Asn1Processor(BinDetectProcessor):
     def process(self, file_bytes):
+        # Only attempt a full decode if the file starts like a DER encoded structure.
+        if not is_der_sequence(file_bytes[:SNIFF_SIZE], len(file_bytes)):
+            return []
+
         try:
             # Run through the ASN.1 decoding process. If the file 
             decoder = asn1.Decoder()
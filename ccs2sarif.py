@@ -9,29 +9,30 @@
 
 import argparse
 import ast
-import json
 import os
 import regex
 import sys
 
+from secretscrub_sarif import write_sarif_doc
+
 def main():
     global args
     args = parse_args()
-    ccs_results_stream = open(args.input, 'r') if args.input else sys.stdin
-    ccs_results = ccs_results_stream.read()
-    ccs_to_sarif(args.ccs, args.srcdir, ccs_results, args.out)
+    ccs_results_stream = open(args.input, 'r', newline='\n') if args.input else sys.stdin
+    ccs_to_sarif(args.ccs, args.srcdir, ccs_results_stream, args.out)
     if args.input:
         ccs_results_stream.close()
 
+# The ccs results may be given either as a single string or as an iterable of lines, such as a stream. In the
+# latter case, each result is converted and written out as soon as its line is read.
 def ccs_to_sarif(ccs_path, src_dir, ccs_results, out_path):
     ccs = Ccs(ccs_path)
     sarif_rules = build_rules(ccs)
     sarif_tool = build_sarif_tool(sarif_rules)
     sarif_findings = process_sarif_findings(sarif_rules, src_dir, ccs_results)
-    sarif_doc = build_sarif_doc(sarif_tool, sarif_findings)
     try:
         out_file = open(out_path, 'w') if out_path else sys.stdout 
-        json.dump(sarif_doc, out_file, indent=2)
+        write_sarif_doc(out_file, sarif_tool, sarif_findings)
     finally:
         if out_path:
             out_file.close()
@@ -78,23 +79,11 @@ def build_sarif_tool(sarif_rules):
     }
     return tool_def
 
-def build_sarif_doc(sarif_tool, sarif_results):
-    sarif_doc = {
-        'version' : '2.1.0',
-        '$schema' : 'https://json.schemastore.org/sarif-2.1.0-rtm.5.json',
-        'runs' : [
-            {
-                'tool' : sarif_tool,
-                'results' : list(sarif_results)
-            }
-        ]
-    }
-    return sarif_doc
-
 def process_sarif_findings(sarif_rules, src_dir, ccs_results):
-    lines = list(line.rstrip('\r') for line in ccs_results.split('\n'))
+    lines = ccs_results.split('\n') if isinstance(ccs_results, str) else ccs_results
 
     for line in lines:
+        line = line.rstrip('\n').rstrip('\r')
         (src_path, src_line, rule_id, src_prefix, src_text) = parse_ccs_output_line(line)
         if not src_path:
             continue
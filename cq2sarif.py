@@ -10,12 +10,13 @@
 import argparse
 import ast
 import glob
-import json
 import logging
 import os
 import regex
 import sys
 
+from secretscrub_sarif import write_sarif_doc
+
 def main():
     global args
     args = parse_args()
@@ -26,10 +27,9 @@ def cq_to_sarif(cq_path, src_dir, cq_results, out_path):
     sarif_rules = build_rules(cq)
     sarif_tool = build_sarif_tool(sarif_rules)
     sarif_findings = process_sarif_findings(sarif_rules, src_dir, cq_results)
-    sarif_doc = build_sarif_doc(sarif_tool, sarif_findings)
     out_file = open(out_path, 'w') if out_path else sys.stdout
     try:
-        json.dump(sarif_doc, out_file, indent=2)
+        write_sarif_doc(out_file, sarif_tool, sarif_findings)
     finally:
         if out_path:
             out_file.close()
@@ -76,60 +76,50 @@ def build_sarif_tool(sarif_rules):
     }
     return tool_def
 
-def build_sarif_doc(sarif_tool, sarif_results):
-    sarif_doc = {
-        'version' : '2.1.0',
-        '$schema' : 'https://json.schemastore.org/sarif-2.1.0-rtm.5.json',
-        'runs' : [
-            {
-                'tool' : sarif_tool,
-                'results' : list(sarif_results)
-            }
-        ]
-    }
-    return sarif_doc
-
+# Results are generated one line of cq output at a time, so that they can be written out as they are produced.
 def process_sarif_findings(sarif_rules, src_dir, cq_results):
-    for path in glob.glob(os.path.join(cq_results,'*.txt')):
+    rule_ids = set(r['id'] for r in sarif_rules)
+    for path in sorted(glob.glob(os.path.join(cq_results,'*.txt'))):
         rule_id = os.path.basename(path)[:-len('.txt')]
-        if not rule_id in [r['id'] for r in sarif_rules]:
+        if not rule_id in rule_ids:
             logging.info(f"Regular expression definition '{rule_id}' not found in CQ library")
             continue
 
         logging.info(f'Processing {rule_id}...')
         with open(path, 'r') as f:
-            lines = f.readlines()
+            yield from process_cq_output_lines(rule_id, src_dir, f)
 
-        for line in lines:
-            (src_path, src_line, src_text) = parse_cq_output_line(line)
-            rel_path = get_path_relative_to(src_path, src_dir)
-            if not rel_path:
-                continue
+def process_cq_output_lines(rule_id, src_dir, lines):
+    for line in lines:
+        (src_path, src_line, src_text) = parse_cq_output_line(line)
+        rel_path = get_path_relative_to(src_path, src_dir)
+        if not rel_path:
+            continue
 
-            sarif_result = {
-                'ruleId' : rule_id,
-                'message' : {
-                    'text' : f'{rule_id} has detected secret for file {rel_path}.'
-                },
-                'locations' : [
-                    {
-                        'physicalLocation' : {
-                            'artifactLocation' : {
-                                'uri' : rel_path
-                            },
-                            'region' : {
-                                'startLine' : src_line,
-                                'endLine' : src_line,
-                                'snippet' : {
-                                    'text' : src_text.rstrip('\r\n')
-                                }
+        sarif_result = {
+            'ruleId' : rule_id,
+            'message' : {
+                'text' : f'{rule_id} has detected secret for file {rel_path}.'
+            },
+            'locations' : [
+                {
+                    'physicalLocation' : {
+                        'artifactLocation' : {
+                            'uri' : rel_path
+                        },
+                        'region' : {
+                            'startLine' : src_line,
+                            'endLine' : src_line,
+                            'snippet' : {
+                                'text' : src_text.rstrip('\r\n')
                             }
                         }
                     }
-                ]
-            }
+                }
+            ]
+        }
 
-            yield sarif_result
+        yield sarif_result
 
 WINDOWS_PATH_REGEX = regex.compile(r'^[a-zA-Z]:[/\\]')
 def parse_cq_output_line(line):
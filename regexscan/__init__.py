@@ -0,0 +1,196 @@
+# Released as open source by NCC Group Plc - https://www.nccgroup.com/
+#
+# Developed by:
+#     Andrew Kisliakov (andrew.kisliakov@nccgroup.com)
+#
+# Project link: https://www.github.com/nccgroup/secretscrub/
+#
+# Released under AGPL-3.0. See LICENSE for more information.
+
+import concurrent.futures
+import io
+import logging
+import multiprocessing
+import os
+import regex
+
+from cq2sarif import Cq
+from ccs2sarif import Ccs
+from secretscrub_redaction import TEXT_ENCODING
+
+TOOL_NAME = 'RegexScan'
+CATALOG_CQ = 'cq'
+CATALOG_CCS = 'ccs'
+# The same selection of cq checks that is made when cq itself is run.
+CQ_CHECK_PREFIX = 'cred'
+BINARY_SNIFF_SIZE = 8192
+# Expressions containing backreferences cannot safely be combined with others, as their group numbers would change.
+BACKREFERENCE_REGEX = regex.compile(r'\\[1-9]|\(\?P=|\\g<')
+
+# The line-based checks from the cq and ccs catalogs, compiled into a single combined expression. Each line is
+# tested once against the combined expression, and only lines that match are tested against the individual
+# checks to find out which of them matched. Checks that cannot be combined are always tested individually.
+class RegexMatcher:
+    def __init__(self, checks):
+        self.checks = []
+        combinable = []
+        for (rule_id, pattern) in checks:
+            try:
+                compiled = regex.compile(pattern)
+            except Exception as e:
+                logging.debug(f'Unable to compile regular expression for {rule_id} "{pattern}": {e}')
+                continue
+            self.checks.append((rule_id, compiled))
+            if not BACKREFERENCE_REGEX.search(pattern):
+                combinable.append(pattern)
+
+        self.combined = None
+        self.uncombined = list(check for check in self.checks if BACKREFERENCE_REGEX.search(check[1].pattern))
+        if combinable:
+            try:
+                self.combined = regex.compile('|'.join(f'(?:{pattern})' for pattern in combinable))
+            except Exception as e:
+                logging.debug(f'Unable to combine regular expressions: {e}')
+                self.uncombined = self.checks
+
+    # Yields the rule ID and span of each match within a single line.
+    def match_line(self, line):
+        checks = self.checks if self.combined and self.combined.search(line) else self.uncombined
+        for (rule_id, compiled) in checks:
+            for match in compiled.finditer(line):
+                if match.end() > match.start():
+                    yield (rule_id, match.span())
+
+# Read the line-based checks from the cq and ccs scripts. Either may be missing, in which case its checks are
+# simply not used. Rule IDs are prefixed with the catalog that they came from.
+def load_checks(cq_path, ccs_path):
+    checks = []
+    if cq_path and os.path.isfile(cq_path):
+        for (check, pattern) in Cq(cq_path).line_regex_checks.items():
+            if check.startswith(CQ_CHECK_PREFIX):
+                checks.append((f'{CATALOG_CQ}/{check}', pattern))
+    else:
+        logging.warning(f'cq rule catalog not found at "{cq_path}"')
+    if ccs_path and os.path.isfile(ccs_path):
+        for (check, pattern) in Ccs(ccs_path).line_regex_checks.items():
+            checks.append((f'{CATALOG_CCS}/{check}', pattern))
+    else:
+        logging.warning(f'ccs rule catalog not found at "{ccs_path}"')
+    return checks
+
+def build_rules(checks):
+    return list({
+        'id' : rule_id,
+        'name' : rule_id.split('/', 1)[1].replace('-',' ').replace('_',' '),
+        'shortDescription' : {
+            'text' : pattern
+        },
+        'properties' : {
+            'tags' : ['secret']
+        }
+    } for (rule_id, pattern) in checks)
+
+# The results of a scan, presented in the same way as a SARIF run read by secretscrub_sarif so that they can be
+# collected for redaction without ever being written out.
+class RegexScanRun:
+    def __init__(self, name, checks, results):
+        self.path = name
+        self.run_data = {
+            'tool' : {
+                'driver' : {
+                    'fullName' : TOOL_NAME,
+                    'name' : TOOL_NAME,
+                    'rules' : build_rules(checks)
+                }
+            }
+        }
+        self.results = results
+
+    def get_tool_name(self):
+        return TOOL_NAME
+
+    def get_results(self):
+        return iter(self.results)
+
+# Scan every file beneath src_dir (other than within .git directories), optionally across a pool of worker
+# processes. Results are always produced in sorted path order, however many jobs run. Workers are spawned rather
+# than forked, as the scan runs on a worker thread while other analysis tools' threads may be holding locks.
+def regex_scan(src_dir, checks, name = TOOL_NAME, jobs = 1):
+    candidates = []
+    for (root, dirs, files) in os.walk(src_dir):
+        dirs[:] = list(d for d in dirs if d != '.git')
+        for filename in files:
+            path = os.path.join(root, filename)
+            candidates.append((path, os.path.relpath(path, src_dir).replace('\\', '/')))
+    candidates.sort(key=lambda c: c[1])
+    logging.info(f'{TOOL_NAME}: scanning {len(candidates)} files with {len(checks)} checks')
+
+    results = []
+    if jobs > 1 and len(candidates) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn'), initializer=init_worker, initargs=(checks,)) as executor:
+            for file_results in executor.map(scan_file_in_worker, *zip(*candidates), chunksize=max(1, len(candidates) // (jobs * 4))):
+                results.extend(file_results)
+    else:
+        matcher = RegexMatcher(checks)
+        for (path, rel_path) in candidates:
+            results.extend(scan_file(matcher, path, rel_path))
+    return RegexScanRun(name, checks, results)
+
+# Each worker process compiles the checks once, rather than once per file.
+Worker_Matcher = None
+def init_worker(checks):
+    global Worker_Matcher
+    Worker_Matcher = RegexMatcher(checks)
+
+def scan_file_in_worker(path, rel_path):
+    return scan_file(Worker_Matcher, path, rel_path)
+
+# Files are read as text in the same encoding that is used for redaction, and with the same line endings, so that
+# line numbers and snippets always agree with it. Binary files and files that cannot be decoded are skipped.
+def scan_file(matcher, path, rel_path):
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except IOError as e:
+        logging.error(f'Error reading file {rel_path} : {e}')
+        return []
+    if b'\0' in data[:BINARY_SNIFF_SIZE]:
+        return []
+    try:
+        text = data.decode(TEXT_ENCODING)
+    except UnicodeDecodeError:
+        logging.debug(f'Skipping file {rel_path} which cannot be decoded as {TEXT_ENCODING}')
+        return []
+
+    results = []
+    for (line_number, line) in enumerate(io.StringIO(text, newline=''), start=1):
+        line = line.rstrip('\r\n')
+        for (rule_id, (start, end)) in matcher.match_line(line):
+            results.append(build_result(rule_id, rel_path, line_number, start, end, line[start:end]))
+    return results
+
+def build_result(rule_id, rel_path, line_number, start, end, text):
+    return {
+        'ruleId' : rule_id,
+        'message' : {
+            'text' : f'{rule_id} has detected secret for file {rel_path}.'
+        },
+        'locations' : [
+            {
+                'physicalLocation' : {
+                    'artifactLocation' : {
+                        'uri' : rel_path
+                    },
+                    'region' : {
+                        'startLine' : line_number,
+                        'endLine' : line_number,
+                        'startColumn' : start + 1,
+                        'endColumn' : end + 1,
+                        'snippet' : {
+                            'text' : text
+                        }
+                    }
+                }
+            }
+        ]
+    }
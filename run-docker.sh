@@ -29,6 +29,11 @@ while [[ $# -gt 0 ]]; do
       shift # past argument
       shift # past value
       ;;
+    -j|--jobs)
+      JOBS_ARG="--jobs $2"
+      shift # past argument
+      shift # past value
+      ;;
     -x|--process-archives)
       PROCESS_ARCHIVES_ARG="--process-archives"
       shift # past argument
@@ -92,9 +97,9 @@ rm -rf "$OUT_DIR/src-redacted" || exit 1
 mkdir -p "$OUT_DIR/src-redacted" || exit 1
 
 if [ "" = "$ANALYSE_WITH" ]; then
-  python /app/secretscrub.py $PROCESS_ARCHIVES_ARG $LOG_LEVEL_ARG --input "$ANALYSIS_DIR" --srcdir /src --outdir "$OUT_DIR/src-redacted" --report "$OUT_DIR/secretscrub-report.csv" || exit 1
+  python /app/secretscrub.py $PROCESS_ARCHIVES_ARG $JOBS_ARG $LOG_LEVEL_ARG --input "$ANALYSIS_DIR" --srcdir /src --outdir "$OUT_DIR/src-redacted" --report "$OUT_DIR/secretscrub-report.csv" || exit 1
 else
-  python /app/secretscrub.py $PROCESS_ARCHIVES_ARG $LOG_LEVEL_ARG --analyse-with "$ANALYSE_WITH" --srcdir /src --outdir "$OUT_DIR/src-redacted" --report "$OUT_DIR/secretscrub-report.csv" || exit 1
+  python /app/secretscrub.py $PROCESS_ARCHIVES_ARG $JOBS_ARG $LOG_LEVEL_ARG --analyse-with "$ANALYSE_WITH" --srcdir /src --outdir "$OUT_DIR/src-redacted" --report "$OUT_DIR/secretscrub-report.csv" || exit 1
 fi
 
 # Because the user within the Docker container may not be the same as the user 
@@ -8,26 +8,37 @@
 # Released under AGPL-3.0. See LICENSE for more information.
 
 import argparse
+import asyncio
+import concurrent.futures
 import functools
 import getpass
-import io
+import glob
+import hashlib
 import logging
+import multiprocessing
 import os
 import regex
 import shutil
 from string import Template
 import sys
 import tempfile
+import time
 from ruamel.yaml import YAML
 
-from sarif import loader as sarif_loader
-
 from secretscrub_types import *
 from secretscrub_report import SecretScrubReport, SecretScrubReportEncryption as ReportEncryption
+from secretscrub_sarif import load_sarif_stream
+from secretscrub_incremental import IncrementalState
+from secretscrub_findings_cache import FindingsCache
+from secretscrub_metrics import Metrics, METRICS_FORMATS
+from secretscrub_redaction import RedactionEntry, RedactionTargets, redact_target, resolve_source_path, validate_location_binary, validate_location_text
 from cq2sarif import cq_to_sarif
 from ccs2sarif import ccs_to_sarif
+import bindetect
 from bindetect import bin_detect
-from archive import unpack_archives, repack_archives
+from archive import ArchiveRegistry, FileTypeCache, unpack_archives, repack_archives
+from util.inventory import Inventory, FILE_TYPE_DIR
+import regexscan
 
 import util
 
@@ -39,6 +50,7 @@ TOOL_NAME_BINDETECT = 'BinDetect'
 TOOL_NAME_CQ = 'cq'
 TOOL_NAME_CCS = 'ccs'
 TOOL_NAME_GITLEAKS = 'Gitleaks'
+TOOL_NAME_REGEXSCAN = regexscan.TOOL_NAME
 TOOL_NAME_TRIVY = 'Trivy'
 
 def parse_args():
@@ -49,54 +61,130 @@ def parse_args():
     input_group = parser.add_mutually_exclusive_group(required=True)
     input_group.add_argument('-i', '--input', metavar='DIRECTORY', help='A directory containing a number of pre-generated SARIF files containing details of detected secrets')
     input_group.add_argument('-a', '--analyse-with', '--analyze-with', metavar='TOOL_LIST', help='A comma-separated list of tools to run')
+    parser.add_argument('--tool-timeout', metavar='SECONDS', type=float, help='The maximum time that any single analysis tool may run for before all analysis is abandoned')
+    parser.add_argument('--max-concurrent-tools', metavar='N', type=int, help='The maximum number of analysis tools to run at the same time. Default: all selected tools')
     parser.add_argument('-x', '--process-archives', action='store_true', help='Extract the contents of any archives and search for secrets found there')
+    parser.add_argument('--filetype-cache', metavar='CACHE_FILE', help='A file in which to keep the results of archive detection between runs, so that unchanged files need not be examined again. The file is created or updated once archives have been extracted')
+    parser.add_argument('--scratch-dir', metavar='DIRECTORY', help='A directory in which to create the scratch area used to hold the contents of expanded archives. Placing this on fast local storage or tmpfs can speed up archive processing. Default: the system temporary directory')
     parser.add_argument('-s', '--srcdir', required=True, metavar='DIRECTORY', help='The directory containing the original codebase from which the SARIF files were generated')
     parser.add_argument('-o', '--outdir', required=True, metavar='DIRECTORY', help='A directory to store a copy of the provided codebase with secrets redacted')
     parser.add_argument('--placeholder', metavar='TEXT', help='The placeholder to insert in place of all detected secrets. This can accept the following substitutions:\n- ${tool} The name of the tool used to detect the secret\n- ${rule} The name of the rule used to detect the secret\n- ${regex} The regular expression associated with the rule used to detect the secret\n- ${yaml} A YAML flow style structure containing (if known) only the names of the tool and the rule used to detect the secret\n- ${yaml_regex} A YAML flow style structure containing (if known) the names of the tool and rule and the regular expression used to detect the secret',
                         default=DEFAULT_PLACEHOLDER_FORMAT)
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=1, help='The number of worker processes to use when redacting files and running BinDetect and RegexScan, and of threads to use when extracting and repacking archives. Default: 1')
+    parser.add_argument('--bindetect-sniff', action='store_true', help='Also recognise key stores and private keys in BinDetect by their content, rather than only by their file names. The start of every file up to --bindetect-sniff-max-size is read, and private key blocks in text files are redacted')
+    parser.add_argument('--bindetect-sniff-max-size', metavar='BYTES', type=int, default=bindetect.DEFAULT_SNIFF_MAX_SIZE, help=f'The largest file that BinDetect will recognise by its content when --bindetect-sniff is given, or 0 for no limit. Files of any size are still recognised by name. Default: {bindetect.DEFAULT_SNIFF_MAX_SIZE}')
+    parser.add_argument('--link-mode', metavar='MODE', choices=util.LINK_MODES, default='copy', help='How files that need no redaction are placed into the output directory:\n- copy: Copy each file\n- reflink: Use copy-on-write clones where the filesystem supports them\n- hardlink: Use hard links to the original files\n- auto: Use reflinks, then hard links, whichever is available\nIf the chosen method is unavailable, files are copied. Default: copy')
+    parser.add_argument('--findings-cache', metavar='DIRECTORY', help='A directory in which to keep the results of each analysis tool for each file content, which may be shared between runs and source trees. Tools are only run over files whose content, path, tool version and rules have not been seen before. The cache holds the text of every secret that was found, so it should be protected as carefully as the source itself')
+    parser.add_argument('--incremental', metavar='STATE_FILE', help='Only process files that are new or have changed since the run that produced the given state file, reusing the previous output and report entries for everything else. The state file is created or updated on completion')
     parser.add_argument('-r', '--report', metavar='PATH', help='The path to a CSV file which will contain a report with details of all the redacted secrets')
     parser.add_argument('--report-encryption', metavar='FORMAT', help='The format to use when encrypting the report', 
                         type=ReportEncryption.argparse, 
                         choices=list(ReportEncryption), default=ReportEncryption.ZIP_AES256)
+    parser.add_argument('--metrics', metavar='PATH', help='A file to which to write a summary of the run: the wall and CPU time and bytes read and written by each stage, and the number of results with each status from each tool. The file is written even if the run fails')
+    parser.add_argument('--metrics-format', metavar='FORMAT', choices=METRICS_FORMATS, default='json', help='The format of the metrics file:\n- json: A JSON document\n- prometheus: The Prometheus text format, for the node exporter\'s textfile collector\nDefault: json')
     parser.add_argument('-l', '--log-level', metavar='LEVEL', help='The logging level to use')
     args = parser.parse_args(args=None if sys.argv[1:] else ['--help'])
     return args
 
 def main(args):
     init_logging(args.log_level)
+    metrics = Metrics(args.metrics, args.metrics_format)
     report = SecretScrubReport(args.report, args.report_encryption)
+    if metrics.enabled:
+        # Rows replayed for unchanged files are counted too, so that the counts describe the whole report.
+        report.add_row_observer(metrics.record_row, replayed=True)
     encryption_key_prompt = report.prompt_encryption_key()
     if encryption_key_prompt:
         report.set_encryption_key(getpass.getpass(prompt=f'{encryption_key_prompt} : '))
 
     tmp_dir = None
-    src_dir = args.srcdir
+    # The source is made up of one or more layers which are overlaid on top of each other. The original source
+    # directory is never modified; if archives are being processed, their expanded contents are placed in a
+    # separate scratch directory which mirrors the layout of the source directory.
+    src_dirs = [args.srcdir]
+    analysis_dir = args.srcdir
+    incremental = None
     try:
-        if args.process_archives:
-            logging.info(f'Archive extraction requested. Copying to intermediate temporary directory...')
-            tmp_dir = util.os.path.realpath(tempfile.mkdtemp())
-            new_src_dir =  util.os.path.join(tmp_dir, os.path.basename(src_dir))
-            shutil.copytree(src_dir, new_src_dir)
-            src_dir = new_src_dir
-
-            logging.info(f'Extracting archives...')
-            unpack_archives(src_dir, report)
+        if args.process_archives or args.incremental or args.findings_cache:
+            tmp_dir = util.os.path.realpath(tempfile.mkdtemp(prefix='secretscrub-', dir=args.scratch_dir))
+
+        # The source directory is walked once, and every later stage that would otherwise walk it uses this instead.
+        with metrics.stage('inventory'):
+            inventory = Inventory.scan(args.srcdir)
+        metrics.add_inventory(inventory)
+
+        if args.incremental:
+            incremental = IncrementalState(args.incremental, build_incremental_settings(args))
+            incremental.scan(args.srcdir, args.outdir, inventory)
+            incremental.remove_stale_outputs(args.outdir)
+            report.add_row_observer(incremental.record_row)
+            # Only the new and changed files are handed to the analysis tools.
+            analysis_dir = incremental.stage_changed_files(args.srcdir, util.os.path.join(tmp_dir, 'staged'))
 
-        if args.analyse_with:
+        if args.process_archives:
+            archive_dir = util.os.path.join(tmp_dir, 'archives')
+            logging.info(f'Archive extraction requested. Extracting archives to scratch directory "{archive_dir}"...')
+            if incremental:
+                incremental.add_root(archive_dir)
+            archive_registry = ArchiveRegistry(archive_dir)
+            filetype_cache = FileTypeCache(args.filetype_cache)
+            with metrics.stage('unpack') as stage:
+                unpack_archives(analysis_dir, report, archive_dir, archive_registry, args.jobs, inventory, filetype_cache)
+            stage['bytes_read'] = metrics.get_file_sizes(archive['archive_path'] for archive in archive_registry.archives.values())
+            stage['bytes_written'] = metrics.get_dir_size(archive_dir)
+            filetype_cache.save()
+            src_dirs.append(archive_dir)
+
+        if args.analyse_with and incremental and not incremental.changed:
+            logging.info(f'No new or changed files to analyse')
+            input = None
+            runs = []
+        elif args.analyse_with:
             logging.info(f'Analysis requested: {args.analyse_with}')
-            input = run_analysis(args.analyse_with.split(','), src_dir)
+            findings_cache = FindingsCache(args.findings_cache, util.os.path.join(tmp_dir, 'findings')) if args.findings_cache else None
+            with metrics.stage('analysis'):
+                (input, runs) = run_analysis(args.analyse_with.split(','), [analysis_dir] + src_dirs[1:], args.max_concurrent_tools, args.tool_timeout,
+                                             build_tool_options(args, inventory), findings_cache, metrics)
+            if findings_cache:
+                logging.info(f'Findings cache: {findings_cache.hits} hits, {findings_cache.misses} misses')
         else:
             logging.info(f'No analysis requested')
             input = args.input
+            runs = []
 
-        for file_type, file_subdir, file_path in get_input_files(input):
+        targets = RedactionTargets()
+        for file_type, file_subdir, file_path in (get_input_files(input) if input else []):
             if file_type == 'sarif':
-                process_sarif_file(file_path, file_subdir, src_dir, args.outdir, report, args.placeholder)
-
-        copy_remaining_files(src_dir, args.outdir)
+                with metrics.stage('sarif', os.path.join(file_subdir, os.path.basename(file_path)), metrics.get_file_sizes([file_path])):
+                    process_sarif_file(file_path, file_subdir, targets, args.placeholder)
+        for run in runs:
+            with metrics.stage('sarif', run.path):
+                process_sarif_run(run, run.path, '', targets, args.placeholder)
+        if incremental:
+            targets.filter(incremental.is_changed_artifact)
+        with metrics.stage('redaction', bytes_read=metrics.get_file_sizes(resolve_source_path(src_dirs, target.artifact_path) for target in targets)) as stage:
+            modified_paths = redact_targets(targets, src_dirs, args.outdir, report, args.jobs)
+        stage['bytes_written'] = metrics.get_file_sizes(os.path.join(args.outdir, path) for path in modified_paths)
+
+        with metrics.stage('copy') as stage:
+            stage['bytes_read'] = stage['bytes_written'] = copy_remaining_files(args.srcdir, args.outdir, args.link_mode, inventory)
         if args.process_archives:
+            # Archives with no modified contents are left exactly as they were copied from the source directory.
+            # Modified archives are rebuilt from the original archive and their redacted members, so the rest of
+            # the expanded contents never need to be copied to the output.
+            for path in modified_paths:
+                archive_registry.mark_modified(path)
             logging.info(f'Updating archives...')
-            repack_archives(args.outdir, report)
+            dirty_archives = list(archive_registry.archives[rel_path] for rel_path in archive_registry.dirty_archives())
+            with metrics.stage('repack', bytes_read=metrics.get_file_sizes(archive['archive_path'] for archive in dirty_archives)) as stage:
+                repack_archives(args.outdir, report, archive_registry, args.jobs)
+            stage['bytes_written'] = metrics.get_file_sizes(os.path.join(args.outdir, os.path.dirname(rel_path), archive_registry.archives[rel_path]['archive_name'])
+                                                            for rel_path in archive_registry.dirty_archives())
+
+        if incremental:
+            incremental.log_unchanged_rows(report)
+            incremental.save(args.outdir)
+        metrics.completed = True
     finally:
         try:
             report.close()
@@ -110,8 +198,36 @@ def main(args):
             if tmp_dir:
                 shutil.rmtree(tmp_dir)
         except Exception as e:
-            logging.error(f'Error deleting temporary source directory: {e}')
+            logging.error(f'Error deleting scratch directory: {e}')
 
+        try:
+            metrics.save()
+        except Exception as e:
+            logging.error(f'Error writing metrics file: {e}')
+
+# Anything that affects what is produced from an otherwise unchanged source file. If any of these change, the
+# previous incremental state is discarded. When pre-generated SARIF files are used, they are included too.
+def build_incremental_settings(args):
+    settings = {
+        'analyse_with' : args.analyse_with,
+        'placeholder' : args.placeholder,
+        'process_archives' : args.process_archives
+    }
+    tool_options = build_tool_options(args)
+    for tool in (args.analyse_with.split(',') if args.analyse_with else []):
+        for option in Tool_Result_Options.get(tool, []):
+            settings[f'{tool}_{option}'] = tool_options[tool][option]
+    if args.input:
+        settings['input'] = list([file_subdir, os.path.basename(file_path), util.hash_file(file_path)]
+                                 for (file_type, file_subdir, file_path) in sorted(get_input_files(args.input)))
+    return settings
+
+# The options passed to the in-process tools.
+def build_tool_options(args, inventory = None):
+    return {
+        'bindetect' : {'jobs' : args.jobs, 'inventory' : inventory, 'sniff' : args.bindetect_sniff, 'sniff_max_size' : args.bindetect_sniff_max_size or None},
+        'regexscan' : {'jobs' : args.jobs}
+    }
 
 def init_logging(loglevel):
     loglevel = loglevel.upper() if loglevel else 'INFO'
@@ -122,52 +238,214 @@ def init_logging(loglevel):
     
         logging.basicConfig(level = mapping[loglevel])
 
-def run_analysis(tools, src_dir):
+# Run each of the tools over every source layer. The results for additional layers are written to separately
+# named SARIF files but, because each layer mirrors the layout of the source directory, the artifact paths
+# within them are all relative to the same root. Returns the directory containing the SARIF files, along with the
+# runs produced by in-process tools and taken from the findings cache, which are never written out.
+def run_analysis(tools, src_dirs, max_concurrent_tools=None, tool_timeout=None, tool_options=None, findings_cache=None, metrics=None):
     result_dir = tempfile.mkdtemp()
-    for tool in tools:
-        if tool == 'trivy':
-            run_trivy(src_dir, result_dir)
-        elif tool == 'gitleaks':
-            run_gitleaks(src_dir, result_dir)
-        elif tool == 'cq':
-            run_cq(src_dir, result_dir)
-        elif tool == 'ccs':
-            run_ccs(src_dir, result_dir)
-        elif tool == 'bindetect':
-            run_bindetect(src_dir, result_dir)
-
-    return result_dir
-
-def run_trivy(src_dir, result_dir):
+    runs = asyncio.run(run_tools(tools, src_dirs, result_dir, max_concurrent_tools, tool_timeout, tool_options, findings_cache, metrics))
+    return (result_dir, runs)
+
+# Run the selected tools concurrently. If any tool fails or times out, all of the others are cancelled (and
+# their processes killed) before the error is propagated. Any tool-specific options are passed to the tool's
+# runner as keyword arguments. Runners that produce their results in memory return them as a SARIF run, and
+# these are all returned. If a findings cache is given, each tool is only run over the files it has no results for.
+# If metrics are being gathered, each tool's run over each layer is a stage of its own.
+async def run_tools(tools, src_dirs, result_dir, max_concurrent_tools=None, tool_timeout=None, tool_options=None, findings_cache=None, metrics=None):
+    src_dirs = [src_dirs] if isinstance(src_dirs, str) else src_dirs
+    metrics = metrics or Metrics()
+    semaphore = asyncio.Semaphore(max_concurrent_tools or max(1, len(tools) * len(src_dirs)))
+    start_time = time.monotonic()
+    tasks = list(asyncio.create_task(run_timed_tool(tool, src_dir, result_dir, (f'-{layer}' if layer else ''), semaphore, tool_timeout, (tool_options or {}).get(tool, {}), findings_cache, metrics))
+                 for tool in tools for (layer, src_dir) in enumerate(src_dirs))
+    try:
+        runs = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    logging.info(f'Analysis completed in {time.monotonic() - start_time:.2f}s')
+    return list(run for tool_runs in runs for run in tool_runs)
+
+async def run_timed_tool(tool, src_dir, result_dir, result_suffix, semaphore, tool_timeout, options={}, findings_cache=None, metrics=None):
+    if not tool in Tool_Runners:
+        logging.warning(f'Unrecognised tool: {tool}')
+        return []
+    metrics = metrics or Metrics()
+    async with semaphore:
+        start_time = time.monotonic()
+        with metrics.stage('tool', f'{tool}{result_suffix}', metrics.get_dir_size(src_dir)):
+            try:
+                if findings_cache:
+                    runs = await asyncio.wait_for(run_cached_tool(tool, src_dir, result_dir, result_suffix, findings_cache, options), tool_timeout)
+                else:
+                    run = await asyncio.wait_for(Tool_Runners[tool](src_dir, result_dir, result_suffix, **options), tool_timeout)
+                    runs = [run] if run is not None else []
+            except asyncio.TimeoutError:
+                logging.error(f'{tool} did not complete within {tool_timeout}s')
+                raise
+            except asyncio.CancelledError:
+                logging.warning(f'{tool} was cancelled after {time.monotonic() - start_time:.2f}s')
+                raise
+            except Exception as e:
+                logging.error(f'{tool} failed after {time.monotonic() - start_time:.2f}s: {e}')
+                raise
+        logging.info(f'{tool} completed in {time.monotonic() - start_time:.2f}s ({src_dir})')
+        return runs
+
+# Run a tool over only those files whose results are not already in the findings cache, by staging them in a
+# separate tree. The tool's results for those files are added to the cache, and its SARIF output is then
+# processed as usual. The cached results for all other files are returned as a run of their own.
+# Cached results are only shared between files at different paths for tools whose rules depend on nothing more
+# than a file's name and content; Trivy and Gitleaks, for example, allowlist whole directories.
+async def run_cached_tool(tool, src_dir, result_dir, result_suffix, findings_cache, options):
+    fingerprint = await Tool_Fingerprints[tool]()
+    if fingerprint is None:
+        logging.warning(f'Unable to identify the version of {tool}. Its results will not be cached')
+        run = await Tool_Runners[tool](src_dir, result_dir, result_suffix, **options)
+        return [run] if run is not None else []
+
+    tool_key = findings_cache.get_tool_key(tool, *fingerprint, dict((k, options[k]) for k in Tool_Result_Options.get(tool, []) if k in options))
+    share_by_name = tool in Path_Independent_Tools
+    (cached_run, missed_paths) = await asyncio.to_thread(findings_cache.partition, tool_key, src_dir, f'cache-{tool}{result_suffix}', share_by_name)
+    runs = [cached_run] if cached_run else []
+    logging.info(f'{tool}: {len(missed_paths)} files not found in the findings cache ({src_dir})')
+    if not missed_paths:
+        return runs
+
+    os.makedirs(findings_cache.scratch_dir, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(prefix=f'{tool}-src-', dir=findings_cache.scratch_dir)
+    tool_result_dir = tempfile.mkdtemp(prefix=f'{tool}-results-', dir=findings_cache.scratch_dir)
+    try:
+        await asyncio.to_thread(findings_cache.stage, src_dir, missed_paths, staging_dir)
+        run = await Tool_Runners[tool](staging_dir, tool_result_dir, result_suffix, **options)
+        sarif_paths = list(file_path for (file_type, file_subdir, file_path) in get_input_files(tool_result_dir) if file_type == 'sarif' and not file_subdir)
+        sarif_runs = ([run] if run is not None else []) + list(sarif_run for path in sarif_paths for sarif_run in load_sarif_stream(path).runs)
+        await asyncio.to_thread(findings_cache.store, tool_key, src_dir, missed_paths, sarif_runs, share_by_name)
+        for path in sarif_paths:
+            shutil.move(path, os.path.join(result_dir, os.path.basename(path)))
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        shutil.rmtree(tool_result_dir, ignore_errors=True)
+    return runs + ([run] if run is not None else [])
+
+async def run_trivy(src_dir, result_dir, result_suffix=''):
     logging.info("Running analysis using Trivy...")
     trivy_exes = ['trivy']
     if util.is_windows():
         trivy_exes.append('trivy.bat')
-    completed = util.run_tool(trivy_exes, 'fs', '--scanners', 'secret', '--format', 'sarif', '--output', os.path.join(result_dir, '50-trivy.sarif'), '.', cwd=src_dir)
+    completed = await util.run_tool_async(trivy_exes, 'fs', '--scanners', 'secret', '--format', 'sarif', '--output', os.path.join(result_dir, f'50-trivy{result_suffix}.sarif'), '.', cwd=src_dir)
     completed.check_returncode()
 
-def run_gitleaks(src_dir, result_dir):
+async def run_gitleaks(src_dir, result_dir, result_suffix=''):
     logging.info("Running analysis using GitLeaks...")
-    completed = util.run_tool('gitleaks', 'detect', '--no-git', '--exit-code', '0', '--source', '.', '--report-format', 'sarif', '--report-path', os.path.join(result_dir, '50-gitleaks.sarif'), cwd=src_dir)
+    completed = await util.run_tool_async('gitleaks', 'detect', '--no-git', '--exit-code', '0', '--source', '.', '--report-format', 'sarif', '--report-path', os.path.join(result_dir, f'50-gitleaks{result_suffix}.sarif'), cwd=src_dir)
     completed.check_returncode()
 
-def run_cq(src_dir, result_dir):
+async def run_cq(src_dir, result_dir, result_suffix=''):
     logging.info("Running analysis using cq...")
     cq_path = os.path.join(os.path.dirname(__file__), 'cq', 'cq.py')
-    completed = util.run_tool('python', cq_path, '-p', '-v', '-c', '^cred._*', '-ns', '-sa', result_dir, cwd=src_dir)
+    # Each cq run gets its own directory for its raw output so that concurrent runs cannot mix their results.
+    cq_results_dir = tempfile.mkdtemp(prefix='cq-', dir=result_dir)
+    completed = await util.run_tool_async('python', cq_path, '-p', '-v', '-c', '^cred._*', '-ns', '-sa', cq_results_dir, cwd=src_dir)
     completed.check_returncode()
-    cq_to_sarif(cq_path, src_dir, result_dir, os.path.join(result_dir, '99-cq.sarif'))
+    await asyncio.to_thread(cq_to_sarif, cq_path, src_dir, cq_results_dir, os.path.join(result_dir, f'99-cq{result_suffix}.sarif'))
 
-def run_ccs(src_dir, result_dir):
+async def run_ccs(src_dir, result_dir, result_suffix=''):
     logging.info("Running analysis using ccs...")
     ccs_path = os.path.join(os.path.dirname(__file__), 'ccs', 'ccs.py')
-    ccs_output = util.run_tool('python', ccs_path, '-p', '-v', '-ns', '-sa', '-dupes', '-everything', result_dir, cwd=src_dir, return_output=True)
-    ccs_to_sarif(ccs_path, src_dir, ccs_output, os.path.join(result_dir, '99-ccs.sarif'))
-
-def run_bindetect(src_dir, result_dir):
+    # ccs writes its results to stdout, which is converted line by line as it is produced.
+    sarif_path = os.path.join(result_dir, f'99-ccs{result_suffix}.sarif')
+    await util.run_tool_streamed('python', ccs_path, '-p', '-v', '-ns', '-sa', '-dupes', '-everything', result_dir, cwd=src_dir,
+                                 consume=lambda ccs_output: ccs_to_sarif(ccs_path, src_dir, ccs_output, sarif_path))
+
+# BinDetect runs in-process on a worker thread. It cannot be interrupted once started, so a timeout or
+# cancellation only stops the analysis from waiting for it. The inventory is only used for the layer it describes.
+async def run_bindetect(src_dir, result_dir, result_suffix='', jobs=1, inventory=None, sniff=False, sniff_max_size=bindetect.DEFAULT_SNIFF_MAX_SIZE):
     logging.info("Running analysis using BinDetect...")
-    bin_detect(src_dir, os.path.join(result_dir, '70-bindetect.sarif'))
-    
+    await asyncio.to_thread(bin_detect, src_dir, os.path.join(result_dir, f'70-bindetect{result_suffix}.sarif'), jobs, sniff, sniff_max_size, inventory=inventory)
+
+# RegexScan matches the cq and ccs rule catalogs in-process, without running either tool. Its results are kept in
+# memory rather than written to a SARIF file. Like BinDetect, it cannot be interrupted once started.
+async def run_regexscan(src_dir, result_dir, result_suffix='', jobs=1):
+    logging.info("Running analysis using RegexScan...")
+    tools_dir = os.path.dirname(__file__)
+    checks = regexscan.load_checks(os.path.join(tools_dir, 'cq', 'cq.py'), os.path.join(tools_dir, 'ccs', 'ccs.py'))
+    return await asyncio.to_thread(regexscan.regex_scan, src_dir, checks, f'80-regexscan{result_suffix}', jobs)
+
+Tool_Runners = {
+    'trivy' : run_trivy,
+    'gitleaks' : run_gitleaks,
+    'cq' : run_cq,
+    'ccs' : run_ccs,
+    'bindetect' : run_bindetect,
+    'regexscan' : run_regexscan
+}
+
+# Each tool is identified for the findings cache by its version and a hash of its rule catalog. Trivy and
+# Gitleaks have their rules built in, so their versions suffice. cq and ccs are identified by their scripts,
+# which contain their rules, and the built-in tools by their own source.
+async def fingerprint_trivy():
+    trivy_exes = ['trivy', 'trivy.bat'] if util.is_windows() else ['trivy']
+    return await fingerprint_executable(trivy_exes, '--version')
+
+async def fingerprint_gitleaks():
+    return await fingerprint_executable('gitleaks', 'version')
+
+async def fingerprint_executable(exes, *args):
+    try:
+        version = (await util.run_tool_async(exes, *args, return_output=True)).strip()
+    except Exception as e:
+        logging.debug(f'Unable to determine version using {exes}: {e}')
+        return None
+    return (version, '') if version else None
+
+async def fingerprint_cq():
+    tools_dir = os.path.dirname(__file__)
+    return await asyncio.to_thread(fingerprint_files, [os.path.join(tools_dir, 'cq2sarif.py')], [os.path.join(tools_dir, 'cq', name) for name in ['cq.py', 'fn.py']])
+
+async def fingerprint_ccs():
+    tools_dir = os.path.dirname(__file__)
+    return await asyncio.to_thread(fingerprint_files, [os.path.join(tools_dir, 'ccs2sarif.py')], [os.path.join(tools_dir, 'ccs', 'ccs.py')])
+
+async def fingerprint_bindetect():
+    return await asyncio.to_thread(fingerprint_files, sorted(glob.glob(os.path.join(os.path.dirname(bindetect.__file__), '*.py'))), [])
+
+async def fingerprint_regexscan():
+    tools_dir = os.path.dirname(__file__)
+    return await asyncio.to_thread(fingerprint_files, [regexscan.__file__], [os.path.join(tools_dir, 'cq', 'cq.py'), os.path.join(tools_dir, 'ccs', 'ccs.py')])
+
+# The version is a hash of the code that produces the tool's SARIF output, and the catalog hash is a hash of the
+# files containing its rules. Missing files are hashed as empty, so that adding one changes the fingerprint.
+def fingerprint_files(version_paths, catalog_paths):
+    return (hash_files(version_paths), hash_files(catalog_paths))
+
+def hash_files(paths):
+    h = hashlib.sha256()
+    for path in paths:
+        h.update(os.path.basename(path).encode('utf-8'))
+        h.update((util.hash_file(path) if os.path.isfile(path) else '').encode('utf-8'))
+    return h.hexdigest()
+
+Tool_Fingerprints = {
+    'trivy' : fingerprint_trivy,
+    'gitleaks' : fingerprint_gitleaks,
+    'cq' : fingerprint_cq,
+    'ccs' : fingerprint_ccs,
+    'bindetect' : fingerprint_bindetect,
+    'regexscan' : fingerprint_regexscan
+}
+
+# The tool options that change what a tool reports, and so are part of its findings cache key.
+Tool_Result_Options = {
+    'bindetect' : ['sniff', 'sniff_max_size']
+}
+
+# The tools whose results for a file depend only on its name and content, not on the directory it is in.
+Path_Independent_Tools = {'bindetect', 'regexscan'}
+
 def get_input_files(path):
     path = os.path.normpath(path)
     if os.path.isfile(path):
@@ -189,20 +467,24 @@ def check_input_file(subdir, path):
             return ('sarif', subdir, path)
     return None
 
-def process_sarif_file(file_path, file_subdir, srcdir, outdir, report, placeholder_fmt):
-    sarif = sarif_loader.load_sarif_file(file_path)
+def process_sarif_file(file_path, file_subdir, targets, placeholder_fmt):
+    sarif = load_sarif_stream(file_path)
     for sarif_run in sarif.runs:
-        tool_name = verify_tool(sarif_run)
-        logging.info(f'{tool_name} : {file_path}')
-        if tool_name:
-            process_results(tool_name, file_path, file_subdir, srcdir, outdir, report, placeholder_fmt, sarif_run)
+        process_sarif_run(sarif_run, file_path, file_subdir, targets, placeholder_fmt)
+
+def process_sarif_run(sarif_run, file_path, file_subdir, targets, placeholder_fmt):
+    tool_name = verify_tool(sarif_run)
+    logging.info(f'{tool_name} : {file_path}')
+    if tool_name:
+        collect_results(tool_name, file_path, file_subdir, targets, placeholder_fmt, sarif_run)
 
 Tool_Dict = {
     'gitleaks' : TOOL_NAME_GITLEAKS,
     'trivy': TOOL_NAME_TRIVY,
     'cq' : TOOL_NAME_CQ,
     'ccs' : TOOL_NAME_CCS,
-    'bindetect' : TOOL_NAME_BINDETECT
+    'bindetect' : TOOL_NAME_BINDETECT,
+    'regexscan' : TOOL_NAME_REGEXSCAN
 }
 def verify_tool(sarif_run):
     sarif_tool = sarif_run.get_tool_name().lower()
@@ -213,130 +495,58 @@ def verify_tool(sarif_run):
 
     return Tool_Dict[sarif_tool]
 
-def process_results(tool_name, sarif_file_path, subdir, src_path, out_path, report, placeholder_fmt, sarif_run):
-    sarif_rules = build_rules_dict(tool_name, sarif_run)
-    sarif_results_by_file = build_results_by_file_dict(tool_name, sarif_run)
+# Gather the results of a single SARIF run into the set of redaction targets, grouped by artifact. Nothing is
+# read or written at this point; all results for an artifact are applied together by redact_targets().
+def collect_results(tool_name, sarif_file_path, subdir, targets, placeholder_fmt, sarif_run):
+    rule_catalog = build_rules_dict(tool_name, sarif_run, placeholder_fmt)
+    sarif_results_by_file = build_results_by_file_dict(tool_name, sarif_run, rule_catalog)
+    source_name = os.path.join(subdir, os.path.split(sarif_file_path)[1])
     for artifact_path in sarif_results_by_file:
         for sarif_result in sorted(sarif_results_by_file[artifact_path], 
                                    key=functools.cmp_to_key(compare_sarif_result), reverse=True):
-            logging.info(f'{os.path.join(subdir, os.path.split(sarif_file_path)[1])}: {sarif_result.locations[0].artifact_path}:{sarif_result.locations[0].start_line}:{sarif_result.locations[0].start_column} {sarif_result.message_text} :')
-
-            (content_list, status, message) = process_result(tool_name, sarif_rules, subdir, src_path, out_path, placeholder_fmt, artifact_path, sarif_result)
-            report.log_result(sarif_result, content_list, status, message)
-            
-def process_result(tool_name, sarif_rules, subdir, src_path, out_path, placeholder_fmt, artifact_path, sarif_result):
-    sarif_rule = sarif_rules.get(sarif_result.rule_id)
-    if not sarif_rule:
-        logging.warning(f'Unknown or unsupported rule: {sarif_result.rule_id}')
-        return (None, 'SarifError', f'Unknown or unsupported rule: {sarif_result.rule_id}')
-
-    # If gitleaks, need to check whether it's in a commit or not
-    if sarif_result.commit_sha:
-        logging.warning(f'This secret was found in a git history. We may not be able to locate it in the current version')
-
-    placeholder_text = generate_placeholder(placeholder_fmt, tool_name, sarif_rule)
-
-    # TODO: For now, only one location supported per result. Assume the first one is it.
-    loc = sarif_result.locations[0] if len(sarif_result.locations) else None
-    if loc is None or loc.artifact_path is None:
-        logging.warning('No file path found')
-        return (None, 'NoFilePath', 'No file path found')
-
-    is_binary = loc.byte_offset is not None
-
-    artifact_path = os.path.join(subdir, loc.artifact_path) if subdir else loc.artifact_path
-    artifact_out_path = os.path.normpath(os.path.join(out_path, artifact_path))
-    artifact_in_path = artifact_out_path if os.path.exists(artifact_out_path) else os.path.normpath(os.path.join(src_path, artifact_path))
-
-    if is_binary:
-        try:
-            with io.open(artifact_in_path, 'rb') as f:
-                artifact_bytes = f.read()            
-        except Exception as e:
-            logging.error(f'Error reading file "{artifact_in_path}": {e}')
-            return (None, 'IOError', 'Error reading file')
-        
-        if not validate_location_binary(artifact_bytes, loc):
-            logging.warning('Secret location is invalid')
-            return (None, 'SarifError', 'Secret location invalid')
-
-        matches = list(sarif_result.detect_secret_spans(loc, artifact_bytes))
-        if not matches:
-            logging.warning('Bytes found in file do not match those in the SARIF report')
-            return (None, 'SarifError', 'Bytes found in file do not match those in the SARIF report.')
-
-        content_list = []
-        for match in matches:
-            content = artifact_bytes[match[0]:match[1]]
-            content_list.append(content)
-            artifact_bytes = artifact_bytes[0:match[0]] + placeholder_text.encode('utf-8') + artifact_bytes[match[1]:]
-
-        try:
-            # Output the artifact, creating directories if necessary
-            os.makedirs(os.path.dirname(artifact_out_path), exist_ok=True)
-            with io.open(artifact_out_path, 'wb') as f:
-                f.write(artifact_bytes)
-        except Exception as e:
-            logging.error(f'Error writing file "{artifact_out_path}": {e}')
-            return (None, 'IOError', 'Error writing file')
-
+            entry = RedactionEntry(tool_name, source_name, rule_catalog.get(sarif_result.rule_id), sarif_result)
+            targets.add(os.path.join(subdir, artifact_path) if subdir else artifact_path, entry)
+
+# Redact all targets, optionally spreading the artifacts across a pool of worker processes. Artifacts are
+# always processed and reported in sorted path order so that the report is identical however many jobs run.
+# Returns the paths of the artifacts that were rewritten.
+# Worker processes are spawned rather than forked, so that they never inherit a lock held by another thread.
+def redact_targets(targets, src_path, out_path, report, jobs=1):
+    logging.info(f'Redacting secrets in {len(targets)} files...')
+    sorted_targets = sorted(targets, key=lambda t: t.artifact_path)
+    redact = functools.partial(redact_target, src_path=src_path, out_path=out_path)
+    if jobs > 1 and len(sorted_targets) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn')) as executor:
+            target_outcomes = executor.map(redact, sorted_targets, chunksize=max(1, len(sorted_targets) // (jobs * 4)))
+            return log_target_outcomes(sorted_targets, target_outcomes, report)
     else:
-        try:
-            # Read in the artifact
-            with io.open(artifact_in_path, 'r', newline='') as f:
-                artifact_lines = f.readlines()
-        except Exception as e:
-            logging.error(f'Error reading file "{artifact_in_path}": {e}')
-            return (None, 'IOError', 'Error reading file')
+        return log_target_outcomes(sorted_targets, map(redact, sorted_targets), report)
 
-        if not validate_location_text(artifact_lines, loc):
-            logging.warning('Secret location is invalid')
-            return (None, 'SarifError', 'Secret location invalid')
-
-        if loc.start_line != loc.end_line:
-            logging.warning(f'Secret spans multiple lines {loc.start_line}-{loc.end_line} in: "{artifact_path}" ({sarif_rule.id}). This isn\'t yet fully supported for certain tool types.')
-
-        joined_lines = ''.join(artifact_lines[loc.start_line:loc.end_line+1])
-
-        matches = list(sarif_result.detect_secret_spans(loc, joined_lines))
-        if not matches:
-            logging.warning('Text found in file does not match that in the SARIF report.')
-            return (None, 'SarifError', 'Text found in file does not match that in the SARIF report.')
-
-        content_list = []
-        for match in matches:
-            content = joined_lines[match[0]:match[1]]
-            content_list.append(content)
-            num_newlines = content.count('\n')
-            joined_lines = joined_lines[0:match[0]] + placeholder_text + ('\n' * num_newlines) + joined_lines[match[1]:]
-
-        artifact_lines[loc.start_line] = joined_lines
-        for line_no in range(loc.end_line, loc.start_line, -1):
-            del artifact_lines[line_no]
-
-        try:
-            # Output the artifact, creating directories if necessary
-            os.makedirs(os.path.dirname(artifact_out_path), exist_ok=True)
-            with io.open(artifact_out_path, 'w', newline='') as f:
-                f.writelines(artifact_lines)
-        except Exception as e:
-            logging.error(f'Error writing file "{artifact_out_path}": {e}')
-            return (None, 'IOError', 'Error writing file')
-
-    logging.info('Successfully scrubbed.')
-    return (content_list,'Scrubbed','Scrubbed')
+def log_target_outcomes(targets, target_outcomes, report):
+    modified_paths = []
+    for (target, outcomes) in zip(targets, target_outcomes):
+        for (sarif_result, content_list, status, message) in outcomes:
+            report.log_result(sarif_result, content_list, status, message)
+        if any(status == 'Scrubbed' for (_, _, status, _) in outcomes):
+            modified_paths.append(target.artifact_path)
+    return modified_paths
 
-def build_rules_dict(tool_name, sarif_run):
-    rules_dict = {}
+# Build the catalog of every rule in the run, rendering each rule's placeholder exactly once.
+def build_rules_dict(tool_name, sarif_run, placeholder_fmt = DEFAULT_PLACEHOLDER_FORMAT):
+    rule_catalog = RuleCatalog()
     for rule_dict in get_from_dict(sarif_run.run_data, ['tool','driver','rules'], []):
         sarif_rule = get_sarif_rule(tool_name, rule_dict)
-        if sarif_rule.is_secret:
-            rules_dict[sarif_rule.id] = sarif_rule
-    return rules_dict
+        placeholder_text = generate_placeholder(placeholder_fmt, tool_name, sarif_rule) if sarif_rule.is_secret else None
+        rule_catalog.add(CompiledRule(sarif_rule, placeholder_text))
+    return rule_catalog
 
-def build_results_by_file_dict(tool_name, sarif_run):
+# Results for rules that are not secret-related are dropped as soon as they are read, which keeps memory usage
+# down for noisy tools.
+def build_results_by_file_dict(tool_name, sarif_run, rule_catalog = RuleCatalog()):
     results_by_file_dict = {}
     for result in sarif_run.get_results():
+        if rule_catalog.is_ignored(result.get('ruleId')):
+            continue
         result = get_sarif_result(tool_name, result)
         for loc in result.locations:
             if not loc.artifact_path:
@@ -346,23 +556,6 @@ def build_results_by_file_dict(tool_name, sarif_run):
             results_by_file_dict[loc.artifact_path].append(result)
     return results_by_file_dict
 
-def validate_location_binary(b, loc):
-    if loc.byte_offset is None: return False
-    if loc.byte_offset < 0 or (loc.byte_length is not None and loc.byte_length < 0): return False
-    if loc.byte_offset >= len(b): return False
-    if loc.byte_length is not None and (loc.byte_offset + loc.byte_length) > len(b): return False
-    return True
-
-def validate_location_text(lines, loc):
-    if loc.start_line is None or loc.end_line is None: return False
-    if loc.start_line < 0 or loc.end_line < 0: return False
-    if loc.start_line > loc.end_line: return False
-    if loc.end_line >= len(lines): return False
-    if loc.start_column is not None and (loc.start_column < 0 or loc.start_column > len(lines[loc.start_line])): return False
-    if loc.end_column is not None and (loc.end_column < 0 or loc.end_column > len(lines[loc.end_line])): return False
-    if (loc.start_line == loc.end_line and loc.start_column is not None and loc.end_column is not None and loc.start_column > loc.end_column): return False
-    return True
-
 def sanitise_placeholder(s):
     if s is None:
         return None
@@ -370,20 +563,28 @@ def sanitise_placeholder(s):
     return s.replace('"', '\u201d').replace("'",'\u2019').replace('\r',' ').replace('\n',' ')
 
 def generate_placeholder(fmt, tool_name, sarif_rule):
+    if sarif_rule:
+        return render_placeholder(fmt, tool_name, True, sarif_rule.name, sarif_rule.regex)
+    return render_placeholder(fmt, tool_name, False, None, None)
+
+# The rendered placeholder depends only on these values, so it is cached rather than re-serialising the YAML
+# for every result.
+@functools.lru_cache(maxsize=None)
+def render_placeholder(fmt, tool_name, has_rule, rule_name, rule_regex):
     template = Template(fmt)
     detection = {}
     if tool_name: detection['Tool'] = tool_name
-    if sarif_rule and sarif_rule.name: detection['Rule'] = sarif_rule.name
+    if rule_name: detection['Rule'] = rule_name
     detection_regex = detection.copy()
-    if sarif_rule and sarif_rule.regex: detection_regex['Regex'] = sarif_rule.regex
+    if rule_regex: detection_regex['Regex'] = rule_regex
 
     yaml_dumper = YAML(typ=['rt','string'])
     yaml_dumper.default_flow_style = True
     yaml = yaml_dumper.dump_to_string({'Detection': detection}).strip() if len(detection) > 0 else ''
     yaml_regex = yaml_dumper.dump_to_string({'Detection': detection_regex}).strip() if len(detection_regex) > 0 else ''
     return template.safe_substitute(tool = tool_name, 
-                      rule = (sarif_rule.name if sarif_rule else ""), 
-                      regex = (sarif_rule.regex if sarif_rule else ""), 
+                      rule = (rule_name if has_rule else ""), 
+                      regex = (rule_regex if has_rule else ""), 
                       yaml = yaml,
                       yaml_regex = yaml_regex,
                       _yaml = (f' {yaml}' if yaml else ''),                   # Special placeholder which inserts a space before the YAML only if it exists
@@ -401,6 +602,8 @@ def get_sarif_rule(tool_name, sarif_rule):
         return CcsRule(sarif_rule)
     if tool_name == TOOL_NAME_BINDETECT:
         return BinDetectRule(sarif_rule)
+    if tool_name == TOOL_NAME_REGEXSCAN:
+        return RegexScanRule(sarif_rule)
     raise Exception(f'Unexpected tool name: {tool_name}')
 
 def get_sarif_result(tool_name, sarif_result):
@@ -414,6 +617,8 @@ def get_sarif_result(tool_name, sarif_result):
         return CcsResult(sarif_result)
     if tool_name == TOOL_NAME_BINDETECT:
         return BinDetectResult(sarif_result)
+    if tool_name == TOOL_NAME_REGEXSCAN:
+        return RegexScanResult(sarif_result)
     raise Exception(f'Unexpected tool name: {tool_name}')
 
 def compare_sarif_result(r1, r2):
@@ -434,9 +639,16 @@ def compare_sarif_result(r1, r2):
 
     return 0
 
-def copy_remaining_files(src_dir, dest_dir):
+# Returns the number of bytes copied.
+def copy_remaining_files(src_dir, dest_dir, link_mode = 'copy', inventory = None):
     
     logging.info(f'Copying remaining unredacted files...')
+    linker = util.FileLinker(link_mode)
+    if inventory is not None and inventory.is_root(src_dir):
+        return copy_inventory_files(inventory, dest_dir, linker)
+
+    copied_size = 0
+
     for root, dirs, files in os.walk(src_dir):
         if not root.startswith(src_dir):
             logging.error(f'Attempt to copy unexpected directory {root}')
@@ -452,9 +664,32 @@ def copy_remaining_files(src_dir, dest_dir):
         for file in files:
             if not os.path.exists(os.path.join(dest_dir, root, file)):
                 try:
-                    shutil.copy2(os.path.join(src_dir, root, file), os.path.join(dest_dir, root, file))
+                    linker.link(os.path.join(src_dir, root, file), os.path.join(dest_dir, root, file))
+                    copied_size += os.path.getsize(os.path.join(dest_dir, root, file))
                 except OSError as e:
                     logging.error(f'ERROR: {e}')
+    return copied_size
+
+# As above, but taking the files and directories from an inventory. Entries are in sorted order, so every
+# directory is created before anything within it.
+def copy_inventory_files(inventory, dest_dir, linker):
+    os.makedirs(dest_dir, exist_ok = True)
+    copied_size = 0
+    for entry in inventory.entries:
+        # We won't copy anything inside a .git directory because secrets could get in that way.
+        if '.git' in entry.rel_path.split('/'):
+            continue
+
+        dest_path = os.path.join(dest_dir, entry.rel_path)
+        if entry.file_type == FILE_TYPE_DIR:
+            os.makedirs(dest_path, exist_ok = True)
+        elif not os.path.exists(dest_path):
+            try:
+                linker.link(entry.path, dest_path)
+                copied_size += entry.size
+            except OSError as e:
+                logging.error(f'ERROR: {e}')
+    return copied_size
 
 class CqRule(SarifRule):
      def __init__(self, sarif_rule):
@@ -477,6 +712,11 @@ class TrivyRule(SarifRule):
         self.name = f"{get_from_dict(sarif_rule, ['name'])} - {get_from_dict(sarif_rule, ['shortDescription','text'])}"
         self.is_secret = 'secret' in get_from_dict(sarif_rule, ['properties','tags'], [])
 
+class RegexScanRule(SarifRule):
+     def __init__(self, sarif_rule):
+        super().__init__(TOOL_NAME_REGEXSCAN, sarif_rule)
+        self.regex = get_from_dict(sarif_rule, ['shortDescription','text'])
+
 class BinDetectRule(SarifRule):
      def __init__(self, sarif_rule):
         super().__init__(TOOL_NAME_BINDETECT, sarif_rule)
@@ -570,6 +810,16 @@ class TrivyResult(SarifResult):
     def make_regex_safe_string(s):
         return ''.join([ch if ch.isalnum() else '\\u{:04x}'.format(ord(ch)) for ch in s])
 
+class RegexScanResult(SarifResult):
+    def __init__(self, sarif_result):
+        super().__init__(TOOL_NAME_REGEXSCAN, sarif_result)
+
+    # RegexScan knows exactly where each match is, so only that occurrence of the text is redacted.
+    def detect_secret_spans(self, loc, lines):
+        end_column = loc.start_column + len(loc.snippet_text)
+        if lines[loc.start_column:end_column] == loc.snippet_text:
+            yield (loc.start_column, end_column)
+
 class BinDetectResult(SarifResult):
     def __init__(self, sarif_result):
         super().__init__(TOOL_NAME_BINDETECT, sarif_result)
@@ -0,0 +1,184 @@
+# Released as open source by NCC Group Plc - https://www.nccgroup.com/
+#
+# Developed by:
+#     Andrew Kisliakov (andrew.kisliakov@nccgroup.com)
+#
+# Project link: https://www.github.com/nccgroup/secretscrub/
+#
+# Released under AGPL-3.0. See LICENSE for more information.
+
+import copy
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+import util
+
+CACHE_VERSION = 1
+
+# A local, content-addressed store of the results produced by each analysis tool, which may be shared between
+# runs and between source trees. Results are stored per file, keyed by the tool, its version and rule catalog,
+# and the hash of the file's content, with the artifact location removed so that they can be applied to any
+# copy of the same content. Within each content hash, results are further keyed by the file's relative path,
+# since tools commonly decide from a file's path (e.g. its extension, or an allowlisted directory such as
+# vendor/) whether to report anything at all. Tools whose rules depend on nothing but the file's name may share
+# results between files of the same name in any directory.
+#
+# The store is laid out as <tool key>/tool.json, holding the tool description from the tool's most recent
+# SARIF run, and <tool key>/<2 hex digits>/<content hash>.json, holding the results for that content. Results
+# include the text of the secrets that were found, so every directory is created accessible only to its owner.
+class FindingsCache:
+    def __init__(self, path, scratch_dir):
+        self.path = path
+        self.scratch_dir = scratch_dir
+        self.file_hashes = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.hash_locks = {}
+        os.makedirs(path, mode=0o700, exist_ok=True)
+
+    # Any settings that change what the tool reports are included, so that results are never shared between them.
+    def get_tool_key(self, tool, version, catalog_hash, settings = None):
+        key = [CACHE_VERSION, tool, version, catalog_hash] + ([settings] if settings else [])
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()[:32]
+
+    # The content hashes of every file within a directory (other than within .git directories, which are never
+    # copied to the output), worked out once however many tools are run over it.
+    def hash_files(self, src_dir):
+        with self.lock:
+            hash_lock = self.hash_locks.setdefault(src_dir, threading.Lock())
+        with hash_lock:
+            if src_dir not in self.file_hashes:
+                file_hashes = {}
+                for (root, dirs, files) in os.walk(src_dir):
+                    dirs[:] = list(d for d in dirs if d != '.git')
+                    for file in files:
+                        path = os.path.join(root, file)
+                        if os.path.isfile(path):
+                            file_hashes[os.path.relpath(path, src_dir).replace('\\', '/')] = util.hash_file(path)
+                self.file_hashes[src_dir] = file_hashes
+            return self.file_hashes[src_dir]
+
+    def get_tool_dir(self, tool_key):
+        return os.path.join(self.path, tool_key)
+
+    def get_entry_path(self, tool_key, content_hash):
+        return os.path.join(self.get_tool_dir(tool_key), content_hash[:2], f'{content_hash}.json')
+
+    def load_tool(self, tool_key):
+        return read_json(os.path.join(self.get_tool_dir(tool_key), 'tool.json'))
+
+    def lookup(self, tool_key, content_hash, entry_name):
+        entry = read_json(self.get_entry_path(tool_key, content_hash)) or {}
+        return entry.get(entry_name)
+
+    # Split the files within a directory into those whose results are already known, which are returned as a
+    # run in the same form as a SARIF run, and those which the tool must still be run over.
+    def partition(self, tool_key, src_dir, run_name, share_by_name = False):
+        file_hashes = self.hash_files(src_dir)
+        tool_data = self.load_tool(tool_key)
+        if tool_data is None:
+            with self.lock:
+                self.misses += len(file_hashes)
+            return (None, sorted(file_hashes))
+
+        results = []
+        missed_paths = []
+        for rel_path in sorted(file_hashes):
+            cached_results = self.lookup(tool_key, file_hashes[rel_path], get_entry_name(rel_path, share_by_name))
+            if cached_results is None:
+                missed_paths.append(rel_path)
+                continue
+            for cached_result in cached_results:
+                results.append(set_result_path(copy.deepcopy(cached_result), rel_path))
+        with self.lock:
+            self.hits += len(file_hashes) - len(missed_paths)
+            self.misses += len(missed_paths)
+        return (CachedRun(run_name, tool_data, results), missed_paths)
+
+    # Create a tree containing only the given files, for the tool to scan.
+    def stage(self, src_dir, rel_paths, staging_dir):
+        linker = util.FileLinker('auto')
+        for rel_path in rel_paths:
+            staged_path = os.path.join(staging_dir, rel_path)
+            os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+            linker.link(os.path.join(src_dir, rel_path), staged_path)
+
+    # Record the results that a tool produced for a set of files. Every file is recorded, including those for
+    # which nothing was found.
+    def store(self, tool_key, src_dir, rel_paths, sarif_runs, share_by_name = False):
+        file_hashes = self.hash_files(src_dir)
+        results_by_path = dict((rel_path, []) for rel_path in rel_paths)
+        tool_data = None
+        for sarif_run in sarif_runs:
+            tool_data = tool_data or sarif_run.run_data.get('tool')
+            for result in sarif_run.get_results():
+                rel_path = get_result_path(result)
+                if rel_path in results_by_path:
+                    results_by_path[rel_path].append(set_result_path(copy.deepcopy(result), None))
+        if tool_data is None:
+            return
+
+        write_json(os.path.join(self.get_tool_dir(tool_key), 'tool.json'), tool_data)
+        for (rel_path, results) in results_by_path.items():
+            entry_path = self.get_entry_path(tool_key, file_hashes[rel_path])
+            entry = read_json(entry_path) or {}
+            entry[get_entry_name(rel_path, share_by_name)] = results
+            write_json(entry_path, entry)
+
+# Cached results, presented in the same way as a SARIF run read by secretscrub_sarif.
+class CachedRun:
+    def __init__(self, name, tool_data, results):
+        self.path = name
+        self.run_data = {'tool' : tool_data}
+        self.results = results
+
+    def get_tool_name(self):
+        return self.run_data['tool'].get('driver', {}).get('name', '')
+
+    def get_results(self):
+        return iter(self.results)
+
+def get_entry_name(rel_path, share_by_name):
+    return os.path.basename(rel_path) if share_by_name else rel_path
+
+def get_result_path(result):
+    locations = result.get('locations') or [{}]
+    uri = locations[0].get('physicalLocation', {}).get('artifactLocation', {}).get('uri')
+    return os.path.normpath(uri).replace('\\', '/') if uri else None
+
+def set_result_path(result, rel_path):
+    for location in result.get('locations') or []:
+        artifact_location = location.get('physicalLocation', {}).get('artifactLocation')
+        if artifact_location is not None:
+            if rel_path is None:
+                artifact_location.pop('uri', None)
+            else:
+                artifact_location['uri'] = rel_path
+    return result
+
+def read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f'Ignoring unreadable findings cache entry "{path}": {e}')
+        return None
+
+# Entries are replaced atomically, so that concurrent runs sharing the cache never see a partial entry.
+def write_json(path, value):
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,181 @@
+# Released as open source by NCC Group Plc - https://www.nccgroup.com/
+#
+# Developed by:
+#     Andrew Kisliakov (andrew.kisliakov@nccgroup.com)
+#
+# Project link: https://www.github.com/nccgroup/secretscrub/
+#
+# Released under AGPL-3.0. See LICENSE for more information.
+
+import json
+import logging
+import os
+import tempfile
+
+from archive import get_archive_source_path
+
+import util
+
+STATE_VERSION = 1
+
+# Tracks the state of a source tree between runs so that only new or changed files need to be analysed and
+# redacted. For each source file, the state file records its content hash, the hash of the output that was
+# produced from it and the report rows that were logged for it. Report rows are stored without their content,
+# so that the state file never contains any secrets.
+class IncrementalState:
+    def __init__(self, path, settings):
+        self.path = path
+        self.settings = settings
+        self.previous_files = {}
+        self.files = {}
+        self.changed = set()
+        self.removed = set()
+        self.rows = {}
+        self.roots = []
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            logging.info(f'No incremental state found at "{self.path}". All files will be processed.')
+            return
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except Exception as e:
+            logging.warning(f'Unable to read incremental state from "{self.path}": {e}. All files will be processed.')
+            return
+
+        if state.get('version') != STATE_VERSION or state.get('settings') != self.settings:
+            logging.info('Settings have changed since the previous run. All files will be processed.')
+            return
+
+        self.previous_files = state.get('files', {})
+
+    def save(self, out_dir):
+        for rel_path in self.changed:
+            entry = self.files[rel_path]
+            out_path = os.path.join(out_dir, rel_path)
+            if os.path.isfile(out_path):
+                st = os.stat(out_path)
+                entry['output_size'] = st.st_size
+                entry['output_mtime_ns'] = st.st_mtime_ns
+                entry['output_sha256'] = util.hash_file(out_path)
+            entry['rows'] = self.rows.get(rel_path, [])
+
+        state = {
+            'version' : STATE_VERSION,
+            'settings' : self.settings,
+            'files' : self.files
+        }
+        (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+        except:
+            os.unlink(tmp_path)
+            raise
+        logging.info(f'Incremental state written to "{self.path}"')
+
+    # Compare the source tree against the previous state. A file is unchanged only if its content is the same
+    # as last time and its output is still present and intact; anything else must be processed again. Files are
+    # only re-hashed if their size or modification time has changed. If an inventory of the source tree is given,
+    # it is used instead of walking and examining the tree again.
+    def scan(self, src_dir, out_dir, inventory = None):
+        self.add_root(src_dir)
+        self.add_root(out_dir)
+        for (rel_path, path, size, mtime_ns) in walk_source_files(src_dir, inventory):
+            previous = self.previous_files.get(rel_path)
+            if previous and previous.get('size') == size and previous.get('mtime_ns') == mtime_ns:
+                content_hash = previous.get('sha256')
+            else:
+                content_hash = util.hash_file(path)
+
+            entry = {
+                'size' : size,
+                'mtime_ns' : mtime_ns,
+                'sha256' : content_hash
+            }
+            if previous and previous.get('sha256') == content_hash and self.is_output_intact(out_dir, rel_path, previous):
+                for key in ['output_size', 'output_mtime_ns', 'output_sha256', 'rows']:
+                    entry[key] = previous.get(key)
+            else:
+                self.changed.add(rel_path)
+            self.files[rel_path] = entry
+
+        self.removed = set(self.previous_files) - set(self.files)
+        logging.info(f'Incremental scan: {len(self.changed)} new or changed, {len(self.removed)} removed, {len(self.files) - len(self.changed)} unchanged')
+
+    def is_output_intact(self, out_dir, rel_path, previous):
+        out_path = os.path.join(out_dir, rel_path)
+        if not os.path.isfile(out_path) or not previous.get('output_sha256'):
+            return False
+        st = os.stat(out_path)
+        if previous.get('output_size') == st.st_size and previous.get('output_mtime_ns') == st.st_mtime_ns:
+            return True
+        return util.hash_file(out_path) == previous.get('output_sha256')
+
+    # Outputs of removed files are deleted, as are those of changed files so that they are recreated.
+    def remove_stale_outputs(self, out_dir):
+        for rel_path in sorted(self.removed | self.changed):
+            out_path = os.path.join(out_dir, rel_path)
+            if os.path.lexists(out_path):
+                logging.debug(f'Removing stale output "{out_path}"')
+                os.unlink(out_path)
+
+    # Create a tree containing only the new and changed files, for the analysis tools to scan.
+    def stage_changed_files(self, src_dir, staging_dir):
+        self.add_root(staging_dir)
+        linker = util.FileLinker('auto')
+        for rel_path in sorted(self.changed):
+            staged_path = os.path.join(staging_dir, rel_path)
+            os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+            linker.link(os.path.join(src_dir, rel_path), staged_path)
+        return staging_dir
+
+    def is_changed_artifact(self, artifact_path):
+        return get_archive_source_path(os.path.normpath(artifact_path)) in self.changed
+
+    # A directory which mirrors the layout of the source directory, such as the scratch directory into which
+    # archives are expanded. Rows logged against a file (rather than a result) give its full path, which is made
+    # relative to whichever of these it is in.
+    def add_root(self, path):
+        self.roots.append(os.path.abspath(path))
+
+    def get_rel_path(self, path):
+        if os.path.isabs(path):
+            path = os.path.abspath(path)
+            for root in self.roots:
+                if path.startswith(root + os.sep):
+                    return os.path.relpath(path, root).replace('\\', '/')
+        return path
+
+    def record_row(self, rowdata):
+        rel_path = get_archive_source_path(self.get_rel_path('/'.join(filter(None, [rowdata.get('Directory'), rowdata.get('File Name')]))))
+        if rel_path in self.files:
+            self.rows.setdefault(rel_path, []).append(rowdata)
+
+    def log_unchanged_rows(self, report):
+        for rel_path in sorted(self.files):
+            if rel_path in self.changed:
+                continue
+            for rowdata in self.files[rel_path].get('rows') or []:
+                report.log_row(rowdata)
+
+# Yields the relative path (always using '/' as the separator), full path, size and modification time of every
+# file that would be copied to the output directory.
+def walk_source_files(src_dir, inventory = None):
+    if inventory is not None and inventory.is_root(src_dir):
+        for entry in inventory.files():
+            if '.git' not in entry.rel_path.split('/'):
+                yield (entry.rel_path, entry.path, entry.size, entry.mtime_ns)
+        return
+
+    for (root, dirs, files) in os.walk(src_dir):
+        dirs[:] = list(d for d in dirs if d != '.git')
+        rel_root = os.path.relpath(root, src_dir).replace('\\', '/')
+        for file in files:
+            path = os.path.join(root, file)
+            st = os.stat(path)
+            yield ((file if rel_root == '.' else f'{rel_root}/{file}'), path, st.st_size, st.st_mtime_ns)
@@ -0,0 +1,175 @@
+# Released as open source by NCC Group Plc - https://www.nccgroup.com/
+#
+# Developed by:
+#     Andrew Kisliakov (andrew.kisliakov@nccgroup.com)
+#
+# Project link: https://www.github.com/nccgroup/secretscrub/
+#
+# Released under AGPL-3.0. See LICENSE for more information.
+
+import collections
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+METRICS_VERSION = 1
+METRICS_FORMATS = ['json', 'prometheus']
+PROMETHEUS_PREFIX = 'secretscrub'
+
+# A summary of a single run: the wall and CPU time spent in each stage, the number of bytes each stage read and
+# wrote, and the number of results that ended with each status. CPU time is that of this process, with the time
+# of any child processes (external tools and worker processes) that completed during the stage given
+# separately. Tools run concurrently, so their stages overlap and their CPU times are not exclusive to them.
+#
+# Working out the number of bytes involved can mean walking a directory, so this is only done if the metrics
+# are to be written, i.e. a path is given.
+class Metrics:
+    def __init__(self, path = None, format = 'json'):
+        self.path = path
+        self.format = format
+        self.start_time = time.time()
+        self.start_perf_counter = time.perf_counter()
+        self.start_times = os.times()
+        self.completed = False
+        self.stages = []
+        self.statuses = collections.Counter()
+        self.tool_statuses = collections.defaultdict(collections.Counter)
+        self.inventories = []
+        self.dir_sizes = {}
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    # Time a stage. The stage's record is returned so that its byte counts can be filled in once they are known.
+    @contextlib.contextmanager
+    def stage(self, stage, name = None, bytes_read = None):
+        record = {'stage' : stage, 'name' : name, 'bytes_read' : bytes_read, 'bytes_written' : None}
+        start_times = os.times()
+        start_time = time.perf_counter()
+        try:
+            yield record
+        finally:
+            end_times = os.times()
+            record['wall_seconds'] = time.perf_counter() - start_time
+            record['cpu_seconds'] = get_cpu_time(end_times) - get_cpu_time(start_times)
+            record['child_cpu_seconds'] = get_child_cpu_time(end_times) - get_child_cpu_time(start_times)
+            with self.lock:
+                self.stages.append(record)
+
+    # An inventory of a directory saves walking it again to work out its size.
+    def add_inventory(self, inventory):
+        self.inventories.append(inventory)
+
+    # The size of a directory is only worked out once, as several tools may be run over it.
+    def get_dir_size(self, path):
+        if not self.enabled:
+            return None
+        if path not in self.dir_sizes:
+            inventory = next((inventory for inventory in self.inventories if inventory.is_root(path)), None)
+            self.dir_sizes[path] = inventory.total_size() if inventory else get_dir_size(path)
+        return self.dir_sizes[path]
+
+    def get_file_sizes(self, paths):
+        return get_file_sizes(paths) if self.enabled else None
+
+    # A report row observer, counting every row by its status and, for results, by the tool that produced them.
+    def record_row(self, rowdata):
+        with self.lock:
+            self.statuses[rowdata.get('Status')] += 1
+            if rowdata.get('Tool'):
+                self.tool_statuses[rowdata.get('Tool')][rowdata.get('Status')] += 1
+
+    def to_dict(self):
+        end_times = os.times()
+        return {
+            'version' : METRICS_VERSION,
+            'start_time' : time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.start_time)),
+            'start_timestamp' : self.start_time,
+            'completed' : self.completed,
+            'wall_seconds' : time.perf_counter() - self.start_perf_counter,
+            'cpu_seconds' : get_cpu_time(end_times) - get_cpu_time(self.start_times),
+            'child_cpu_seconds' : get_child_cpu_time(end_times) - get_child_cpu_time(self.start_times),
+            'bytes_read' : sum(stage['bytes_read'] or 0 for stage in self.stages),
+            'bytes_written' : sum(stage['bytes_written'] or 0 for stage in self.stages),
+            'stages' : self.stages,
+            'results' : {
+                'by_status' : dict(sorted(self.statuses.items())),
+                'by_tool' : dict((tool, dict(sorted(statuses.items()))) for (tool, statuses) in sorted(self.tool_statuses.items(), key=lambda t: t[0]))
+            }
+        }
+
+    def save(self):
+        if not self.path:
+            return
+        metrics = self.to_dict()
+        write_atomic(self.path, to_prometheus(metrics) if self.format == 'prometheus' else json.dumps(metrics, indent=2))
+        logging.info(f'Metrics written to {self.path}')
+
+def get_cpu_time(times):
+    return times.user + times.system
+
+def get_child_cpu_time(times):
+    return times.children_user + times.children_system
+
+def get_dir_size(path):
+    size = 0
+    for (root, dirs, files) in os.walk(path):
+        size += get_file_sizes(os.path.join(root, file) for file in files)
+    return size
+
+def get_file_sizes(paths):
+    size = 0
+    for path in paths:
+        try:
+            size += os.path.getsize(path)
+        except OSError:
+            pass
+    return size
+
+# The Prometheus text exposition format, as read by the node exporter's textfile collector. Every value describes
+# the most recent run, so all of them are gauges.
+def to_prometheus(metrics):
+    lines = []
+    def add_metric(name, help, samples):
+        lines.append(f'# HELP {PROMETHEUS_PREFIX}_{name} {help}')
+        lines.append(f'# TYPE {PROMETHEUS_PREFIX}_{name} gauge')
+        for (labels, value) in samples:
+            label_text = ','.join(f'{k}="{escape_label_value(v)}"' for (k, v) in labels.items() if v is not None)
+            lines.append(f'{PROMETHEUS_PREFIX}_{name}{{{label_text}}} {value}' if label_text else f'{PROMETHEUS_PREFIX}_{name} {value}')
+
+    add_metric('run_start_time_seconds', 'The time at which the run started', [({}, metrics['start_timestamp'])])
+    add_metric('run_completed', 'Whether the run completed successfully', [({}, int(metrics['completed']))])
+    for key in ['wall_seconds', 'cpu_seconds', 'child_cpu_seconds', 'bytes_read', 'bytes_written']:
+        add_metric(f'run_{key}', f'The total {key.replace("_", " ")} of the run', [({}, metrics[key])])
+
+    stage_labels = list({'stage' : stage['stage'], 'name' : stage['name']} for stage in metrics['stages'])
+    for key in ['wall_seconds', 'cpu_seconds', 'child_cpu_seconds', 'bytes_read', 'bytes_written']:
+        add_metric(f'stage_{key}', f'The {key.replace("_", " ")} of each stage',
+                   list((labels, stage[key]) for (labels, stage) in zip(stage_labels, metrics['stages']) if stage[key] is not None))
+
+    add_metric('results', 'The number of results with each status', list(({'status' : status}, count) for (status, count) in metrics['results']['by_status'].items()))
+    add_metric('tool_results', 'The number of results from each tool with each status',
+               list(({'tool' : tool, 'status' : status}, count) for (tool, statuses) in metrics['results']['by_tool'].items() for (status, count) in statuses.items()))
+    return '\n'.join(lines) + '\n'
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# The file is replaced atomically, so that a collector never reads a partially written file. Unlike the
+# temporary file it is written to, it is readable by other users, e.g. the one the collector runs as.
+def write_atomic(path, text):
+    (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
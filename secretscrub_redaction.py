@@ -0,0 +1,396 @@
+# Released as open source by NCC Group Plc - https://www.nccgroup.com/
+#
+# Developed by:
+#     Andrew Kisliakov (andrew.kisliakov@nccgroup.com)
+#
+# Project link: https://www.github.com/nccgroup/secretscrub/
+#
+# Released under AGPL-3.0. See LICENSE for more information.
+
+import codecs
+import io
+import locale
+import bisect
+import logging
+import mmap
+import numpy
+import os
+import regex
+import shutil
+import tempfile
+
+# Text artifacts are decoded using the same encoding that io.open() would use by default.
+TEXT_ENCODING = locale.getpreferredencoding(False)
+TEXT_ENCODING_IS_UTF8 = codecs.lookup(TEXT_ENCODING).name == 'utf-8'
+
+# Line endings as understood by io.open(..., newline=''), i.e. universal newlines left untranslated.
+LINE_END_REGEX = regex.compile(rb'\r\n|\r|\n')
+
+# The amount of an artifact scanned at a time when indexing its lines.
+LINE_INDEX_CHUNK_SIZE = 16 * 1024 * 1024
+
+# A single SARIF result waiting to be applied to an artifact, along with everything needed to redact it.
+class RedactionEntry:
+    def __init__(self, tool_name, source_name, rule, sarif_result):
+        self.tool_name = tool_name
+        self.source_name = source_name
+        self.rule = rule
+        self.sarif_result = sarif_result
+
+# All of the results reported against a single artifact, across every SARIF file and tool.
+class RedactionTarget:
+    def __init__(self, artifact_path):
+        self.artifact_path = artifact_path
+        self.entries = []
+
+class RedactionTargets:
+    def __init__(self):
+        self.targets = {}
+
+    def add(self, artifact_path, entry):
+        artifact_path = os.path.normpath(artifact_path)
+        if not artifact_path in self.targets:
+            self.targets[artifact_path] = RedactionTarget(artifact_path)
+        self.targets[artifact_path].entries.append(entry)
+
+    # Keep only the targets whose artifact path satisfies the predicate.
+    def filter(self, predicate):
+        self.targets = dict((path, target) for (path, target) in self.targets.items() if predicate(path))
+
+    def __iter__(self):
+        return iter(self.targets.values())
+
+    def __len__(self):
+        return len(self.targets)
+
+# A contiguous range of bytes to be replaced in the artifact.
+class RedactionSpan:
+    def __init__(self, start, end, placeholder, is_text):
+        self.start = start
+        self.end = end
+        self.placeholder = placeholder
+        self.is_text = is_text
+
+# Read-only access to the bytes of a source artifact. The file is memory-mapped the first time its contents are
+# needed, so that nothing is read for artifacts which are replaced in their entirety, and ranges of it can be
+# written out without first being copied into memory.
+class ArtifactSource:
+    def __init__(self, path):
+        self.path = path
+        self.size = os.stat(path).st_size
+        self.f = None
+        self.map = None
+
+    @property
+    def data(self):
+        if self.map is None:
+            if self.size == 0:
+                self.map = b''
+            else:
+                self.f = io.open(self.path, 'rb')
+                self.map = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def write_range(self, f, start, end):
+        if start >= end:
+            return
+        with memoryview(self.data) as view:
+            f.write(view[start:end])
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        if self.f:
+            self.f.close()
+        self.map = None
+        self.f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+# Byte offsets of the start of each line within an artifact, following the same line splitting rules as
+# readlines() on a file opened with newline=''. The artifact is scanned in fixed-size chunks, each of which is
+# searched for line endings in a single vectorised pass. If the line numbers of interest are given, only their
+# offsets are kept, so memory use does not grow with the size of the artifact; otherwise the offsets of every
+# line are kept in an array.
+class LineIndex:
+    def __init__(self, data, lines = None):
+        self.data = data
+        self.starts = {0 : 0} if lines is not None else None
+        wanted = None if lines is None else sorted(set(lines))
+        all_ends = [numpy.zeros(1, dtype=numpy.int64)]
+        line_no = 0
+        pos = 0
+        size = len(data)
+        while pos < size:
+            end = min(pos + LINE_INDEX_CHUNK_SIZE, size)
+            # Never split a '\r\n' pair across two chunks.
+            if end < size and data[end-1:end+1] == b'\r\n':
+                end += 1
+            ends = find_line_ends(data[pos:end]) + pos
+            if wanted is None:
+                all_ends.append(ends)
+            else:
+                # Line numbers line_no + 1 onwards begin at each of the line ends found in this chunk.
+                first = bisect.bisect_right(wanted, line_no)
+                last = bisect.bisect_right(wanted, line_no + len(ends))
+                for wanted_line in wanted[first:last]:
+                    self.starts[wanted_line] = int(ends[wanted_line - line_no - 1])
+            line_no += len(ends)
+            pos = end
+
+        # A line ending at the very end of the artifact does not begin another line.
+        ends_with_line_end = size > 0 and data[size-1:size] in (b'\n', b'\r')
+        self.line_count = line_no if ends_with_line_end else (line_no + 1 if size > 0 else 0)
+        self.offsets = numpy.concatenate(all_ends)[:max(self.line_count, 1)] if wanted is None else None
+
+    def line_start(self, line_no):
+        if self.offsets is not None:
+            return int(self.offsets[line_no])
+        return self.starts[line_no]
+
+    def line_end(self, line_no):
+        return self.line_start(line_no + 1) if line_no + 1 < self.line_count else len(self.data)
+
+    def text(self, start_line, end_line):
+        return self.data[self.line_start(start_line):self.line_end(end_line)].decode(TEXT_ENCODING)
+
+# Apply every result for a single artifact, reading and writing the artifact at most once. Returns a list of
+# (sarif_result, content_list, status, message) tuples, one per entry and in entry order. The source path may
+# be a single directory or a list of overlaid directories, in which case the first one containing the artifact
+# is used.
+def redact_target(target, src_path, out_path):
+    artifact_in_path = resolve_source_path(src_path, target.artifact_path)
+    try:
+        source = ArtifactSource(artifact_in_path)
+    except OSError as e:
+        logging.error(f'Error reading file "{artifact_in_path}": {e}')
+        return redact_source(target, None, artifact_in_path, out_path)
+
+    with source:
+        return redact_source(target, source, artifact_in_path, out_path)
+
+def redact_source(target, source, artifact_in_path, out_path):
+    outcomes = [None] * len(target.entries)
+    artifact_out_path = os.path.normpath(os.path.join(out_path, target.artifact_path))
+
+    line_index = None
+    spans = []
+    scrubbed = []
+    for (i, entry) in enumerate(target.entries):
+        sarif_result = entry.sarif_result
+        loc = sarif_result.locations[0] if len(sarif_result.locations) else None
+        if loc is not None:
+            logging.info(f'{entry.source_name}: {loc.artifact_path}:{loc.start_line}:{loc.start_column} {sarif_result.message_text} :')
+
+        if not entry.rule:
+            logging.warning(f'Unknown or unsupported rule: {sarif_result.rule_id}')
+            outcomes[i] = (None, 'SarifError', f'Unknown or unsupported rule: {sarif_result.rule_id}')
+            continue
+
+        # If gitleaks, need to check whether it's in a commit or not
+        if sarif_result.commit_sha:
+            logging.warning(f'This secret was found in a git history. We may not be able to locate it in the current version')
+
+        # TODO: For now, only one location supported per result. Assume the first one is it.
+        if loc is None or loc.artifact_path is None:
+            logging.warning('No file path found')
+            outcomes[i] = (None, 'NoFilePath', 'No file path found')
+            continue
+
+        if source is None:
+            outcomes[i] = (None, 'IOError', 'Error reading file')
+            continue
+
+        try:
+            if loc.byte_offset is not None:
+                outcomes[i] = find_binary_spans(entry, loc, source, spans)
+            else:
+                if line_index is None:
+                    line_index = LineIndex(source.data, get_text_lines(target))
+                outcomes[i] = find_text_spans(entry, loc, line_index, target.artifact_path, spans)
+        except OSError as e:
+            logging.error(f'Error reading file "{artifact_in_path}": {e}')
+            outcomes[i] = (None, 'IOError', 'Error reading file')
+            continue
+
+        if outcomes[i][1] == 'Scrubbed':
+            scrubbed.append(i)
+
+    if not scrubbed:
+        return build_outcome_list(target, outcomes)
+
+    try:
+        # Output the artifact, creating directories if necessary
+        os.makedirs(os.path.dirname(artifact_out_path), exist_ok=True)
+        with open_replacement(artifact_out_path, artifact_in_path) as f:
+            write_redacted(f, source, spans)
+    except Exception as e:
+        logging.error(f'Error writing file "{artifact_out_path}": {e}')
+        for i in scrubbed:
+            outcomes[i] = (None, 'IOError', 'Error writing file')
+
+    return build_outcome_list(target, outcomes)
+
+# Redacted output is always written to a new file which then replaces any existing output. The output might be a
+# hard link or reflink to the original, so writing into the existing file could alter the original source.
+class open_replacement:
+    def __init__(self, path, mode_path = None):
+        self.path = path
+        self.mode_path = mode_path
+
+    def __enter__(self):
+        self.f = tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(self.path), prefix='.secretscrub-', delete=False)
+        if self.mode_path:
+            shutil.copymode(self.mode_path, self.f.name)
+        return self.f
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.f.close()
+        if exc_type is None:
+            os.replace(self.f.name, self.path)
+        else:
+            os.unlink(self.f.name)
+        return False
+
+def resolve_source_path(src_path, artifact_path):
+    src_dirs = [src_path] if isinstance(src_path, str) else src_path
+    for src_dir in src_dirs:
+        artifact_in_path = os.path.normpath(os.path.join(src_dir, artifact_path))
+        if os.path.lexists(artifact_in_path):
+            return artifact_in_path
+    return os.path.normpath(os.path.join(src_dirs[0], artifact_path))
+
+# The lines whose offsets are needed to locate and validate every text result for a target.
+def get_text_lines(target):
+    lines = set()
+    for entry in target.entries:
+        for loc in entry.sarif_result.locations[:1]:
+            if loc.byte_offset is None and isinstance(loc.start_line, int) and isinstance(loc.end_line, int):
+                lines.update([loc.start_line, loc.start_line + 1, loc.end_line, loc.end_line + 1])
+    return lines
+
+def build_outcome_list(target, outcomes):
+    return list((entry.sarif_result,) + outcome for (entry, outcome) in zip(target.entries, outcomes))
+
+# Only the size of the artifact is needed to locate binary results. Its contents are only read in order to
+# report the secrets, and not even then when a result covers the whole file and the tool supplied its bytes.
+def find_binary_spans(entry, loc, source, spans):
+    if not validate_location_binary(source, loc):
+        logging.warning('Secret location is invalid')
+        return (None, 'SarifError', 'Secret location invalid')
+
+    matches = list(entry.sarif_result.detect_secret_spans(loc, source))
+    if not matches:
+        logging.warning('Bytes found in file do not match those in the SARIF report')
+        return (None, 'SarifError', 'Bytes found in file do not match those in the SARIF report.')
+
+    content_list = []
+    placeholder = entry.rule.placeholder_bytes
+    for match in matches:
+        if match == (0, len(source)) and loc.snippet_binary is not None and len(loc.snippet_binary) == len(source):
+            content_list.append(loc.snippet_binary)
+        else:
+            content_list.append(source[match[0]:match[1]])
+        spans.append(RedactionSpan(match[0], match[1], placeholder, False))
+
+    logging.info('Successfully scrubbed.')
+    return (content_list, 'Scrubbed', 'Scrubbed')
+
+def find_text_spans(entry, loc, line_index, artifact_path, spans):
+    try:
+        if not validate_location_text(line_index, loc):
+            logging.warning('Secret location is invalid')
+            return (None, 'SarifError', 'Secret location invalid')
+        joined_lines = line_index.text(loc.start_line, loc.end_line)
+    except UnicodeDecodeError as e:
+        logging.error(f'Error reading file "{artifact_path}": {e}')
+        return (None, 'IOError', 'Error reading file')
+
+    if loc.start_line != loc.end_line:
+        logging.warning(f'Secret spans multiple lines {loc.start_line}-{loc.end_line} in: "{artifact_path}" ({entry.rule.id}). This isn\'t yet fully supported for certain tool types.')
+
+    matches = list(entry.sarif_result.detect_secret_spans(loc, joined_lines))
+    if not matches:
+        logging.warning('Text found in file does not match that in the SARIF report.')
+        return (None, 'SarifError', 'Text found in file does not match that in the SARIF report.')
+
+    content_list = []
+    base = line_index.line_start(loc.start_line)
+    placeholder = entry.rule.placeholder_bytes if TEXT_ENCODING_IS_UTF8 else entry.rule.placeholder_text.encode(TEXT_ENCODING)
+    for match in matches:
+        content_list.append(joined_lines[match[0]:match[1]])
+        start = base + len(joined_lines[:match[0]].encode(TEXT_ENCODING))
+        end = start + len(joined_lines[match[0]:match[1]].encode(TEXT_ENCODING))
+        spans.append(RedactionSpan(start, end, placeholder, True))
+
+    logging.info('Successfully scrubbed.')
+    return (content_list, 'Scrubbed', 'Scrubbed')
+
+# The offset just past each line ending within a chunk, where a line ends at '\n', '\r\n' or a lone '\r'.
+def find_line_ends(chunk):
+    b = numpy.frombuffer(chunk, dtype=numpy.uint8)
+    lf = numpy.flatnonzero(b == 0x0A)
+    cr = numpy.flatnonzero(b == 0x0D)
+    # A '\r' followed by '\n' is part of the same line ending as the '\n'.
+    cr = cr[b[numpy.minimum(cr + 1, len(b) - 1)] != 0x0A] if len(b) else cr
+    ends = numpy.concatenate((lf, cr))
+    ends.sort()
+    return ends + 1
+
+# Sort the spans and combine any that overlap. Where spans overlap (e.g. the same secret was reported by
+# more than one tool), the placeholder belonging to the span that was found first is kept.
+def merge_spans(spans):
+    merged = []
+    for (order, span) in sorted(enumerate(spans), key=lambda s: (s[1].start, s[0])):
+        if merged and span.start < merged[-1][1].end:
+            (prev_order, prev) = merged[-1]
+            end = max(prev.end, span.end)
+            if order < prev_order:
+                merged[-1] = (order, RedactionSpan(prev.start, end, span.placeholder, span.is_text))
+            else:
+                prev.end = end
+        else:
+            merged.append((order, RedactionSpan(span.start, span.end, span.placeholder, span.is_text)))
+    return list(span for (_, span) in merged)
+
+# Write the artifact out in a single linear pass, substituting placeholders for each span. Text spans keep
+# any newlines that they contained so that line numbers elsewhere in the file are not disturbed. The unredacted
+# ranges in between are written straight from the source, so a span covering the whole file is written without
+# the source being read at all.
+def write_redacted(f, source, spans):
+    pos = 0
+    for span in merge_spans(spans):
+        source.write_range(f, pos, span.start)
+        f.write(span.placeholder)
+        if span.is_text:
+            f.write(b'\n' * source[span.start:span.end].count(b'\n'))
+        pos = span.end
+    source.write_range(f, pos, len(source))
+
+def validate_location_binary(b, loc):
+    if loc.byte_offset is None: return False
+    if loc.byte_offset < 0 or (loc.byte_length is not None and loc.byte_length < 0): return False
+    if loc.byte_offset >= len(b): return False
+    if loc.byte_length is not None and (loc.byte_offset + loc.byte_length) > len(b): return False
+    return True
+
+def validate_location_text(line_index, loc):
+    if loc.start_line is None or loc.end_line is None: return False
+    if loc.start_line < 0 or loc.end_line < 0: return False
+    if loc.start_line > loc.end_line: return False
+    if loc.end_line >= line_index.line_count: return False
+    if loc.start_column is not None and (loc.start_column < 0 or loc.start_column > len(line_index.text(loc.start_line, loc.start_line))): return False
+    if loc.end_column is not None and (loc.end_column < 0 or loc.end_column > len(line_index.text(loc.end_line, loc.end_line))): return False
+    if (loc.start_line == loc.end_line and loc.start_column is not None and loc.end_column is not None and loc.start_column > loc.end_column): return False
+    return True
@@ -16,6 +16,7 @@ import os
 import pyzipper
 import shutil
 import tempfile
+import threading
 
 class SecretScrubReportEncryption(Enum):
 
@@ -41,6 +42,9 @@ class SecretScrubReport:
         self.tmp_path = None
         self.encryption = encryption
         self.encryption_key = None
+        self.row_observers = []
+        # Rows may be logged from worker threads, e.g. while archives are processed in parallel.
+        self.lock = threading.Lock()
         if path:
             self.open()
 
@@ -94,8 +98,34 @@ class SecretScrubReport:
                     except Exception as e:
                         logging.error("Unable to remove temporary report file at {self.tmp_path}. The file should be removed manually.")
 
+    # Register a callable which is passed a copy of every row logged for a result or a file, whether or not a report
+    # file is being written. The 'Content' column is omitted from these copies so that secrets do not leak out of the
+    # report. Rows that were recorded previously and are written again with log_row are only passed to observers
+    # registered with replayed set, so that an observer which records rows never records the same row twice.
+    def add_row_observer(self, observer, replayed = False):
+        self.row_observers.append((observer, replayed))
+
+    def notify_row_observers(self, rowdata, replayed = False):
+        for (observer, observes_replayed) in self.row_observers:
+            if observes_replayed or not replayed:
+                observer(dict((k, v) for (k, v) in rowdata.items() if k != 'Content'))
+
+    # Write a row that was recorded previously, e.g. by a row observer.
+    def log_row(self, rowdata):
+        if not self.csv and not self.row_observers:
+            return
+
+        try:
+            with self.lock:
+                self.notify_row_observers(rowdata, replayed=True)
+                if self.csv:
+                    self.csv.writerow(rowdata)
+        except Exception as e:
+            logging.warning(f'Cannot write report entry: {e}')
+            return
+
     def log_result(self, sarif_result, content_list, status, message):
-        if not self.csv:
+        if not self.csv and not self.row_observers:
             return
 
         try:
@@ -111,13 +141,16 @@ class SecretScrubReport:
                 'Status' : status,
                 'Message' : message
             }
-            self.csv.writerow(rowdata)
+            with self.lock:
+                self.notify_row_observers(rowdata)
+                if self.csv:
+                    self.csv.writerow(rowdata)
         except Exception as e:
             logging.warning(f'Cannot write report entry: {e}')
             return
     
     def log_file_result(self, file_path, status, message):
-        if not self.csv:
+        if not self.csv and not self.row_observers:
             return
 
         try:
@@ -132,7 +165,10 @@ class SecretScrubReport:
                 'Status' : status,
                 'Message' : message
             }
-            self.csv.writerow(rowdata)
+            with self.lock:
+                self.notify_row_observers(rowdata)
+                if self.csv:
+                    self.csv.writerow(rowdata)
         except Exception as e:
             logging.warning(f'Cannot write report entry: {e}')
             return
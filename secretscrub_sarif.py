@@ -0,0 +1,191 @@
+# Released as open source by NCC Group Plc - https://www.nccgroup.com/
+#
+# Developed by:
+#     Andrew Kisliakov (andrew.kisliakov@nccgroup.com)
+#
+# Project link: https://www.github.com/nccgroup/secretscrub/
+#
+# Released under AGPL-3.0. See LICENSE for more information.
+
+import json
+
+from secretscrub_types import get_from_dict
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+SARIF_VERSION = '2.1.0'
+SARIF_SCHEMA = 'https://json.schemastore.org/sarif-2.1.0-rtm.5.json'
+JSON_WHITESPACE = ' \t\r\n'
+
+# A minimal pull-style JSON reader. Containers can be walked one member at a time with iter_object() and
+# iter_array(), while individual values are decoded in full using read_value(). Only the part of the document
+# currently being decoded is held in memory.
+class JsonStreamReader:
+    def __init__(self, f, chunk_size = DEFAULT_CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self, size = None):
+        if self.eof:
+            return False
+        chunk = self.f.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in JSON_WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, ch):
+        found = self.peek()
+        if found != ch:
+            raise ValueError(f'Invalid JSON: expected "{ch}" but found "{found}"')
+        self.pos += 1
+
+    def read_value(self):
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                (value, end) = self.decoder.raw_decode(self.buffer, self.pos)
+                # A value that runs right up to the end of the buffer (e.g. a number) may have been truncated.
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill(size)
+            size = size * 2
+
+    # Yields each key of an object. The caller must consume the corresponding value before continuing.
+    def iter_object(self):
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self.expect(':')
+            yield key
+            ch = self.peek()
+            self.pos += 1
+            if ch == '}':
+                return
+            if ch != ',':
+                raise ValueError(f'Invalid JSON: expected "," or "}}" but found "{ch}"')
+
+    # Yields once per element of an array. The caller must consume each element before continuing.
+    def iter_array(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            ch = self.peek()
+            self.pos += 1
+            if ch == ']':
+                return
+            if ch != ',':
+                raise ValueError(f'Invalid JSON: expected "," or "]" but found "{ch}"')
+
+    def iter_array_values(self):
+        if self.peek() != '[':
+            self.read_value()
+            return
+        for _ in self.iter_array():
+            yield self.read_value()
+
+# A SARIF run whose results are streamed from the file on demand rather than held in memory. The interface
+# mirrors the parts of sarif-tools' SarifRun that are used by SecretScrub.
+class SarifStreamRun:
+    def __init__(self, path, run_index, run_data):
+        self.path = path
+        self.run_index = run_index
+        self.run_data = run_data
+
+    def get_tool_name(self):
+        return get_from_dict(self.run_data, ['tool','driver','name'], '')
+
+    def get_results(self):
+        with open_sarif_file(self.path) as f:
+            reader = JsonStreamReader(f)
+            for key in reader.iter_object():
+                if key != 'runs':
+                    reader.read_value()
+                    continue
+                for (run_index, _) in enumerate(reader.iter_array()):
+                    if run_index != self.run_index:
+                        reader.read_value()
+                        continue
+                    for run_key in reader.iter_object():
+                        if run_key == 'results':
+                            yield from reader.iter_array_values()
+                        else:
+                            reader.read_value()
+                    return
+
+class SarifStream:
+    def __init__(self, path, runs):
+        self.path = path
+        self.runs = runs
+
+def open_sarif_file(path):
+    return open(path, 'r', encoding='utf-8-sig')
+
+# Read everything except the results from each run within a SARIF file. The results are left in the file until
+# they are requested through SarifStreamRun.get_results().
+def load_sarif_stream(path):
+    runs = []
+    with open_sarif_file(path) as f:
+        reader = JsonStreamReader(f)
+        for key in reader.iter_object():
+            if key != 'runs':
+                reader.read_value()
+                continue
+            for _ in reader.iter_array():
+                run_data = {}
+                for run_key in reader.iter_object():
+                    if run_key == 'results':
+                        for _ in reader.iter_array_values():
+                            pass
+                    else:
+                        run_data[run_key] = reader.read_value()
+                runs.append(SarifStreamRun(path, len(runs), run_data))
+    return SarifStream(path, runs)
+
+# Write a SARIF document containing a single run, one result at a time, so that the results never need to be
+# held in memory together. The output is formatted exactly as json.dump(..., indent=indent) would format the
+# equivalent document.
+def write_sarif_doc(f, sarif_tool, sarif_results, indent = 2):
+    def pad(level):
+        return ' ' * (indent * level)
+    def dumps(value, level):
+        return json.dumps(value, indent=indent).replace('\n', '\n' + pad(level))
+
+    f.write('{\n')
+    f.write(f'{pad(1)}"version": {dumps(SARIF_VERSION, 1)},\n')
+    f.write(f'{pad(1)}"$schema": {dumps(SARIF_SCHEMA, 1)},\n')
+    f.write(f'{pad(1)}"runs": [\n{pad(2)}{{\n')
+    f.write(f'{pad(3)}"tool": {dumps(sarif_tool, 3)},\n')
+    f.write(f'{pad(3)}"results": [')
+    count = 0
+    for sarif_result in sarif_results:
+        f.write((',\n' if count else '\n') + pad(4) + dumps(sarif_result, 4))
+        count += 1
+    f.write((f'\n{pad(3)}]' if count else ']') + '\n')
+    f.write(f'{pad(2)}}}\n{pad(1)}]\n}}')
+    return count
@@ -17,6 +17,36 @@ class SarifRule:
         self.regex =None
         self.is_secret = True
 
+# A rule that has been prepared once per run so that processing each result only needs a lookup: the placeholder
+# is rendered up front.
+class CompiledRule:
+    def __init__(self, sarif_rule, placeholder_text):
+        self.sarif_rule = sarif_rule
+        self.id = sarif_rule.id
+        self.is_secret = sarif_rule.is_secret
+        self.placeholder_text = placeholder_text
+        self.placeholder_bytes = placeholder_text.encode('utf-8') if placeholder_text is not None else None
+
+class RuleCatalog:
+    def __init__(self):
+        self.rules = {}
+
+    def add(self, compiled_rule):
+        self.rules[compiled_rule.id] = compiled_rule
+
+    # Returns the compiled rule for a secret-related rule, or None if the rule is unknown or not secret-related.
+    def get(self, rule_id):
+        compiled_rule = self.rules.get(rule_id)
+        return compiled_rule if compiled_rule and compiled_rule.is_secret else None
+
+    # Rules that are known but which do not relate to secrets. Results for these can be discarded outright.
+    def is_ignored(self, rule_id):
+        compiled_rule = self.rules.get(rule_id)
+        return compiled_rule is not None and not compiled_rule.is_secret
+
+    def __len__(self):
+        return len(self.rules)
+
 class SarifLocation:
     def __init__(self, sarif_location):
         self.artifact_path = get_from_dict(sarif_location, ['physicalLocation','artifactLocation','uri'])
@@ -53,6 +83,7 @@ class SarifResult:
         if len(self.locations) > 1:
             raise Exception("Result has multiple locations. This is not supported yet.")            
 
+# Not every tool's regular expressions are compatible with Python (e.g. Go RE2 syntax), so failures are tolerated.
 def get_from_dict(dict, path, default = None):
     node = dict
     for child in path:
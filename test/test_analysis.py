@@ -0,0 +1,49 @@
+import asyncio
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from secretscrub import *
+
+async def sleeping_tool(src_dir, result_dir, result_suffix='', seconds=0.5):
+    completed = await util.run_tool_async(sys.executable, '-c', f'import time; time.sleep({seconds})', cwd=src_dir)
+    completed.check_returncode()
+
+async def long_sleeping_tool(src_dir, result_dir, result_suffix=''):
+    await sleeping_tool(src_dir, result_dir, result_suffix, 30)
+
+async def failing_tool(src_dir, result_dir, result_suffix=''):
+    completed = await util.run_tool_async(sys.executable, '-c', 'import sys; sys.exit(1)', cwd=src_dir)
+    completed.check_returncode()
+
+class TestAnalysis(unittest.TestCase):
+
+    def run_tools(self, tools, **kwargs):
+        src_dir = tempfile.gettempdir()
+        start_time = time.monotonic()
+        with mock.patch.dict(Tool_Runners, {'sleep1':sleeping_tool, 'sleep2':sleeping_tool, 'sleep30':long_sleeping_tool, 'fail':failing_tool}):
+            try:
+                asyncio.run(run_tools(tools, src_dir, src_dir, **kwargs))
+            finally:
+                self.elapsed = time.monotonic() - start_time
+
+    def test_run_tools_should_run_tools_concurrently(self):
+        self.run_tools(['sleep1', 'sleep2'])
+        assert self.elapsed < 0.9
+
+    def test_run_tools_with_max_concurrent_tools_1_should_run_tools_sequentially(self):
+        self.run_tools(['sleep1', 'sleep2'], max_concurrent_tools=1)
+        assert self.elapsed >= 1.0
+
+    def test_run_tools_with_timeout_should_kill_tool(self):
+        with self.assertRaises(asyncio.TimeoutError):
+            self.run_tools(['sleep30'], tool_timeout=0.5)
+        assert self.elapsed < 10
+
+    def test_run_tools_with_failing_tool_should_cancel_other_tools(self):
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.run_tools(['fail', 'sleep30'])
+        assert self.elapsed < 10
@@ -0,0 +1,248 @@
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+import filetype
+
+from archive.handlers import can_copy_raw_members, strip_zip64_extra
+from archive import ArchiveRegistry, FileTypeCache, detect_archive_type, unpack_archives, repack_archives, walk_archives
+from secretscrub_report import SecretScrubReport, SecretScrubReportEncryption
+from util.inventory import Inventory
+
+def make_zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for (name, data) in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.srcdir = tempfile.mkdtemp()
+        self.scratchdir = tempfile.mkdtemp()
+        self.report = SecretScrubReport(None, SecretScrubReportEncryption.NONE)
+
+    def tearDown(self):
+        shutil.rmtree(self.srcdir)
+        shutil.rmtree(self.scratchdir)
+
+    def test_unpack_archives_with_workers_should_expand_nested_and_sibling_archives(self):
+        for i in range(8):
+            with open(os.path.join(self.srcdir, f'{i}.zip'), 'wb') as f:
+                f.write(make_zip({'inner.zip' : make_zip({'secret.txt' : f'secret {i}'})}))
+
+        registry = ArchiveRegistry(self.scratchdir)
+        assert unpack_archives(self.srcdir, self.report, self.scratchdir, registry, workers=4)
+        assert len(registry) == 16
+        with open(os.path.join(self.scratchdir, '[[[5.zip]]]', '[[[inner.zip]]]', 'secret.txt'), 'r') as f:
+            assert f.read() == 'secret 5'
+
+    def test_repack_archives_with_workers_should_repack_inner_archives_before_outer_ones(self):
+        for i in range(8):
+            with open(os.path.join(self.srcdir, f'{i}.zip'), 'wb') as f:
+                f.write(make_zip({'inner.zip' : make_zip({'secret.txt' : f'secret {i}'})}))
+
+        registry = ArchiveRegistry(self.srcdir)
+        assert unpack_archives(self.srcdir, self.report, registry = registry, workers = 4)
+        for i in range(0, 8, 2):
+            with open(os.path.join(self.srcdir, f'[[[{i}.zip]]]', '[[[inner.zip]]]', 'secret.txt'), 'w') as f:
+                f.write('[REDACTED]')
+            registry.mark_modified(f'[[[{i}.zip]]]/[[[inner.zip]]]/secret.txt')
+        assert repack_archives(self.srcdir, self.report, registry, workers = 4)
+
+        for i in range(8):
+            with zipfile.ZipFile(os.path.join(self.srcdir, f'{i}.zip')) as outer:
+                with zipfile.ZipFile(io.BytesIO(outer.read('inner.zip'))) as inner:
+                    assert inner.read('secret.txt') == (b'[REDACTED]' if i % 2 == 0 else f'secret {i}'.encode('utf-8'))
+        assert sorted(d for d in os.listdir(self.srcdir) if d.startswith('[[[')) == sorted(f'[[[{i}.zip]]]' for i in range(1, 8, 2))
+
+    def test_update_archive_with_zip_should_stream_original_members_and_substitute_modified_ones(self):
+        archive_path = os.path.join(self.srcdir, 'app.jar')
+        with zipfile.ZipFile(archive_path, 'w') as archive:
+            archive.writestr('z.txt', 'last alphabetically, first in archive')
+            archive.writestr(zipfile.ZipInfo('dir/'), b'')
+            archive.writestr('dir/secret.txt', 'secret', compress_type=zipfile.ZIP_STORED)
+            archive.comment = b'comment'
+
+        registry = ArchiveRegistry(self.scratchdir)
+        assert unpack_archives(self.srcdir, self.report, self.scratchdir, registry)
+        outdir = os.path.join(self.scratchdir, 'out')
+        os.makedirs(os.path.join(outdir, '[[[app.jar]]]', 'dir'))
+        with open(os.path.join(outdir, '[[[app.jar]]]', 'dir', 'secret.txt'), 'w') as f:
+            f.write('[REDACTED]')
+        registry.mark_modified('[[[app.jar]]]/dir/secret.txt')
+        assert repack_archives(outdir, self.report, registry)
+
+        assert os.listdir(outdir) == ['app.jar']
+        with zipfile.ZipFile(os.path.join(outdir, 'app.jar')) as archive:
+            assert archive.namelist() == ['z.txt', 'dir/', 'dir/secret.txt']
+            assert archive.comment == b'comment'
+            assert archive.getinfo('dir/secret.txt').compress_type == zipfile.ZIP_STORED
+            assert archive.read('dir/secret.txt') == b'[REDACTED]'
+            assert archive.read('z.txt') == b'last alphabetically, first in archive'
+
+    def test_update_archive_with_zip_should_copy_unchanged_members_without_recompressing(self):
+        # Written to a stream which cannot be seeked, so that every member is followed by a data descriptor.
+        class Unseekable(io.RawIOBase):
+            def __init__(self, f):
+                self.f = f
+            def writable(self):
+                return True
+            def write(self, b):
+                return self.f.write(b)
+        data = b''.join(f'line {i}\n'.encode('utf-8') for i in range(10000))
+        archive_path = os.path.join(self.srcdir, 'app.zip')
+        with open(archive_path, 'wb') as f:
+            with zipfile.ZipFile(Unseekable(f), 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+                archive.writestr('big.txt', data)
+                archive.writestr('secret.txt', 'secret')
+        with zipfile.ZipFile(archive_path) as archive:
+            original = archive.getinfo('big.txt')
+            assert original.flag_bits & 0x08
+
+        registry = ArchiveRegistry(self.scratchdir)
+        assert unpack_archives(self.srcdir, self.report, self.scratchdir, registry)
+        outdir = os.path.join(self.scratchdir, 'out')
+        os.makedirs(os.path.join(outdir, '[[[app.zip]]]'))
+        with open(os.path.join(outdir, '[[[app.zip]]]', 'secret.txt'), 'w') as f:
+            f.write('[REDACTED]')
+        registry.mark_modified('[[[app.zip]]]/secret.txt')
+        assert repack_archives(outdir, self.report, registry)
+
+        with zipfile.ZipFile(os.path.join(outdir, 'app.zip')) as archive:
+            assert archive.testzip() is None
+            assert archive.namelist() == ['big.txt', 'secret.txt']
+            # Recompressing would use the default compression level, rather than the one the member was written with.
+            copied = archive.getinfo('big.txt')
+            assert (copied.compress_size, copied.CRC, copied.date_time) == (original.compress_size, original.CRC, original.date_time)
+            assert archive.read('big.txt') == data
+            assert archive.read('secret.txt') == b'[REDACTED]'
+
+    def test_update_archive_with_zip_should_recompress_unchanged_members_if_they_cannot_be_copied(self):
+        archive_path = os.path.join(self.srcdir, 'app.zip')
+        # zipfile never writes a ZIP64 field for a small member, so one is put in place of another field.
+        secret_info = zipfile.ZipInfo('secret.txt')
+        secret_info.extra = b'\xfe\xca\x08\x00' + b'\x00' * 8
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('a.txt', 'unchanged')
+            archive.writestr(secret_info, 'secret')
+        with open(archive_path, 'wb') as f:
+            f.write(buffer.getvalue().replace(b'\xfe\xca\x08\x00', b'\x01\x00\x08\x00'))
+
+        registry = ArchiveRegistry(self.scratchdir)
+        assert unpack_archives(self.srcdir, self.report, self.scratchdir, registry)
+        outdir = os.path.join(self.scratchdir, 'out')
+        os.makedirs(os.path.join(outdir, '[[[app.zip]]]'))
+        with open(os.path.join(outdir, '[[[app.zip]]]', 'secret.txt'), 'w') as f:
+            f.write('[REDACTED]')
+        registry.mark_modified('[[[app.zip]]]/secret.txt')
+        with mock.patch('archive.handlers.can_copy_raw_members', return_value=False):
+            assert repack_archives(outdir, self.report, registry)
+
+        with zipfile.ZipFile(os.path.join(outdir, 'app.zip')) as archive:
+            assert archive.testzip() is None
+            assert archive.read('a.txt') == b'unchanged'
+            assert archive.read('secret.txt') == b'[REDACTED]'
+            # The modified member's local header does not keep the ZIP64 field from the original archive.
+            info = archive.getinfo('secret.txt')
+            archive.fp.seek(info.header_offset + 28)
+            assert int.from_bytes(archive.fp.read(2), 'little') == 0
+
+    # The zipfile attributes needed to copy members directly are present in every supported version of Python.
+    def test_zip_members_can_be_copied_without_recompressing(self):
+        with zipfile.ZipFile(io.BytesIO(), 'w') as archive:
+            assert can_copy_raw_members(archive)
+
+    def test_strip_zip64_extra_should_only_remove_zip64_fields(self):
+        assert strip_zip64_extra(b'\x01\x00\x08\x00' + b'\x00' * 8 + b'\x0a\x00\x02\x00xy') == b'\x0a\x00\x02\x00xy'
+        assert strip_zip64_extra(b'') == b''
+
+    def test_update_archive_with_tar_should_keep_non_file_members(self):
+        archive_path = os.path.join(self.srcdir, 'app.tar')
+        with tarfile.open(archive_path, 'w') as archive:
+            for (name, data) in [('secret.txt', b'secret'), ('other.txt', b'other')]:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mode = 0o600
+                archive.addfile(info, io.BytesIO(data))
+            link = tarfile.TarInfo('link.txt')
+            link.type = tarfile.SYMTYPE
+            link.linkname = 'other.txt'
+            archive.addfile(link)
+
+        registry = ArchiveRegistry(self.scratchdir)
+        assert unpack_archives(self.srcdir, self.report, self.scratchdir, registry)
+        outdir = os.path.join(self.scratchdir, 'out')
+        os.makedirs(os.path.join(outdir, '[[[app.tar]]]'))
+        with open(os.path.join(outdir, '[[[app.tar]]]', 'secret.txt'), 'w') as f:
+            f.write('[REDACTED]')
+        registry.mark_modified('[[[app.tar]]]/secret.txt')
+        assert repack_archives(outdir, self.report, registry)
+
+        with tarfile.open(os.path.join(outdir, 'app.tar')) as archive:
+            assert archive.getnames() == ['secret.txt', 'other.txt', 'link.txt']
+            assert archive.getmember('secret.txt').mode == 0o600
+            assert archive.extractfile('secret.txt').read() == b'[REDACTED]'
+            assert archive.getmember('link.txt').issym()
+
+    def test_detect_archive_type_should_agree_with_filetype(self):
+        tar_buffer = io.BytesIO()
+        with tarfile.open(fileobj=tar_buffer, mode='w') as archive:
+            archive.addfile(tarfile.TarInfo('empty.txt'))
+        samples = {
+            'a.zip' : make_zip({'a.txt' : 'a'}),
+            'renamed.txt' : make_zip({'a.txt' : 'a'}),
+            'a.tar' : tar_buffer.getvalue(),
+            'a.gz' : b'\x1f\x8b\x08' + bytes(32),
+            'a.pdf' : b'%PDF-1.4\n',
+            'a.png' : b'\x89PNG\r\n\x1a\n' + bytes(32),
+            'a.py' : b'# PK\x03\x04\n',
+            'empty.zip' : b''
+        }
+        for (name, data) in samples.items():
+            path = os.path.join(self.srcdir, name)
+            with open(path, 'wb') as f:
+                f.write(data)
+            kind = filetype.guess(path)
+            expected = kind.mime if kind is not None and kind.mime in ['application/zip', 'application/x-tar', 'application/gzip', 'application/pdf'] else None
+            assert detect_archive_type(path) == expected, name
+
+    def test_file_type_cache_should_reuse_results_until_file_changes(self):
+        path = os.path.join(self.srcdir, 'a.zip')
+        with open(path, 'wb') as f:
+            f.write(make_zip({'a.txt' : 'a'}))
+        cache_path = os.path.join(self.scratchdir, 'filetype.cache')
+        cache = FileTypeCache(cache_path)
+        assert list(walk_archives(self.srcdir, Inventory.scan(self.srcdir), cache)) == [(path, 'application/zip')]
+        cache.save()
+
+        cache = FileTypeCache(cache_path)
+        with mock.patch('archive.detection.detect_archive_type', side_effect=AssertionError('file was examined')):
+            assert list(walk_archives(self.srcdir, Inventory.scan(self.srcdir), cache)) == [(path, 'application/zip')]
+        assert (cache.hits, cache.misses) == (1, 0)
+
+        with open(path, 'wb') as f:
+            f.write(b'no longer an archive')
+        assert list(walk_archives(self.srcdir, Inventory.scan(self.srcdir), cache)) == []
+        assert cache.misses == 1
+
+    def test_file_type_cache_should_not_be_used_for_expanded_archive_contents(self):
+        with open(os.path.join(self.srcdir, 'outer.zip'), 'wb') as f:
+            f.write(make_zip({'inner.zip' : make_zip({'a.txt' : 'a'}), 'b.txt' : 'b'}))
+        cache_path = os.path.join(self.scratchdir, 'filetype.cache')
+        cache = FileTypeCache(cache_path)
+        registry = ArchiveRegistry(os.path.join(self.scratchdir, 'archives'))
+        assert unpack_archives(self.srcdir, self.report, registry.root, registry, inventory=Inventory.scan(self.srcdir), cache=cache)
+        assert len(registry) == 2
+        assert (cache.hits, cache.misses) == (0, 1)
+        cache.save()
+        with open(cache_path, 'r') as f:
+            assert len(json.load(f)['entries']) == 1
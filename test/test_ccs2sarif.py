@@ -0,0 +1,58 @@
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import util
+from ccs2sarif import ccs_to_sarif
+
+# A stand-in for ccs.py: the converter reads its rules, and running it prints results in the format that ccs uses.
+CCS_PY = '''
+import re
+import sys
+pwd_rules = [
+    (re.compile('password'), 1, 'password', 'Password'),
+    (re.compile('todo'), 2, 'other', 'Other'),
+]
+if __name__ == '__main__':
+    for i in range(1, int(sys.argv[1]) + 1):
+        print(f'{sys.argv[2]}/dir/file{i}.txt:{i}:password:Rule:1:prefix:password = secret{i}')
+'''
+
+class TestCcs2Sarif(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.srcdir = os.path.join(self.tmpdir, 'src')
+        os.makedirs(self.srcdir)
+        self.ccs_path = os.path.join(self.tmpdir, 'ccs.py')
+        with open(self.ccs_path, 'w') as f:
+            f.write(CCS_PY)
+        self.out_path = os.path.join(self.tmpdir, 'out.sarif')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_results(self):
+        with open(self.out_path, 'r') as f:
+            return json.load(f)['runs'][0]['results']
+
+    def test_ccs_to_sarif_with_string_should_convert_each_line(self):
+        ccs_output = f'{self.srcdir}/a.txt:3:password:Rule:1:prefix:password = x\r\nnot a result\r\n'
+        ccs_to_sarif(self.ccs_path, self.srcdir, ccs_output, self.out_path)
+        results = self.read_results()
+        assert len(results) == 1
+        assert results[0]['ruleId'] == 'password:Rule:1'
+        assert results[0]['locations'][0]['physicalLocation']['region']['snippet']['text'] == 'password = x'
+
+    def test_run_tool_streamed_should_convert_tool_output_as_it_is_produced(self):
+        (completed, _) = asyncio.run(util.run_tool_streamed(sys.executable, self.ccs_path, '5000', self.srcdir, cwd=self.srcdir,
+                                                                consume=lambda stream: ccs_to_sarif(self.ccs_path, self.srcdir, stream, self.out_path)))
+        completed.check_returncode()
+        results = self.read_results()
+        assert len(results) == 5000
+        assert results[4999]['locations'][0]['physicalLocation']['artifactLocation']['uri'] == 'dir/file5000.txt'
+        assert results[4999]['locations'][0]['physicalLocation']['region']['startLine'] == 5000
@@ -0,0 +1,56 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from cq2sarif import cq_to_sarif
+
+CQ_PY = '''
+import regex
+LINE_REGEX_CHECKS = [
+    ('cred_password', regex.compile(r'password\\s*=')),
+    ('other_check', regex.compile(r'todo')),
+]
+'''
+
+class TestCq2Sarif(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.srcdir = os.path.join(self.tmpdir, 'src')
+        self.resultsdir = os.path.join(self.tmpdir, 'results')
+        os.makedirs(self.srcdir)
+        os.makedirs(self.resultsdir)
+        self.cq_path = os.path.join(self.tmpdir, 'cq.py')
+        with open(self.cq_path, 'w') as f:
+            f.write(CQ_PY)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_cq_to_sarif_should_stream_results_for_known_rules_only(self):
+        with open(os.path.join(self.resultsdir, 'cred_password.txt'), 'w') as f:
+            for i in range(1, 1001):
+                f.write(f'{self.srcdir}/dir/file{i}.txt:{i}:password = secret{i}\n')
+        with open(os.path.join(self.resultsdir, 'unknown.txt'), 'w') as f:
+            f.write(f'{self.srcdir}/a.txt:1:ignored\n')
+
+        out_path = os.path.join(self.tmpdir, 'out.sarif')
+        cq_to_sarif(self.cq_path, self.srcdir, self.resultsdir, out_path)
+        with open(out_path, 'r') as f:
+            sarif = json.load(f)
+
+        results = sarif['runs'][0]['results']
+        assert [r['id'] for r in sarif['runs'][0]['tool']['driver']['rules']] == ['cred_password', 'other_check']
+        assert len(results) == 1000
+        assert results[9]['ruleId'] == 'cred_password'
+        assert results[9]['locations'][0]['physicalLocation']['artifactLocation']['uri'] == 'dir/file10.txt'
+        assert results[9]['locations'][0]['physicalLocation']['region']['startLine'] == 10
+        assert results[9]['locations'][0]['physicalLocation']['region']['snippet']['text'] == 'password = secret10'
+
+    def test_cq_to_sarif_with_no_results_should_write_empty_results(self):
+        out_path = os.path.join(self.tmpdir, 'out.sarif')
+        cq_to_sarif(self.cq_path, self.srcdir, self.resultsdir, out_path)
+        with open(out_path, 'r') as f:
+            assert json.load(f)['runs'][0]['results'] == []
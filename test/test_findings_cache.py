@@ -0,0 +1,107 @@
+import asyncio
+import json
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+from secretscrub import *
+from secretscrub_findings_cache import FindingsCache
+from secretscrub_sarif import write_sarif_doc
+
+Scanned_Paths = []
+
+# Reports every line containing SECRET, and records which files it was run over.
+async def fake_tool(src_dir, result_dir, result_suffix=''):
+    results = []
+    for (root, dirs, files) in os.walk(src_dir):
+        for file in files:
+            rel_path = os.path.relpath(os.path.join(root, file), src_dir).replace('\\', '/')
+            Scanned_Paths.append(rel_path)
+            with open(os.path.join(root, file), 'r') as f:
+                for (i, line) in enumerate(f, start=1):
+                    if 'SECRET' in line:
+                        results.append(make_cq_result_dict(rel_path, i, 'SECRET'))
+    tool = {'driver' : {'name' : 'cq', 'rules' : [{'id' : 'cred_test', 'name' : 'test', 'shortDescription' : {'text' : 'SECRET'}}]}}
+    with open(os.path.join(result_dir, f'99-cq{result_suffix}.sarif'), 'w') as f:
+        write_sarif_doc(f, tool, results)
+
+async def fake_fingerprint():
+    return ('1.0', 'rules')
+
+def make_cq_result_dict(path, line, snippet):
+    return {'ruleId':'cred_test','locations':[{'physicalLocation':{'artifactLocation':{'uri':path},'region':{'startLine':line,'endLine':line,'snippet':{'text':snippet}}}}]}
+
+class TestFindingsCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.srcdir = os.path.join(self.tmpdir, 'src')
+        self.cache = os.path.join(self.tmpdir, 'cache')
+        os.makedirs(os.path.join(self.srcdir, 'vendor'))
+        self.write_src('a.txt', 'SECRET\n')
+        self.write_src('b.txt', 'nothing\n')
+        Scanned_Paths.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_src(self, name, data):
+        with open(os.path.join(self.srcdir, name), 'w') as f:
+            f.write(data)
+
+    def run_fake_tool(self):
+        result_dir = tempfile.mkdtemp(dir=self.tmpdir)
+        findings_cache = FindingsCache(self.cache, os.path.join(self.tmpdir, 'scratch'))
+        with mock.patch.dict(Tool_Runners, {'fake' : fake_tool}), mock.patch.dict(Tool_Fingerprints, {'fake' : fake_fingerprint}):
+            runs = asyncio.run(run_tools(['fake'], self.srcdir, result_dir, findings_cache=findings_cache))
+        targets = RedactionTargets()
+        for (file_type, file_subdir, file_path) in get_input_files(result_dir):
+            process_sarif_file(file_path, file_subdir, targets, '[X]')
+        for run in runs:
+            process_sarif_run(run, run.path, '', targets, '[X]')
+        return (findings_cache, dict((target.artifact_path, [e.sarif_result.locations[0].start_line for e in target.entries]) for target in targets))
+
+    def test_run_tools_with_findings_cache_should_only_scan_files_not_seen_before(self):
+        (findings_cache, first) = self.run_fake_tool()
+        assert sorted(Scanned_Paths) == ['a.txt', 'b.txt']
+        assert first == {'a.txt' : [0]}
+
+        Scanned_Paths.clear()
+        self.write_src('b.txt', 'x\nSECRET\n')
+        self.write_src('vendor/a.txt', 'SECRET\n')
+        self.write_src('vendor/c.txt', 'SECRET\n')
+        (findings_cache, second) = self.run_fake_tool()
+        # The same content at another path is rescanned, as the tool may treat it differently there.
+        assert sorted(Scanned_Paths) == ['b.txt', 'vendor/a.txt', 'vendor/c.txt']
+        assert second == {'a.txt' : [0], 'b.txt' : [1], 'vendor/a.txt' : [0], 'vendor/c.txt' : [0]}
+        assert (findings_cache.hits, findings_cache.misses) == (1, 3)
+
+    def test_run_tools_with_findings_cache_should_share_results_by_name_for_path_independent_tools(self):
+        with mock.patch('secretscrub.Path_Independent_Tools', {'fake'}):
+            self.run_fake_tool()
+            Scanned_Paths.clear()
+            self.write_src('vendor/a.txt', 'SECRET\n')
+            (findings_cache, results) = self.run_fake_tool()
+        assert Scanned_Paths == []
+        assert results == {'a.txt' : [0], 'vendor/a.txt' : [0]}
+        assert stat.S_IMODE(os.stat(self.cache).st_mode) == 0o700
+
+    def test_run_tools_with_findings_cache_should_rescan_when_tool_changes(self):
+        self.run_fake_tool()
+        Scanned_Paths.clear()
+        async def new_fingerprint():
+            return ('2.0', 'rules')
+        with mock.patch('test.test_findings_cache.fake_fingerprint', new_fingerprint):
+            (findings_cache, results) = self.run_fake_tool()
+        assert sorted(Scanned_Paths) == ['a.txt', 'b.txt']
+        assert results == {'a.txt' : [0]}
+
+    def test_get_tool_key_should_change_with_result_settings(self):
+        findings_cache = FindingsCache(self.cache, os.path.join(self.tmpdir, 'scratch'))
+        key = findings_cache.get_tool_key('bindetect', '1.0', '')
+        assert findings_cache.get_tool_key('bindetect', '1.0', '', {}) == key
+        assert findings_cache.get_tool_key('bindetect', '1.0', '', {'sniff' : True, 'sniff_max_size' : None}) != key
+        assert findings_cache.get_tool_key('bindetect', '1.0', '', {'sniff' : True, 'sniff_max_size' : 1024}) != findings_cache.get_tool_key('bindetect', '1.0', '', {'sniff' : True, 'sniff_max_size' : None})
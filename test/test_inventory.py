@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from secretscrub import *
+from archive import walk_archives
+from bindetect import BinDetectStats, process_dir
+from util.inventory import Inventory
+
+class TestInventory(unittest.TestCase):
+
+    def setUp(self):
+        self.srcdir = tempfile.mkdtemp()
+        self.outdir = tempfile.mkdtemp()
+        for (name, data) in [('b.txt', b'b'), ('a/x.keystore', b'KEYSTORE'), ('a/c/empty.txt', b''), ('.git/config', b'secret')]:
+            os.makedirs(os.path.dirname(os.path.join(self.srcdir, name)), exist_ok=True)
+            with open(os.path.join(self.srcdir, name), 'wb') as f:
+                f.write(data)
+        os.makedirs(os.path.join(self.srcdir, 'empty'))
+
+    def tearDown(self):
+        shutil.rmtree(self.srcdir)
+        shutil.rmtree(self.outdir)
+
+    def test_scan_should_record_every_file_and_directory_in_sorted_order(self):
+        inventory = Inventory.scan(self.srcdir)
+        assert [e.rel_path for e in inventory.entries] == ['.git', '.git/config', 'a', 'a/c', 'a/c/empty.txt', 'a/x.keystore', 'b.txt', 'empty']
+        assert [e.rel_path for e in inventory.dirs()] == ['.git', 'a', 'a/c', 'empty']
+        keystore = list(inventory.files())[2]
+        st = os.stat(os.path.join(self.srcdir, 'a', 'x.keystore'))
+        assert (keystore.size, keystore.mtime_ns, keystore.inode) == (8, st.st_mtime_ns, st.st_ino)
+        assert inventory.total_size() == 15
+
+    def test_stages_given_an_inventory_should_not_walk_the_directory(self):
+        inventory = Inventory.scan(self.srcdir)
+        with mock.patch('os.walk', side_effect=AssertionError('directory was walked')):
+            assert list(walk_archives(self.srcdir, inventory)) == []
+            stats = BinDetectStats()
+            results = list(process_dir(self.srcdir, stats, inventory=inventory))
+            copy_remaining_files(self.srcdir, self.outdir, 'copy', inventory)
+        assert [r['locations'][0]['physicalLocation']['artifactLocation']['uri'] for r in results] == ['a/x.keystore']
+        assert stats.files_seen == 4
+        assert os.path.isdir(os.path.join(self.outdir, 'empty'))
+        assert os.path.isfile(os.path.join(self.outdir, 'a', 'c', 'empty.txt'))
+        assert not os.path.exists(os.path.join(self.outdir, '.git'))
+
+    def test_inventory_should_only_be_used_for_its_own_directory(self):
+        inventory = Inventory.scan(os.path.join(self.srcdir, 'a'))
+        copy_remaining_files(self.srcdir, self.outdir, 'copy', inventory)
+        assert os.path.isfile(os.path.join(self.outdir, 'b.txt'))
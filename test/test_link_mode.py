@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from parameterized import parameterized
+
+from secretscrub import *
+
+class TestLinkMode(unittest.TestCase):
+
+    def setUp(self):
+        self.srcdir = tempfile.mkdtemp()
+        self.outdir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.srcdir, 'sub'))
+        with open(os.path.join(self.srcdir, 'sub', 'a.txt'), 'wb') as f:
+            f.write(b'line one\nSECRET\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.srcdir)
+        shutil.rmtree(self.outdir)
+
+    def src_path(self):
+        return os.path.join(self.srcdir, 'sub', 'a.txt')
+
+    def out_path(self):
+        return os.path.join(self.outdir, 'sub', 'a.txt')
+
+    def test_copy_remaining_files_with_hardlink_mode_should_link_files(self):
+        copy_remaining_files(self.srcdir, self.outdir, 'hardlink')
+        assert os.path.samefile(self.src_path(), self.out_path())
+
+    @parameterized.expand(['copy', 'reflink'])
+    def test_copy_remaining_files_with_copy_or_reflink_mode_should_create_new_inode(self, link_mode):
+        copy_remaining_files(self.srcdir, self.outdir, link_mode)
+        assert not os.path.samefile(self.src_path(), self.out_path())
+        with open(self.out_path(), 'rb') as f:
+            assert f.read() == b'line one\nSECRET\n'
+
+    def test_file_linker_with_unknown_mode_should_raise(self):
+        with self.assertRaises(ValueError):
+            util.FileLinker('symlink')
+
+    def test_redact_target_over_hardlinked_output_should_not_modify_source(self):
+        copy_remaining_files(self.srcdir, self.outdir, 'hardlink')
+        sarif_result = CqResult({'ruleId':'cred_test','locations':[{'physicalLocation':{'artifactLocation':{'uri':'sub/a.txt'},'region':{'startLine':2,'endLine':2,'snippet':{'text':'SECRET'}}}}]})
+        targets = RedactionTargets()
+        targets.add('sub/a.txt', RedactionEntry(TOOL_NAME_CQ, 'test.sarif', CompiledRule(SarifRule(TOOL_NAME_CQ, {'id':'cred_test'}), '[X]'), sarif_result))
+        redact_target(next(iter(targets)), self.srcdir, self.outdir)
+        assert not os.path.samefile(self.src_path(), self.out_path())
+        with open(self.src_path(), 'rb') as f:
+            assert f.read() == b'line one\nSECRET\n'
+        with open(self.out_path(), 'rb') as f:
+            assert f.read() == b'line one\n[X]\n'
@@ -0,0 +1,79 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from secretscrub import main as secretscrub_main
+from secretscrub_metrics import Metrics
+from secretscrub_report import SecretScrubReport, SecretScrubReportEncryption
+
+from .test_secretscrub import Args
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def invoke_secretscrub(self, metrics_format):
+        args = Args()
+        args.analyse_with = 'bindetect'
+        args.srcdir = os.path.join(os.path.dirname(__file__), 'data', 'bin')
+        args.outdir = os.path.join(self.tmpdir, 'out')
+        args.report_encryption = SecretScrubReportEncryption.NONE
+        args.metrics = os.path.join(self.tmpdir, 'metrics')
+        args.metrics_format = metrics_format
+        secretscrub_main(args)
+        with open(args.metrics, 'r') as f:
+            return f.read()
+
+    def test_main_metrics_should_time_each_stage_and_count_results(self):
+        metrics = json.loads(self.invoke_secretscrub('json'))
+        assert metrics['completed']
+        stages = dict(((stage['stage'], stage['name']), stage) for stage in metrics['stages'])
+        assert set(stages) >= {('inventory', None), ('analysis', None), ('tool', 'bindetect'), ('sarif', '70-bindetect.sarif'), ('redaction', None), ('copy', None)}
+        assert stages[('tool', 'bindetect')]['bytes_read'] > 0
+        assert stages[('redaction', None)]['bytes_written'] > 0
+        assert all(stage['wall_seconds'] >= 0 for stage in metrics['stages'])
+        scrubbed = metrics['results']['by_status']['Scrubbed']
+        assert scrubbed > 0
+        assert metrics['results']['by_tool'] == {'BinDetect' : {'Scrubbed' : scrubbed}}
+
+    def test_main_metrics_prometheus_format(self):
+        text = self.invoke_secretscrub('prometheus')
+        assert '# TYPE secretscrub_run_wall_seconds gauge\n' in text
+        assert 'secretscrub_run_completed 1\n' in text
+        assert 'secretscrub_stage_wall_seconds{stage="tool",name="bindetect"} ' in text
+        assert 'secretscrub_tool_results{tool="BinDetect",status="Scrubbed"} ' in text
+
+    def test_metrics_should_be_written_when_run_fails(self):
+        path = os.path.join(self.tmpdir, 'metrics.json')
+        metrics = Metrics(path)
+        try:
+            with metrics.stage('tool', 'trivy', 10):
+                raise ValueError()
+        except ValueError:
+            pass
+        metrics.record_row({'Tool' : 'Trivy', 'Status' : 'SarifError'})
+        metrics.save()
+        with open(path, 'r') as f:
+            saved = json.load(f)
+        assert not saved['completed']
+        assert saved['stages'][0]['name'] == 'trivy' and saved['stages'][0]['bytes_read'] == 10
+        assert saved['bytes_read'] == 10
+        assert saved['results'] == {'by_status' : {'SarifError' : 1}, 'by_tool' : {'Trivy' : {'SarifError' : 1}}}
+
+    def test_metrics_should_count_file_results_and_replayed_rows(self):
+        metrics = Metrics(os.path.join(self.tmpdir, 'metrics.json'))
+        recorded = []
+        report = SecretScrubReport(None, SecretScrubReportEncryption.NONE)
+        report.add_row_observer(metrics.record_row, replayed=True)
+        report.add_row_observer(recorded.append)
+        report.log_file_result(os.path.join(self.tmpdir, 'bad.zip'), 'ArchiveExtractionFailure', 'Archive file could not be extracted')
+        report.log_row({'File Name' : 'a.txt', 'Directory' : '', 'Tool' : 'Trivy', 'Status' : 'Scrubbed'})
+        report.close()
+        assert metrics.to_dict()['results'] == {'by_status' : {'ArchiveExtractionFailure' : 1, 'Scrubbed' : 1}, 'by_tool' : {'Trivy' : {'Scrubbed' : 1}}}
+        assert list(row['Status'] for row in recorded) == ['ArchiveExtractionFailure']
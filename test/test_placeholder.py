@@ -2,6 +2,7 @@ import json
 import unittest
 
 from secretscrub import *
+from secretscrub_sarif import SarifStreamRun
 
 class TestPlaceholder(unittest.TestCase):
 
@@ -89,3 +90,15 @@ class TestPlaceholder(unittest.TestCase):
         assert text == "[TEST Rule: the_rule Foo: ${bar}]"
 
 
+
+    def test_build_rules_dict_should_render_placeholder_and_compile_regex_once_per_rule(self):
+        sarif_run = SarifStreamRun(None, 0, {'tool':{'driver':{'name':'trivy','rules':[
+            {'id':'r1','name':'rule1','shortDescription':{'text':'desc'},'properties':{'tags':['secret']}},
+            {'id':'r2','name':'rule2','shortDescription':{'text':'desc'},'properties':{'tags':[]}}]}}})
+        rule_catalog = build_rules_dict(TOOL_NAME_TRIVY, sarif_run, '[TEST ${rule}]')
+        compiled_rule = rule_catalog.get('r1')
+        assert compiled_rule.placeholder_text == '[TEST rule1 - desc]'
+        assert compiled_rule.placeholder_bytes == b'[TEST rule1 - desc]'
+        assert rule_catalog.get('r2') is None
+        assert rule_catalog.is_ignored('r2')
+        assert not rule_catalog.is_ignored('r3')
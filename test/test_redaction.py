@@ -0,0 +1,143 @@
+import base64
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from secretscrub import *
+from secretscrub_redaction import TEXT_ENCODING, ArtifactSource
+from secretscrub_report import SecretScrubReportEncryption
+
+def make_cq_result(path, line, snippet):
+    return CqResult({'ruleId':'cred_test','locations':[{'physicalLocation':{'artifactLocation':{'uri':path},'region':{'startLine':line,'endLine':line,'snippet':{'text':snippet}}}}]})
+
+def make_bindetect_result(path, offset, length, snippet=None):
+    region = {'byteOffset':offset,'byteLength':length}
+    if snippet is not None:
+        region['snippet'] = {'binary':base64.b64encode(snippet).decode('utf-8')}
+    return BinDetectResult({'ruleId':'bin_test','locations':[{'physicalLocation':{'artifactLocation':{'uri':path},'region':region}}]})
+
+def make_entry(sarif_result, placeholder='[X]'):
+    return RedactionEntry(sarif_result.tool_name, 'test.sarif', CompiledRule(SarifRule(sarif_result.tool_name, {'id':sarif_result.rule_id}), placeholder), sarif_result)
+
+class TestRedaction(unittest.TestCase):
+
+    def setUp(self):
+        self.srcdir = tempfile.mkdtemp()
+        self.outdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.srcdir)
+        shutil.rmtree(self.outdir)
+
+    def write_src(self, name, data):
+        with open(os.path.join(self.srcdir, name), 'wb') as f:
+            f.write(data)
+
+    def read_out(self, name):
+        with open(os.path.join(self.outdir, name), 'rb') as f:
+            return f.read()
+
+    def test_redact_target_with_results_on_several_lines_should_redact_all_of_them(self):
+        self.write_src('a.txt', b'one SECRET1\r\ntwo\r\nthree SECRET2\r\n')
+        targets = RedactionTargets()
+        targets.add('a.txt', make_entry(make_cq_result('a.txt', 3, 'SECRET2')))
+        targets.add('a.txt', make_entry(make_cq_result('a.txt', 1, 'SECRET1')))
+        outcomes = redact_target(next(iter(targets)), self.srcdir, self.outdir)
+        assert [o[2] for o in outcomes] == ['Scrubbed', 'Scrubbed']
+        assert outcomes[0][1] == ['SECRET2']
+        assert outcomes[1][1] == ['SECRET1']
+        assert self.read_out('a.txt') == b'one [X]\r\ntwo\r\nthree [X]\r\n'
+
+    def test_redact_target_with_overlapping_results_should_keep_first_placeholder(self):
+        self.write_src('a.txt', b'key = ABCDEFGH\n')
+        targets = RedactionTargets()
+        targets.add('a.txt', make_entry(make_cq_result('a.txt', 1, 'ABCDEF'), '[FIRST]'))
+        targets.add('a.txt', make_entry(make_cq_result('a.txt', 1, 'CDEFGH'), '[SECOND]'))
+        outcomes = redact_target(next(iter(targets)), self.srcdir, self.outdir)
+        assert [o[2] for o in outcomes] == ['Scrubbed', 'Scrubbed']
+        assert self.read_out('a.txt') == b'key = [FIRST]\n'
+
+    def test_redact_target_with_multi_byte_characters_should_redact_correct_bytes(self):
+        self.write_src('a.txt', 'ключ = SECRET\n'.encode(TEXT_ENCODING))
+        targets = RedactionTargets()
+        targets.add('a.txt', make_entry(make_cq_result('a.txt', 1, 'SECRET')))
+        redact_target(next(iter(targets)), self.srcdir, self.outdir)
+        assert self.read_out('a.txt') == 'ключ = [X]\n'.encode(TEXT_ENCODING)
+
+    def test_redact_target_with_invalid_line_should_report_error_and_not_write_file(self):
+        self.write_src('a.txt', b'SECRET\n')
+        targets = RedactionTargets()
+        targets.add('a.txt', make_entry(make_cq_result('a.txt', 5, 'SECRET')))
+        outcomes = redact_target(next(iter(targets)), self.srcdir, self.outdir)
+        assert outcomes[0][2] == 'SarifError'
+        assert not os.path.exists(os.path.join(self.outdir, 'a.txt'))
+
+    def test_redact_target_with_missing_file_should_report_io_error(self):
+        targets = RedactionTargets()
+        targets.add('missing.txt', make_entry(make_cq_result('missing.txt', 1, 'SECRET')))
+        outcomes = redact_target(next(iter(targets)), self.srcdir, self.outdir)
+        assert outcomes[0][2] == 'IOError'
+
+    def test_redact_target_with_binary_result_should_replace_bytes(self):
+        self.write_src('a.bin', b'\x00\x01SECRET\x02')
+        targets = RedactionTargets()
+        targets.add('a.bin', make_entry(make_bindetect_result('a.bin', 2, 6)))
+        outcomes = redact_target(next(iter(targets)), self.srcdir, self.outdir)
+        assert outcomes[0][1] == [b'SECRET']
+        assert self.read_out('a.bin') == b'\x00\x01[X]\x02'
+
+    def test_redact_target_with_whole_file_binary_result_should_not_read_source(self):
+        self.write_src('a.keystore', b'\x00KEYSTORE\xff')
+        targets = RedactionTargets()
+        targets.add('a.keystore', make_entry(make_bindetect_result('a.keystore', 0, 10, b'\x00KEYSTORE\xff')))
+        with mock.patch.object(ArtifactSource, 'data', new_callable=mock.PropertyMock, side_effect=AssertionError('source was read')):
+            outcomes = redact_target(next(iter(targets)), self.srcdir, self.outdir)
+        assert outcomes[0][1] == [b'\x00KEYSTORE\xff']
+        assert self.read_out('a.keystore') == b'[X]'
+
+    def test_redact_target_with_empty_file_should_report_invalid_location(self):
+        self.write_src('a.bin', b'')
+        targets = RedactionTargets()
+        targets.add('a.bin', make_entry(make_bindetect_result('a.bin', 0, 0)))
+        outcomes = redact_target(next(iter(targets)), self.srcdir, self.outdir)
+        assert outcomes[0][2] == 'SarifError'
+
+    def test_redact_target_with_line_index_chunks_smaller_than_file_should_redact_correct_lines(self):
+        lines = [f'line {i}\r\n' if i % 3 else f'line {i}\r' for i in range(200)]
+        lines[150] = 'key SECRET\r\n'
+        self.write_src('a.txt', ''.join(lines).encode('utf-8'))
+        targets = RedactionTargets()
+        targets.add('a.txt', make_entry(make_cq_result('a.txt', 151, 'SECRET')))
+        with mock.patch('secretscrub_redaction.LINE_INDEX_CHUNK_SIZE', 64):
+            outcomes = redact_target(next(iter(targets)), self.srcdir, self.outdir)
+        assert outcomes[0][2] == 'Scrubbed'
+        lines[150] = 'key [X]\r\n'
+        assert self.read_out('a.txt') == ''.join(lines).encode('utf-8')
+
+    def test_redaction_targets_should_group_entries_by_normalised_path(self):
+        targets = RedactionTargets()
+        targets.add('dir/a.txt', make_entry(make_cq_result('dir/a.txt', 1, 'A')))
+        targets.add('dir/./a.txt', make_entry(make_cq_result('dir/./a.txt', 2, 'B')))
+        assert len(targets) == 1
+        assert len(next(iter(targets)).entries) == 2
+
+    def test_redact_targets_with_multiple_jobs_should_produce_same_report_as_single_job(self):
+        targets = RedactionTargets()
+        for i in reversed(range(20)):
+            self.write_src(f'{i}.txt', f'line\nsecret SECRET{i}\n'.encode('utf-8'))
+            targets.add(f'{i}.txt', make_entry(make_cq_result(f'{i}.txt', 2, f'SECRET{i}')))
+
+        reports = []
+        for jobs in [1, 4]:
+            report_path = os.path.join(self.outdir, f'report-{jobs}.csv')
+            report = SecretScrubReport(report_path, SecretScrubReportEncryption.NONE)
+            redact_targets(targets, self.srcdir, os.path.join(self.outdir, str(jobs)), report, jobs)
+            report.close()
+            with open(report_path, 'rb') as f:
+                reports.append(f.read())
+
+        assert reports[0] == reports[1]
+        assert reports[0].count(b'Scrubbed') == 40
+        assert self.read_out(os.path.join('4', '7.txt')) == b'line\nsecret [X]\n'
@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from secretscrub import *
+from regexscan import RegexMatcher, load_checks, regex_scan
+
+from secretscrub import main as secretscrub_main
+from .test_secretscrub import Args
+
+CQ_PY = '''
+import regex
+LINE_REGEX_CHECKS = [
+    ('cred_password', regex.compile(r'password\\s*=\\s*\\S+')),
+    ('other_check', regex.compile(r'todo')),
+]
+'''
+
+CCS_PY = '''
+import re
+TOKEN = 'tok_'
+pwd_rules = [
+    (re.compile(TOKEN + '[0-9a-f]{8}'), 1, 'token', 'Token'),
+    (re.compile(r'(["\\'])secret\\1'), 2, 'quoted', 'Quoted'),
+]
+'''
+
+class TestRegexScan(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.srcdir = os.path.join(self.tmpdir, 'src')
+        self.outdir = os.path.join(self.tmpdir, 'out')
+        os.makedirs(self.srcdir)
+        for (name, content) in [('cq.py', CQ_PY), ('ccs.py', CCS_PY)]:
+            with open(os.path.join(self.tmpdir, name), 'w') as f:
+                f.write(content)
+        self.checks = load_checks(os.path.join(self.tmpdir, 'cq.py'), os.path.join(self.tmpdir, 'ccs.py'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_src(self, name, data):
+        with open(os.path.join(self.srcdir, name), 'wb') as f:
+            f.write(data)
+
+    def test_load_checks_should_read_cred_checks_from_cq_and_all_checks_from_ccs(self):
+        assert [rule_id for (rule_id, _) in self.checks] == ['cq/cred_password', 'ccs/token:Rule:1', 'ccs/quoted:Rule:2']
+        assert self.checks[1][1] == 'tok_[0-9a-f]{8}'
+
+    def test_regex_matcher_should_match_combined_and_backreference_checks(self):
+        matcher = RegexMatcher(self.checks)
+        assert list(matcher.match_line('x tok_0123abcd password=hunter2')) == [('cq/cred_password', (15, 31)), ('ccs/token:Rule:1', (2, 14))]
+        assert list(matcher.match_line('a = "secret"')) == [('ccs/quoted:Rule:2', (4, 12))]
+        assert list(matcher.match_line('nothing here')) == []
+
+    def test_regex_scan_with_multiple_jobs_should_produce_same_results_as_single_job(self):
+        for i in reversed(range(10)):
+            self.write_src(f'{i}.txt', f'line\r\npassword = pw{i}\rtok_{i:08x}\n'.encode('utf-8'))
+        self.write_src('binary.bin', b'\0password = x')
+        serial = list(regex_scan(self.srcdir, self.checks).get_results())
+        parallel = list(regex_scan(self.srcdir, self.checks, jobs=4).get_results())
+        assert parallel == serial
+        assert len(serial) == 20
+        region = serial[1]['locations'][0]['physicalLocation']['region']
+        assert (region['startLine'], region['startColumn'], region['snippet']['text']) == (3, 1, 'tok_00000000')
+
+    def test_regex_scan_results_should_redact_only_the_matched_text(self):
+        self.write_src('a.txt', b'pw: password = hunter2 # password = hunter2\nkeep tok_0000000\n')
+        run = regex_scan(self.srcdir, self.checks)
+        targets = RedactionTargets()
+        collect_results(TOOL_NAME_REGEXSCAN, run.path, '', targets, '[X]', run)
+        redact_targets(targets, [self.srcdir], self.outdir, SecretScrubReport(None, ReportEncryption.NONE))
+        with open(os.path.join(self.outdir, 'a.txt'), 'rb') as f:
+            assert f.read() == b'pw: [X] # [X]\nkeep tok_0000000\n'
+
+    def test_main_with_empty_findings_cache_should_redact_regex_scan_results(self):
+        self.write_src('a.txt', b'password = hunter2\n')
+        args = Args()
+        args.analyse_with = 'regexscan'
+        args.srcdir = self.srcdir
+        args.outdir = self.outdir
+        args.report_encryption = ReportEncryption.NONE
+        args.findings_cache = os.path.join(self.tmpdir, 'cache')
+        with mock.patch('regexscan.load_checks', return_value=self.checks):
+            secretscrub_main(args)
+        with open(os.path.join(self.outdir, 'a.txt'), 'rb') as f:
+            assert b'hunter2' not in f.read()
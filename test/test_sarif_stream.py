@@ -0,0 +1,74 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from secretscrub import *
+from secretscrub_sarif import JsonStreamReader, load_sarif_stream
+
+SARIF_DOC = {
+    'version' : '2.1.0',
+    'runs' : [
+        {
+            'tool' : {'driver' : {'name' : 'cq', 'rules' : [
+                {'id' : 'cred_a', 'shortDescription' : {'text' : 'a+'}, 'properties' : {'tags' : ['secret']}},
+                {'id' : 'noise', 'shortDescription' : {'text' : 'b+'}, 'properties' : {'tags' : []}}
+            ]}},
+            'results' : [
+                {'ruleId' : 'noise', 'locations' : [{'physicalLocation' : {'artifactLocation' : {'uri' : 'x.txt'}, 'region' : {'startLine' : 1, 'endLine' : 1, 'snippet' : {'text' : 'bbb'}}}}]},
+                {'ruleId' : 'cred_a', 'locations' : [{'physicalLocation' : {'artifactLocation' : {'uri' : 'x.txt'}, 'region' : {'startLine' : 2, 'endLine' : 2, 'snippet' : {'text' : 'aaa'}}}}]},
+                {'ruleId' : 'unknown', 'locations' : [{'physicalLocation' : {'artifactLocation' : {'uri' : 'y.txt'}, 'region' : {'startLine' : 3, 'endLine' : 3, 'snippet' : {'text' : 'ccc'}}}}]}
+            ]
+        },
+        {
+            'results' : [12345, {'ruleId' : 'second'}],
+            'tool' : {'driver' : {'name' : 'gitleaks'}}
+        }
+    ]
+}
+
+class TestSarifStream(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp(suffix='.sarif')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(SARIF_DOC, f, indent=2)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_json_stream_reader_with_small_chunks_should_read_same_values_as_json_load(self):
+        reader = JsonStreamReader(io.StringIO(json.dumps(SARIF_DOC, indent=1)), chunk_size=3)
+        values = {}
+        for key in reader.iter_object():
+            if key == 'runs':
+                values[key] = []
+                for _ in reader.iter_array():
+                    run = {}
+                    for run_key in reader.iter_object():
+                        run[run_key] = list(reader.iter_array_values()) if run_key == 'results' else reader.read_value()
+                    values[key].append(run)
+            else:
+                values[key] = reader.read_value()
+        assert values == SARIF_DOC
+
+    def test_load_sarif_stream_should_read_run_metadata_without_results(self):
+        sarif = load_sarif_stream(self.path)
+        assert [run.get_tool_name() for run in sarif.runs] == ['cq', 'gitleaks']
+        assert 'results' not in sarif.runs[0].run_data
+        assert sarif.runs[1].run_data['tool'] == SARIF_DOC['runs'][1]['tool']
+
+    def test_sarif_stream_run_get_results_should_stream_results_of_that_run_only(self):
+        sarif = load_sarif_stream(self.path)
+        assert list(sarif.runs[0].get_results()) == SARIF_DOC['runs'][0]['results']
+        assert list(sarif.runs[1].get_results()) == SARIF_DOC['runs'][1]['results']
+
+    def test_collect_results_should_drop_results_for_non_secret_rules(self):
+        sarif = load_sarif_stream(self.path)
+        targets = RedactionTargets()
+        collect_results(TOOL_NAME_TRIVY, self.path, '', targets, DEFAULT_PLACEHOLDER_FORMAT, sarif.runs[0])
+        entries = dict((target.artifact_path, target.entries) for target in targets)
+        assert [e.sarif_result.rule_id for e in entries['x.txt']] == ['cred_a']
+        assert [e.sarif_result.rule_id for e in entries['y.txt']] == ['unknown']
+        assert entries['y.txt'][0].rule is None
@@ -1,10 +1,12 @@
 import os
 import shutil
+import tempfile
 import unittest
+import zipfile
 
 from parameterized import parameterized
 
-from secretscrub import main as secretscrub_main, DEFAULT_PLACEHOLDER_FORMAT
+from secretscrub import main as secretscrub_main, build_incremental_settings, DEFAULT_PLACEHOLDER_FORMAT
 from secretscrub_report import SecretScrubReportEncryption
 
 from .testutil import scan_folder_for_redacted_secrets
@@ -20,6 +22,18 @@ class Args:
         self.report = None
         self.report_encryption = SecretScrubReportEncryption.ZIP_AES256
         self.process_archives = False
+        self.scratch_dir = None
+        self.filetype_cache = None
+        self.jobs = 1
+        self.incremental = None
+        self.findings_cache = None
+        self.metrics = None
+        self.bindetect_sniff_max_size = 1024 * 1024
+        self.bindetect_sniff = False
+        self.metrics_format = 'json'
+        self.link_mode = 'copy'
+        self.max_concurrent_tools = None
+        self.tool_timeout = None
 
 class TestMain(unittest.TestCase):
 
@@ -53,6 +67,139 @@ class TestMain(unittest.TestCase):
         detected_secrets = list(scan_folder_for_redacted_secrets(outdir))
         assert len(detected_secrets) > 0
 
+    def test_main_analysewith_bindetect_process_archives_should_redact_inside_archive_without_modifying_source(self):
+        srcdir = tempfile.mkdtemp()
+        outdir = tempfile.mkdtemp()
+        try:
+            keystore_path = os.path.join(os.path.dirname(__file__), 'data', 'bin', '001', 'check.keystore')
+            archive_path = os.path.join(srcdir, 'lib', 'app.jar')
+            os.makedirs(os.path.dirname(archive_path))
+            with zipfile.ZipFile(archive_path, 'w') as archive:
+                archive.write(keystore_path, 'conf/check.keystore')
+                archive.writestr('readme.txt', 'hello')
+            with open(archive_path, 'rb') as f:
+                archive_bytes = f.read()
+
+            args = Args()
+            args.analyse_with = 'bindetect'
+            args.process_archives = True
+            args.srcdir = srcdir
+            args.outdir = outdir
+            secretscrub_main(args)
+
+            assert os.listdir(os.path.join(srcdir, 'lib')) == ['app.jar']
+            with open(archive_path, 'rb') as f:
+                assert f.read() == archive_bytes
+            with zipfile.ZipFile(os.path.join(outdir, 'lib', 'app.jar')) as archive:
+                assert archive.read('conf/check.keystore').startswith(b'[REDACTED SECRET')
+                assert archive.read('readme.txt') == b'hello'
+        finally:
+            shutil.rmtree(srcdir)
+            shutil.rmtree(outdir)
+
+    def test_main_process_archives_should_copy_unmodified_archives_unchanged(self):
+        srcdir = tempfile.mkdtemp()
+        outdir = tempfile.mkdtemp()
+        try:
+            keystore_path = os.path.join(os.path.dirname(__file__), 'data', 'bin', '001', 'check.keystore')
+            with zipfile.ZipFile(os.path.join(srcdir, 'dirty.jar'), 'w') as archive:
+                archive.write(keystore_path, 'check.keystore')
+            with zipfile.ZipFile(os.path.join(srcdir, 'clean.jar'), 'w', zipfile.ZIP_STORED) as archive:
+                archive.writestr('readme.txt', 'hello')
+                archive.comment = b'not preserved by repacking'
+            with open(os.path.join(srcdir, 'clean.jar'), 'rb') as f:
+                clean_bytes = f.read()
+
+            args = Args()
+            args.analyse_with = 'bindetect'
+            args.process_archives = True
+            args.srcdir = srcdir
+            args.outdir = outdir
+            secretscrub_main(args)
+
+            assert sorted(os.listdir(outdir)) == ['clean.jar', 'dirty.jar']
+            with open(os.path.join(outdir, 'clean.jar'), 'rb') as f:
+                assert f.read() == clean_bytes
+            with zipfile.ZipFile(os.path.join(outdir, 'dirty.jar')) as archive:
+                assert archive.read('check.keystore').startswith(b'[REDACTED SECRET')
+        finally:
+            shutil.rmtree(srcdir)
+            shutil.rmtree(outdir)
+
+    def test_main_incremental_should_only_reprocess_changed_files(self):
+        srcdir = tempfile.mkdtemp()
+        outdir = tempfile.mkdtemp()
+        statedir = tempfile.mkdtemp()
+        try:
+            shutil.copy(os.path.join(os.path.dirname(__file__), 'data', 'bin', '001', 'check.keystore'), srcdir)
+            with open(os.path.join(srcdir, 'readme.txt'), 'w') as f:
+                f.write('hello')
+
+            args = Args()
+            args.analyse_with = 'bindetect'
+            args.srcdir = srcdir
+            args.outdir = outdir
+            args.incremental = os.path.join(statedir, 'state.json')
+            args.report_encryption = SecretScrubReportEncryption.NONE
+            reports = []
+            for run in range(3):
+                if run == 2:
+                    with open(os.path.join(srcdir, 'readme.txt'), 'w') as f:
+                        f.write('hello again')
+                args.report = os.path.join(statedir, f'report-{run}.csv')
+                secretscrub_main(args)
+                with open(args.report, 'r') as f:
+                    reports.append(f.read())
+                if run == 0:
+                    keystore_mtime = os.stat(os.path.join(outdir, 'check.keystore')).st_mtime_ns
+
+            assert os.stat(os.path.join(outdir, 'check.keystore')).st_mtime_ns == keystore_mtime
+            with open(os.path.join(outdir, 'readme.txt'), 'r') as f:
+                assert f.read() == 'hello again'
+            # Rows reused from the state file do not have their content, which is never persisted.
+            assert 'check.keystore' in reports[1]
+            assert reports[1] == reports[2]
+        finally:
+            shutil.rmtree(srcdir)
+            shutil.rmtree(outdir)
+            shutil.rmtree(statedir)
+
+    def test_incremental_settings_should_change_with_bindetect_sniff_options(self):
+        args = Args()
+        args.analyse_with = 'bindetect'
+        settings = build_incremental_settings(args)
+        args.bindetect_sniff = True
+        sniff_settings = build_incremental_settings(args)
+        args.bindetect_sniff_max_size = 0
+        assert len({str(settings), str(sniff_settings), str(build_incremental_settings(args))}) == 3
+
+    def test_main_incremental_should_report_unchanged_unextractable_archive_again(self):
+        srcdir = tempfile.mkdtemp()
+        outdir = tempfile.mkdtemp()
+        statedir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(srcdir, 'sub'))
+            with open(os.path.join(srcdir, 'sub', 'bad.zip'), 'wb') as f:
+                f.write(b'PK\x03\x04' + b'\x00' * 64)
+
+            args = Args()
+            args.srcdir = srcdir
+            args.outdir = outdir
+            args.process_archives = True
+            args.incremental = os.path.join(statedir, 'state.json')
+            args.report_encryption = SecretScrubReportEncryption.NONE
+            reports = []
+            for run in range(2):
+                args.report = os.path.join(statedir, f'report-{run}.csv')
+                secretscrub_main(args)
+                with open(args.report, 'r') as f:
+                    reports.append(f.read())
+
+            assert all('bad.zip' in report and 'ArchiveExtractionFailure' in report for report in reports)
+        finally:
+            shutil.rmtree(srcdir)
+            shutil.rmtree(outdir)
+            shutil.rmtree(statedir)
 
     def invoke_secretscrub(self, analyse_with, data_dir):
         srcdir = os.path.join(os.path.dirname(__file__), 'data', data_dir)
@@ -1,7 +1,18 @@
+import asyncio
+import errno
+import hashlib
+import io
 import logging
 import os
 import platform
+import shutil
 import subprocess
+import tempfile
+
+LINK_MODES = ['copy', 'reflink', 'hardlink', 'auto']
+
+# ioctl request number for FICLONE on Linux, from linux/fs.h
+FICLONE = 0x40049409
 
 def is_windows():
     return platform.system() == 'Windows'
@@ -25,3 +36,142 @@ def run_tool(exes, *args, **kwargs):
             return r
     else:
         raise(TypeError("Input 'exes' to run_tool must be a list or a string"))
+
+
+# Asynchronous equivalent of run_tool. The process is killed if the awaiting task is cancelled (e.g. because a
+# timeout expired or another tool failed), so no tool is left running in the background.
+async def run_tool_async(exes, *args, **kwargs):
+    if isinstance(exes, list):
+        for exe in exes:
+            try:
+                return await run_tool_async(exe, *args, **kwargs)
+            except FileNotFoundError as e:
+                logging.debug(f'Error running {exe}: {e}')
+        raise(FileNotFoundError('No executables were found'))
+    elif isinstance(exes, str):
+        cwd = kwargs['cwd'] if 'cwd' in kwargs else os.getcwd()
+        return_output = kwargs.get('return_output', False)
+        logging.debug(f"Launching command: {exes} with args [{args}]")
+        process = await asyncio.create_subprocess_exec(exes, *args, cwd=cwd, stdout=(asyncio.subprocess.PIPE if return_output else None))
+        try:
+            (stdout, _) = await process.communicate()
+        except BaseException:
+            if process.returncode is None:
+                logging.debug(f'Killing {exes} (pid {process.pid})')
+                process.kill()
+                await process.wait()
+            raise
+        if return_output:
+            return stdout.decode('utf-8')
+        else:
+            return subprocess.CompletedProcess([exes] + list(args), process.returncode, stdout)
+    else:
+        raise(TypeError("Input 'exes' to run_tool_async must be a list or a string"))
+
+
+# Run a tool, passing its standard output as a text stream to consume(), which runs on a worker thread and whose
+# result is returned along with the completed process. The output is never buffered in full: if the consumer
+# falls behind, the pipe fills and the tool blocks until the consumer catches up. As with run_tool_async, the
+# process is killed if the awaiting task is cancelled.
+async def run_tool_streamed(exes, *args, consume, **kwargs):
+    if isinstance(exes, list):
+        for exe in exes:
+            try:
+                return await run_tool_streamed(exe, *args, consume=consume, **kwargs)
+            except FileNotFoundError as e:
+                logging.debug(f'Error running {exe}: {e}')
+        raise(FileNotFoundError('No executables were found'))
+    elif isinstance(exes, str):
+        cwd = kwargs['cwd'] if 'cwd' in kwargs else os.getcwd()
+        logging.debug(f"Launching command: {exes} with args [{args}]")
+        process = subprocess.Popen([exes] + list(args), cwd=cwd, stdout=subprocess.PIPE)
+        try:
+            stdout = io.TextIOWrapper(process.stdout, encoding='utf-8', newline='\n')
+            result = await asyncio.to_thread(consume, stdout)
+            await asyncio.to_thread(process.wait)
+        except BaseException:
+            # Killing the tool also closes the pipe, so a consumer still running on its thread sees the end of the
+            # stream and finishes.
+            if process.poll() is None:
+                logging.debug(f'Killing {exes} (pid {process.pid})')
+                process.kill()
+                process.wait()
+            raise
+        stdout.close()
+        return (subprocess.CompletedProcess([exes] + list(args), process.returncode), result)
+    else:
+        raise(TypeError("Input 'exes' to run_tool_streamed must be a list or a string"))
+
+# Clone a file using a copy-on-write reflink. The clone shares data blocks with the original but is a separate
+# inode, so the two can subsequently be modified independently.
+def clone_file(src, dst):
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, 'Reflinks are not supported on this platform')
+    with open(src, 'rb') as fsrc, open(dst, 'xb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.unlink(dst)
+            raise
+    shutil.copystat(src, dst)
+
+# Places unmodified files into the output directory using the cheapest method permitted by the link mode, falling
+# back to a plain copy when a method turns out not to be supported. Once a method fails it is not attempted again.
+class FileLinker:
+    def __init__(self, link_mode = 'copy'):
+        if not link_mode in LINK_MODES:
+            raise ValueError(f'Unsupported link mode: {link_mode}')
+        self.use_reflink = link_mode in ['reflink', 'auto']
+        self.use_hardlink = link_mode in ['hardlink', 'auto']
+
+    def link(self, src, dst):
+        if self.use_reflink:
+            try:
+                clone_file(src, dst)
+                return 'reflink'
+            except OSError as e:
+                if e.errno in [errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS]:
+                    logging.info(f'Reflinks are not available ({e}). Falling back...')
+                    self.use_reflink = False
+                else:
+                    raise
+        if self.use_hardlink:
+            try:
+                os.link(src, dst)
+                return 'hardlink'
+            except OSError as e:
+                if e.errno in [errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP]:
+                    logging.info(f'Hard links are not available ({e}). Falling back...')
+                    self.use_hardlink = False
+                else:
+                    raise
+        shutil.copy2(src, dst)
+        return 'copy'
+
+# Move a file over the top of another, always replacing the destination's directory entry rather than writing
+# into the existing file. The destination may be a hard link to a source file, which must never be modified.
+def replace_file(src, dst):
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(dst)))
+        os.close(fd)
+        try:
+            shutil.copyfile(src, tmp_path)
+            os.replace(tmp_path, dst)
+        except:
+            os.unlink(tmp_path)
+            raise
+        os.unlink(src)
+
+def hash_file(path, algorithm = 'sha256'):
+    h = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
@@ -0,0 +1,75 @@
+import collections
+import logging
+import os
+import stat
+import time
+
+FILE_TYPE_FILE = 'file'
+FILE_TYPE_DIR = 'dir'
+FILE_TYPE_OTHER = 'other'
+
+# A single entry found while walking a tree. rel_path always uses '/' as the separator. As with os.walk,
+# symbolic links are followed when determining the type, size and modification time of an entry, but
+# linked directories are not descended into.
+InventoryEntry = collections.namedtuple('InventoryEntry', ['rel_path', 'path', 'file_type', 'size', 'mtime_ns', 'dev', 'inode'])
+
+# A record of every file and directory within a tree, made with a single walk so that each stage of processing
+# that needs to visit the whole tree does not have to walk it again. Entries are held in sorted path order.
+class Inventory:
+    def __init__(self, root, entries):
+        self.root = root
+        self.entries = entries
+
+    @classmethod
+    def scan(cls, root):
+        start_time = time.monotonic()
+        entries = []
+        pending = ['']
+        while pending:
+            rel_dir = pending.pop()
+            try:
+                with os.scandir(os.path.join(root, rel_dir)) as it:
+                    dir_entries = list(it)
+            except OSError as e:
+                logging.error(f'Error listing directory "{os.path.join(root, rel_dir)}": {e}')
+                continue
+            for dir_entry in dir_entries:
+                rel_path = f'{rel_dir}/{dir_entry.name}' if rel_dir else dir_entry.name
+                entry = make_entry(rel_path, dir_entry)
+                entries.append(entry)
+                if entry.file_type == FILE_TYPE_DIR and not dir_entry.is_symlink():
+                    pending.append(rel_path)
+        entries.sort(key=lambda e: e.rel_path)
+        inventory = cls(root, entries)
+        logging.info(f'Inventory of "{root}": {inventory.file_count()} files ({inventory.total_size()} bytes) in {time.monotonic() - start_time:.2f}s')
+        return inventory
+
+    # Whether this inventory describes the given directory, and so can be used in place of walking it.
+    def is_root(self, dir):
+        return dir is not None and os.path.normpath(os.path.abspath(dir)) == os.path.normpath(os.path.abspath(self.root))
+
+    def files(self):
+        return (entry for entry in self.entries if entry.file_type == FILE_TYPE_FILE)
+
+    def dirs(self):
+        return (entry for entry in self.entries if entry.file_type == FILE_TYPE_DIR)
+
+    def file_count(self):
+        return sum(1 for _ in self.files())
+
+    def total_size(self):
+        return sum(entry.size for entry in self.files())
+
+def make_entry(rel_path, dir_entry):
+    try:
+        st = dir_entry.stat()
+    except OSError:
+        # A broken symbolic link, or an entry that has disappeared since the directory was listed.
+        return InventoryEntry(rel_path, dir_entry.path, FILE_TYPE_OTHER, 0, 0, 0, 0)
+    if stat.S_ISDIR(st.st_mode):
+        file_type = FILE_TYPE_DIR
+    elif stat.S_ISREG(st.st_mode):
+        file_type = FILE_TYPE_FILE
+    else:
+        file_type = FILE_TYPE_OTHER
+    return InventoryEntry(rel_path, dir_entry.path, file_type, st.st_size, st.st_mtime_ns, st.st_dev, st.st_ino)